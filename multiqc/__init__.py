@@ -6,6 +6,7 @@ Initialises when multiqc module is loaded.
 
 Makes the following available under the main multiqc namespace:
 - run()
+- ReportContext, to make several reports at the same time in different threads
 - config
 - config.logger
 - __version__
@@ -15,6 +16,7 @@ import logging
 
 from .multiqc import run
 from .utils import config
+from .utils.context import ReportContext
 
 config.logger = logging.getLogger(__name__)
 
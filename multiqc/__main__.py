@@ -9,14 +9,22 @@ $ python -m multiqc .
 """
 
 
-import pkg_resources
+import sys
 
 from . import multiqc
+from .utils import registry
 
 
 def run_multiqc():
+    # 'multiqc serve' starts a report server instead
+    if sys.argv[1:2] == ["serve"]:
+        from . import serve
+
+        serve.serve_cli(args=sys.argv[2:], prog_name="multiqc serve")
+        return
+
     # Add any extra plugin command line options
-    for entry_point in pkg_resources.iter_entry_points("multiqc.cli_options.v1"):
+    for entry_point in registry.get_entry_points("multiqc.cli_options.v1"):
         opt_func = entry_point.load()
         multiqc.run_cli = opt_func(multiqc.run_cli)
     # Call the main function
@@ -23,7 +23,7 @@ log = logging.getLogger(__name__)
 # Load YAML as an ordered dict
 # From https://stackoverflow.com/a/21912744
 def yaml_ordered_load(stream):
-    class OrderedLoader(yaml.SafeLoader):
+    class OrderedLoader(config.YamlLoader):
         pass
 
     def construct_mapping(loader, node):
@@ -442,7 +442,7 @@ def _find_file_header(f):
         return None
     hconfig = None
     try:
-        hconfig = yaml.safe_load("\n".join(hlines))
+        hconfig = yaml.load("\n".join(hlines), Loader=config.YamlLoader)
         assert isinstance(hconfig, dict)
     except yaml.YAMLError as e:
         log.warning("Could not parse comment file header for MultiQC custom content: {}".format(f["fn"]))
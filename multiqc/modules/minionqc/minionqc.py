@@ -10,6 +10,7 @@ from collections import OrderedDict
 
 import yaml
 
+from multiqc import config
 from multiqc.modules.base_module import BaseMultiqcModule
 from multiqc.plots import linegraph, table
 
@@ -81,7 +82,7 @@ class MultiqcModule(BaseMultiqcModule):
                 return OrderedDict(loader.construct_pairs(node))
 
             yaml.add_constructor(yaml.resolver.BaseResolver.DEFAULT_MAPPING_TAG, dict_constructor)
-            summary_dict = yaml.safe_load(f)
+            summary_dict = yaml.load(f, Loader=config.YamlLoader)
         except Exception as e:
             log.error("Error parsing MinIONQC input file: {}".format(f))
             return
@@ -96,7 +96,7 @@ class MultiqcModule(BaseMultiqcModule):
         """
         # Load the YAML file
         try:
-            data = yaml.load(f["f"], Loader=yaml.SafeLoader)
+            data = yaml.load(f["f"], Loader=config.YamlLoader)
         except Exception as e:
             log.warning("Could not parse YAML for '{}': \n  {}".format(f, e))
             return
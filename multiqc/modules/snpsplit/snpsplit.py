@@ -58,7 +58,7 @@ class MultiqcModule(BaseMultiqcModule):
         self.add_data_source(f, s_name=s_name)
 
     def parse_new_snpsplit_log(self, f):
-        data = next(yaml.load_all(f["f"], Loader=yaml.SafeLoader))
+        data = next(yaml.load_all(f["f"], Loader=config.YamlLoader))
         flat_data = {}
         for k in data:
             for sk in data[k]:
@@ -18,8 +18,6 @@ import sys
 import tempfile
 import time
 import traceback
-from distutils import version
-from distutils.dir_util import copy_tree
 from urllib.request import urlopen
 
 import jinja2
@@ -27,13 +25,37 @@ import rich
 import rich_click as click
 from rich.syntax import Syntax
 
-from .plots import table
-from .utils import config, lint_helpers, log, megaqc, plugin_hooks, report, util_functions
+from .plots import flat_queue
+from .utils import config, context, lint_helpers, log, megaqc, module_outputs, plugin_hooks, report, util_functions
 
 # Set up logging
 start_execution_time = time.time()
 logger = config.logger
 
+
+class TemplateBytecodeCache(jinja2.BytecodeCache):
+    """
+    Keeps compiled report templates in memory, for when MultiQC is run more than once in the
+    same process. Templates are copied to a new temporary directory for every run, so the
+    cache key is only the template name. Jinja checks that the template source hasn't changed.
+    """
+
+    def __init__(self):
+        self.bytecode = dict()
+
+    def get_cache_key(self, name, filename=None):
+        return name
+
+    def load_bytecode(self, bucket):
+        if bucket.key in self.bytecode:
+            bucket.bytecode_from_string(self.bytecode[bucket.key])
+
+    def dump_bytecode(self, bucket):
+        self.bytecode[bucket.key] = bucket.bytecode_to_string()
+
+
+template_bytecode_cache = TemplateBytecodeCache()
+
 # Configuration for rich-click CLI help
 click.rich_click.USE_RICH_MARKUP = True
 click.rich_click.SHOW_METAVARS_COLUMN = False
@@ -112,6 +134,12 @@ click.rich_click.OPTION_GROUPS = {
                 "--quiet",
                 "--lint",
                 "--profile-runtime",
+                "--search-threads",
+                "--search-cache",
+                "--no-search-cache",
+                "--incremental",
+                "--parallel-modules",
+                "--parallel-plots",
                 "--no-megaqc-upload",
                 "--no-ansi",
                 "--version",
@@ -257,6 +285,44 @@ click.rich_click.OPTION_GROUPS = {
 @click.option("-v", "--verbose", count=True, default=0, help="Increase output verbosity.")
 @click.option("-q", "--quiet", is_flag=True, help="Only show log warnings")
 @click.option("--profile-runtime", is_flag=True, help="Add analysis of how long MultiQC takes to run to the report")
+@click.option(
+    "--search-threads",
+    "search_threads",
+    type=click.IntRange(min=1),
+    help="Number of threads to use when searching for files [i](default: 1)[/]",
+)
+@click.option(
+    "--search-cache",
+    "search_cache",
+    is_flag=True,
+    help="Reuse search results for unchanged files from previous runs",
+)
+@click.option(
+    "--no-search-cache",
+    "no_search_cache",
+    is_flag=True,
+    help="Search all files again, even if the search cache is enabled in a config file",
+)
+@click.option(
+    "--incremental",
+    is_flag=True,
+    help=(
+        "Reuse module results from the previous report in the output directory if their input files haven't changed. "
+        "Implies --force"
+    ),
+)
+@click.option(
+    "--parallel-modules",
+    "parallel_modules",
+    type=click.IntRange(min=1),
+    help="Number of processes to run modules in [i](default: 1)[/]",
+)
+@click.option(
+    "--parallel-plots",
+    "parallel_plots",
+    type=click.IntRange(min=1),
+    help="Number of processes to draw flat plots in [i](default: 1)[/]",
+)
 @click.option("--no-ansi", is_flag=True, help="Disable coloured log output")
 @click.option(
     "--custom-css-file",
@@ -327,6 +393,12 @@ def run(
     verbose=0,
     quiet=False,
     profile_runtime=False,
+    search_threads=None,
+    search_cache=False,
+    no_search_cache=False,
+    incremental=False,
+    parallel_modules=None,
+    parallel_plots=None,
     no_ansi=False,
     custom_css_files=(),
     **kwargs,
@@ -342,6 +414,9 @@ def run(
 
     See http://multiqc.info for more details.
 
+    To make several reports at the same time in different threads, call this
+    in a new multiqc.ReportContext in each thread.
+
     Author: Phil Ewels (http://phil.ewels.co.uk)
     """
 
@@ -383,6 +458,8 @@ def run(
         try:
             response = urlopen("http://multiqc.info/version.php?v={}".format(config.short_version), timeout=5)
             remote_version = response.read().decode("utf-8").strip()
+            from distutils import version
+
             if version.StrictVersion(re.sub("[^0-9\.]", "", remote_version)) > version.StrictVersion(
                 re.sub("[^0-9\.]", "", config.short_version)
             ):
@@ -455,6 +532,18 @@ def run(
         config.exclude_modules = exclude
     if profile_runtime:
         config.profile_runtime = True
+    if search_threads is not None:
+        config.search_threads = search_threads
+    if search_cache:
+        config.search_cache = True
+    if no_search_cache:
+        config.search_cache = False
+    if incremental:
+        config.incremental = True
+    if parallel_modules is not None:
+        config.parallel_modules = parallel_modules
+    if parallel_plots is not None:
+        config.parallel_plots = parallel_plots
     if no_ansi:
         config.no_ansi = True
     if custom_css_files:
@@ -641,7 +730,34 @@ def run(
     plugin_hooks.mqc_trigger("before_modules")
     report.modules_output = list()
     sys_exit_code = 0
+    incremental_cache = None
+    if config.incremental:
+        if config.data_dir is None:
+            logger.warning("Incremental mode needs a data directory to save module results, ignoring --incremental")
+        else:
+            # Overwrite the previous report, so that the results are saved where the next run looks for them
+            if not config.force:
+                logger.debug("Incremental mode: overwriting any previous report (--force)")
+                config.force = True
+            incremental_cache = module_outputs.IncrementalCache()
+    mod_cache_keys = [None] * len(run_modules)
+    if incremental_cache is not None:
+        mod_cache_keys = [incremental_cache.module_key(k, c or {}) for m in run_modules for k, c in m.items()]
     total_mods_starttime = time.time()
+    flat_queue.start()
+    # Start modules in worker processes if requested. Their output is added to the report in order below.
+    module_pool = None
+    parallel_outputs = dict()
+    if config.parallel_modules > 1 and len(run_modules) > 1:
+        module_pool = module_outputs.parallel_pool(config.parallel_modules, [k for m in run_modules for k in m])
+    if module_pool is not None:
+        logger.info("Running modules in {} processes".format(config.parallel_modules))
+        for mod_idx, mod_dict in enumerate(run_modules):
+            if incremental_cache is None or not incremental_cache.has(mod_cache_keys[mod_idx]):
+                for this_module, mod_cust_config in mod_dict.items():
+                    parallel_outputs[mod_idx] = module_pool.submit(
+                        module_outputs.run_module, this_module, mod_cust_config or {}
+                    )
     for mod_idx, mod_dict in enumerate(run_modules):
         mod_starttime = time.time()
         try:
@@ -649,11 +765,28 @@ def run(
             mod_cust_config = list(mod_dict.values())[0]
             if mod_cust_config is None:
                 mod_cust_config = {}
-            mod = config.avail_modules[this_module].load()
-            mod.mod_cust_config = mod_cust_config  # feels bad doing this, but seems to work
-            output = mod()
-            if type(output) != list:
-                output = [output]
+            mod_cache_key = mod_cache_keys[mod_idx]
+            saved_output = None
+            if incremental_cache is not None:
+                saved_output = incremental_cache.get(mod_cache_key)
+                if saved_output is not None:
+                    logger.info("Input files unchanged, reusing results from previous run: {}".format(this_module))
+            if saved_output is None and mod_idx in parallel_outputs:
+                saved_output = module_outputs.parallel_result(parallel_outputs.pop(mod_idx))
+                if saved_output is not None and incremental_cache is not None:
+                    incremental_cache.add(mod_cache_key, saved_output)
+            if saved_output is not None:
+                output = saved_output.restore()
+            else:
+                capture_start = module_outputs.start_capture() if incremental_cache is not None else None
+                mod = config.avail_modules[this_module].load()
+                mod.mod_cust_config = mod_cust_config  # feels bad doing this, but seems to work
+                output = mod()
+                if type(output) != list:
+                    output = [output]
+                if incremental_cache is not None:
+                    flat_queue.finish(output)
+                    incremental_cache.add(mod_cache_key, module_outputs.ModuleOutput(capture_start, output))
             for m in output:
                 report.modules_output.append(m)
 
@@ -687,6 +820,10 @@ def run(
         except UserWarning:
             logger.debug("No samples found: {}".format(list(mod_dict.keys())[0]))
         except KeyboardInterrupt:
+            if module_pool is not None:
+                for future in parallel_outputs.values():
+                    future.cancel()
+                module_pool.shutdown(wait=False)
             shutil.rmtree(tmp_dir)
             logger.critical(
                 "User Cancelled Execution!\n{eq}\n{tb}{eq}\n".format(eq=("=" * 60), tb=traceback.format_exc())
@@ -744,7 +881,15 @@ def run(
             sys_exit_code = 1
 
         report.runtimes["mods"][run_module_names[mod_idx]] = time.time() - mod_starttime
+    if module_pool is not None:
+        module_pool.shutdown()
+    # Put in the images of flat plots drawn in worker processes
+    flat_queue.finish(report.modules_output)
+    flat_queue.close()
     report.runtimes["total_mods"] = time.time() - total_mods_starttime
+    if incremental_cache is not None:
+        logger.debug("Reused results from previous run for {} modules".format(incremental_cache.num_reused))
+        incremental_cache.save()
 
     # Special-case module if we want to profile the MultiQC running time
     if config.profile_runtime:
@@ -838,6 +983,9 @@ def run(
 
     # Generate the General Statistics HTML & write to file
     if len(report.general_stats_data) > 0 and not config.skip_generalstats:
+        # Imported here as the plotting libraries are slow to load, and only needed if modules found data
+        from .plots import table
+
         pconfig = {
             "id": "general_stats_table",
             "table_title": "General Statistics",
@@ -859,7 +1007,19 @@ def run(
         # Compress the report plot JSON data
         runtime_compression_start = time.time()
         logger.info("Compressing plot data")
-        report.plot_compressed_json = report.compress_json(report.plot_data)
+        report.plot_data_compression = config.plot_data_compression
+        if report.plot_data_compression not in ["deflate", "lzstring"]:
+            logger.warning(
+                "Unknown plot_data_compression '{}', using 'lzstring'".format(config.plot_data_compression)
+            )
+            report.plot_data_compression = "lzstring"
+        plot_data_encoding = config.plot_data_encoding
+        if plot_data_encoding not in ["json", "float64", "float32"]:
+            logger.warning("Unknown plot_data_encoding '{}', using 'json'".format(config.plot_data_encoding))
+            plot_data_encoding = "json"
+        plot_data = report.encode_plot_data(report.plot_data, plot_data_encoding)
+        report.plot_compressed_data = report.compress_plot_data(plot_data, report.plot_data_compression)
+        report.plot_compressed_json = report.LegacyCompressedJson(report.plot_data)
         report.runtimes["total_compression"] = time.time() - runtime_compression_start
 
     plugin_hooks.mqc_trigger("before_report_generation")
@@ -937,8 +1097,7 @@ def run(
             logger.info("Data        : {}".format(os.path.relpath(config.data_dir)))
             # Modules have run, so data directory should be complete by now. Move its contents.
             logger.debug("Moving data file from '{}' to '{}'".format(config.data_tmp_dir, config.data_dir))
-            # Disable preserving of times and mode on purpose to avoid problems with mounted CIFS shares (see #625)
-            copy_tree(config.data_tmp_dir, config.data_dir, preserve_times=0, preserve_mode=0)
+            util_functions.copy_tree(config.data_tmp_dir, config.data_dir)
             shutil.rmtree(config.data_tmp_dir)
 
         # Copy across the static plot images if requested
@@ -957,8 +1116,7 @@ def run(
 
             # Modules have run, so plots directory should be complete by now. Move its contents.
             logger.debug("Moving plots directory from '{}' to '{}'".format(config.plots_tmp_dir, config.plots_dir))
-            # Disable preserving of times and mode on purpose to avoid problems with mounted CIFS shares (see #625)
-            copy_tree(config.plots_tmp_dir, config.plots_dir, preserve_times=0, preserve_mode=0)
+            util_functions.copy_tree(config.plots_tmp_dir, config.plots_dir)
             shutil.rmtree(config.plots_tmp_dir)
 
     plugin_hooks.mqc_trigger("before_template")
@@ -968,12 +1126,12 @@ def run(
         # Load in parent template files first if a child theme
         try:
             parent_template = config.avail_templates[template_mod.template_parent].load()
-            copy_tree(parent_template.template_dir, tmp_dir)
+            util_functions.copy_tree(parent_template.template_dir, tmp_dir)
         except AttributeError:
             pass  # Not a child theme
 
-        # Copy the template files to the tmp directory (distutils overwrites parent theme files)
-        copy_tree(template_mod.template_dir, tmp_dir)
+        # Copy the template files to the tmp directory (overwrites parent theme files)
+        util_functions.copy_tree(template_mod.template_dir, tmp_dir)
 
         # Function to include file contents in Jinja template
         def include_file(name, fdir=tmp_dir, b64=False):
@@ -991,7 +1149,7 @@ def run(
 
         # Load the report template
         try:
-            env = jinja2.Environment(loader=jinja2.FileSystemLoader(tmp_dir))
+            env = jinja2.Environment(loader=jinja2.FileSystemLoader(tmp_dir), bytecode_cache=template_bytecode_cache)
             env.globals["include_file"] = include_file
             j_template = env.get_template(template_mod.base_fn)
         except:
@@ -999,13 +1157,17 @@ def run(
 
         # Use jinja2 to render the template and overwrite
         config.analysis_dir = [os.path.realpath(d) for d in config.analysis_dir]
-        report_output = j_template.render(report=report, config=config)
         if filename == "stdout":
+            report_output = j_template.render(report=report, config=config)
             print(report_output.encode("utf-8"), file=sys.stdout)
         else:
             try:
+                # Stream the rendered template to disk, instead of building the whole report in memory
                 with io.open(config.output_fn, "w", encoding="utf-8") as f:
-                    print(report_output, file=f)
+                    report_stream = j_template.stream(report=report, config=config)
+                    report_stream.enable_buffering(100)
+                    report_stream.dump(f)
+                    print("", file=f)
             except IOError as e:
                 raise IOError("Could not print report to '{}' - {}".format(config.output_fn, IOError(e)))
 
@@ -1014,7 +1176,7 @@ def run(
                 for f in template_mod.copy_files:
                     fn = os.path.join(tmp_dir, f)
                     dest_dir = os.path.join(os.path.dirname(config.output_fn), f)
-                    copy_tree(fn, dest_dir)
+                    util_functions.copy_tree(fn, dest_dir)
             except AttributeError:
                 pass  # No files to copy
 
@@ -1068,7 +1230,8 @@ def run(
     plugin_hooks.mqc_trigger("execution_finish")
 
     logger.info("MultiQC complete")
-    report.runtimes["total"] = time.time() - start_execution_time
+    ctx = context.get_context()
+    report.runtimes["total"] = time.time() - (start_execution_time if ctx is None else ctx.start_time)
     if config.profile_runtime:
         logger.info("Run took {:.2f} seconds".format(report.runtimes["total"]))
         logger.info(" - {:.2f}s: Searching files".format(report.runtimes["total_sp"]))
@@ -1104,4 +1267,7 @@ def run(
     # * config instance
     # * appropriate error code (eg. 1 if a module broke, 0 on success)
     #
+    # In a ReportContext, these are the report and config of the context, which can be used from any thread
+    if ctx is not None:
+        return {"report": ctx.report, "config": ctx.config, "sys_exit_code": sys_exit_code}
     return {"report": report, "config": config, "sys_exit_code": sys_exit_code}
@@ -3,48 +3,31 @@
 """ MultiQC functions to plot a bargraph """
 
 
-import base64
 import inspect
-import io
 import logging
 import math
 import os
 import random
 import re
-import sys
 from collections import OrderedDict
 
+from multiqc.plots import flat_queue
 from multiqc.utils import config, report, util_functions
 
 logger = logging.getLogger(__name__)
 
-try:
-    # Import matplot lib but avoid default X environment
-    import matplotlib
-
-    matplotlib.use("Agg")
-    import matplotlib.pyplot as plt
-
-    logger.debug("Using matplotlib version {}".format(matplotlib.__version__))
-except Exception as e:
-    # MatPlotLib can break in a variety of ways. Fake an error message and continue without it if so.
-    # The lack of the library will be handled when plots are attempted
-    print("##### ERROR! MatPlotLib library could not be loaded!    #####", file=sys.stderr)
-    print("##### Flat plots will instead be plotted as interactive #####", file=sys.stderr)
-    print(e)
-
 letters = "abcdefghijklmnopqrstuvwxyz"
 
 # Load the template so that we can access its configuration
 # Do this lazily to mitigate import-spaghetti when running unit tests
-_template_mod = None
+# Each template is loaded once, runs in different ReportContexts can use different templates
+_template_mods = dict()
 
 
 def get_template_mod():
-    global _template_mod
-    if not _template_mod:
-        _template_mod = config.avail_templates[config.template].load()
-    return _template_mod
+    if config.template not in _template_mods:
+        _template_mods[config.template] = config.avail_templates[config.template].load()
+    return _template_mods[config.template]
 
 
 def plot(data, cats=None, pconfig=None):
@@ -57,6 +40,7 @@ def plot(data, cats=None, pconfig=None):
     :param pconfig: optional dict with config key:value pairs
     :return: HTML and JS, ready to be inserted into the page
     """
+    import numpy as np
 
     if pconfig is None:
         pconfig = {}
@@ -144,35 +128,26 @@ def plot(data, cats=None, pconfig=None):
             hc_samples = list(d.keys())
         else:
             hc_samples = sorted(list(d.keys()))
+        values, given = bar_matrix(d, hc_samples, list(cats[idx].keys()))
+
+        # Count the values in each category, and find the largest (missing values are NaN)
+        cat_counts = given.sum(axis=0).tolist()
+        cat_max = np.fmax.reduce(values, axis=0, initial=-np.inf).tolist()
+
+        # Remove empty samples
+        keep_samples = given.any(axis=1)
+        values = values[keep_samples]
+        hc_samples = [s for s, keep in zip(hc_samples, keep_samples.tolist()) if keep]
+
         hc_data = list()
-        sample_dcount = dict()
-        for c in cats[idx].keys():
-            thisdata = list()
-            catcount = 0
-            for s in hc_samples:
-                if s not in sample_dcount:
-                    sample_dcount[s] = 0
-                try:
-                    thisdata.append(float(d[s][c]))
-                    catcount += 1
-                    sample_dcount[s] += 1
-                except (KeyError, ValueError):
-                    # Pad with NaNs when we have missing categories in a sample
-                    thisdata.append(float("nan"))
-            if catcount > 0:
-                if pconfig.get("hide_zero_cats", True) is False or max(x for x in thisdata if not math.isnan(x)) > 0:
-                    thisdict = {"name": cats[idx][c]["name"], "data": thisdata}
+        for cidx, c in enumerate(cats[idx].keys()):
+            if cat_counts[cidx] > 0:
+                if pconfig.get("hide_zero_cats", True) is False or cat_max[cidx] > 0:
+                    thisdict = {"name": cats[idx][c]["name"], "data": values[:, cidx].tolist()}
                     if "color" in cats[idx][c]:
                         thisdict["color"] = cats[idx][c]["color"]
                     hc_data.append(thisdict)
 
-        # Remove empty samples
-        for s, c in sample_dcount.items():
-            if c == 0:
-                idx = hc_samples.index(s)
-                del hc_samples[idx]
-                for j, d in enumerate(hc_data):
-                    del hc_data[j]["data"][idx]
         if len(hc_data) > 0:
             plotsamples.append(hc_samples)
             plotdata.append(hc_data)
@@ -207,6 +182,38 @@ def plot(data, cats=None, pconfig=None):
             return highcharts_bargraph(plotdata, plotsamples, pconfig)
 
 
+def bar_value(sample_data, cat):
+    try:
+        return sample_data[cat]
+    except KeyError:
+        return None
+
+
+def bar_matrix(d, samples, cats):
+    """Values of a bar graph dataset as a float array of samples x categories,
+    with NaN for missing values, and a mask of the values that were given"""
+    import numpy as np
+
+    rows = list()
+    for s in samples:
+        if type(d[s]) is dict or type(d[s]) is OrderedDict:
+            rows.append([d[s].get(c) for c in cats])
+        else:
+            # Other mappings, eg. defaultdict, may have values for keys that are not in them yet
+            rows.append([bar_value(d[s], c) for c in cats])
+    rows = np.array(rows, dtype=object).reshape(len(samples), len(cats))
+    try:
+        values = rows.astype(float)
+    except (TypeError, ValueError):
+        values = np.full(rows.shape, np.nan)
+        for i, j in zip(*np.nonzero(rows != None)):
+            try:
+                values[i, j] = float(rows[i, j])
+            except (TypeError, ValueError):
+                rows[i, j] = None
+    return values, rows != None
+
+
 def highcharts_bargraph(plotdata, plotsamples=None, pconfig=None):
     """
     Build the HTML needed for a HighCharts bar graph. Should be
@@ -308,6 +315,7 @@ def matplotlib_bargraph(plotdata, plotsamples, pconfig=None):
     encoded image within HTML or writes the plot and links to it. Should be called by
     plot_bargraph, which properly formats the input data.
     """
+    import numpy as np
 
     if pconfig is None:
         pconfig = {}
@@ -337,20 +345,6 @@ def matplotlib_bargraph(plotdata, plotsamples, pconfig=None):
     )
     html += '<div class="mqc_mplplot_plotgroup" id="{}">'.format(pconfig["id"])
 
-    # Same defaults as HighCharts for consistency
-    default_colors = [
-        "#7cb5ec",
-        "#434348",
-        "#90ed7d",
-        "#f7a35c",
-        "#8085e9",
-        "#f15c80",
-        "#e4d354",
-        "#2b908f",
-        "#f45b5b",
-        "#91e8e1",
-    ]
-
     # Counts / Percentages Switch
     if pconfig.get("cpswitch") is not False and not config.simple_output:
         if pconfig.get("cpswitch_c_active", True) is True:
@@ -406,8 +400,17 @@ def matplotlib_bargraph(plotdata, plotsamples, pconfig=None):
             plot_pcts = [False, True]
 
         # Switch out NaN for 0s so that MatPlotLib doesn't ignore stuff
+        # Series shorter than the number of samples are padded with 0s
+        counts = np.zeros((len(pdata), len(plotsamples[pidx])))
         for idx, d in enumerate(pdata):
-            pdata[idx]["data"] = [x if not math.isnan(x) else 0 for x in d["data"]]
+            series = np.array(d["data"][: counts.shape[1]], dtype=float)
+            counts[idx, : len(series)] = np.where(np.isnan(series), 0, series)
+            pdata[idx]["data"] = counts[idx, : len(d["data"])].tolist()
+
+        # Count totals for each sample, for percentages
+        s_totals = counts.sum(axis=0)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            percentages = np.where(s_totals == 0, 0, counts / s_totals * 100)
 
         for plot_pct in plot_pcts:
 
@@ -422,143 +425,18 @@ def matplotlib_bargraph(plotdata, plotsamples, pconfig=None):
                 if pconfig.get("cpswitch_c_active", True) is not True:
                     hide_plot = True
 
-            # Set up figure
-
-            # Height has a default, then adjusted by the number of samples
-            plt_height = len(plotsamples[pidx]) / 2.3  # Default in inches, empirically determined
-            plt_height = max(6, plt_height)  # At least 6" tall
-            plt_height = min(30, plt_height)  # Cap at 30" tall
-
-            # Use fixed height if pconfig['height'] is set (convert pixels -> inches)
-            if "height" in pconfig:
-                # Default interactive height in pixels = 512
-                # Not perfect replication, but good enough
-                plt_height = 6 * (pconfig["height"] / 512)
-
-            bar_width = 0.8
-
-            fig = plt.figure(figsize=(14, plt_height), frameon=False)
-            axes = fig.add_subplot(111)
-            y_ind = range(len(plotsamples[pidx]))
-
-            # Count totals for each sample
-            if plot_pct is True:
-                s_totals = [0 for _ in pdata[0]["data"]]
-                for series_idx, d in enumerate(pdata):
-                    for sample_idx, v in enumerate(d["data"]):
-                        s_totals[sample_idx] += v
-
-            # Plot bars
-            dlabels = []
-            prev_values = None
-            for idx, d in enumerate(pdata):
-                # Plot percentages
-                values = [x for x in d["data"]]
-                if len(values) < len(y_ind):
-                    values.extend([0] * (len(y_ind) - len(values)))
-                if plot_pct is True:
-                    for (key, var) in enumerate(values):
-                        s_total = s_totals[key]
-                        if s_total == 0:
-                            values[key] = 0
-                        else:
-                            values[key] = (float(var + 0.0) / float(s_total)) * 100
-
-                # Get offset for stacked bars
-                if idx == 0:
-                    prevdata = [0] * len(plotsamples[pidx])
-                else:
-                    for i, p in enumerate(prevdata):
-                        prevdata[i] += prev_values[i]
-                # Default colour index
-                cidx = idx
-                while cidx >= len(default_colors):
-                    cidx -= len(default_colors)
-                # Save the name of this series
-                dlabels.append(d["name"])
-                # Add the series of bars to the plot
-                axes.barh(
-                    y_ind,
-                    values,
-                    bar_width,
-                    left=prevdata,
-                    color=d.get("color", default_colors[cidx]),
-                    align="center",
-                    linewidth=pconfig.get("borderWidth", 0),
-                )
-                prev_values = values
-
-            # Tidy up axes
-            axes.tick_params(
-                labelsize=pconfig.get("labelSize", 8), direction="out", left=False, right=False, top=False, bottom=False
-            )
-            axes.set_xlabel(pconfig.get("ylab", ""))  # I know, I should fix the fact that the config is switched
-            axes.set_ylabel(pconfig.get("xlab", ""))
-            axes.set_yticks(y_ind)  # Specify where to put the labels
-            axes.set_yticklabels(plotsamples[pidx])  # Set y axis sample name labels
-            axes.set_ylim((-0.5, len(y_ind) - 0.5))  # Reduce padding around plot area
-            if plot_pct is True:
-                axes.set_xlim((0, 100))
-                # Add percent symbols
-                vals = axes.get_xticks()
-                axes.set_xticks(axes.get_xticks())
-                axes.set_xticklabels(["{:.0f}%".format(x) for x in vals])
-            else:
-                default_xlimits = axes.get_xlim()
-                axes.set_xlim((pconfig.get("ymin", default_xlimits[0]), pconfig.get("ymax", default_xlimits[1])))
-            if "title" in pconfig:
-                top_gap = 1 + (0.5 / plt_height)
-                plt.text(
-                    0.5, top_gap, pconfig["title"], horizontalalignment="center", fontsize=16, transform=axes.transAxes
-                )
-            axes.grid(True, zorder=0, which="both", axis="x", linestyle="-", color="#dedede", linewidth=1)
-            axes.set_axisbelow(True)
-            axes.spines["right"].set_visible(False)
-            axes.spines["top"].set_visible(False)
-            axes.spines["bottom"].set_visible(False)
-            axes.spines["left"].set_visible(False)
-            plt.gca().invert_yaxis()  # y axis is reverse sorted otherwise
-
-            # Hide some labels if we have a lot of samples
-            show_nth = max(1, math.ceil(len(pdata[0]["data"]) / 150))
-            for idx, label in enumerate(axes.get_yticklabels()):
-                if idx % show_nth != 0:
-                    label.set_visible(False)
-
-            # Legend
-            bottom_gap = -1 * (1 - ((plt_height - 1.5) / plt_height))
-            lgd = axes.legend(
-                dlabels,
-                loc="lower center",
-                bbox_to_anchor=(0, bottom_gap, 1, 0.102),
-                ncol=5,
-                mode="expand",
-                fontsize=pconfig.get("labelSize", 8),
-                frameon=False,
-            )
-
             # Should this plot be hidden on report load?
             hidediv = ""
             if pidx > 0 or hide_plot:
                 hidediv = ' style="display:none;"'
 
-            # Save the plot to the data directory if export is requested
-            if config.export_plots:
-                for fformat in config.export_plot_formats:
-                    # Make the directory if it doesn't already exist
-                    plot_dir = os.path.join(config.plots_dir, fformat)
-                    if not os.path.exists(plot_dir):
-                        os.makedirs(plot_dir)
-                    # Save the plot
-                    plot_fn = os.path.join(plot_dir, "{}.{}".format(pid, fformat))
-                    fig.savefig(plot_fn, format=fformat, bbox_extra_artists=(lgd,), bbox_inches="tight")
-
-            # Output the figure to a base64 encoded string
-            if getattr(get_template_mod(), "base64_plots", True) is True:
-                img_buffer = io.BytesIO()
-                fig.savefig(img_buffer, format="png", bbox_inches="tight")
-                b64_img = base64.b64encode(img_buffer.getvalue()).decode("utf8")
-                img_buffer.close()
+            # Draw the figure, and save it if export is requested
+            values = percentages if plot_pct is True else counts
+            base64_plot = getattr(get_template_mod(), "base64_plots", True) is True
+            b64_img = flat_queue.render(
+                bargraph_figure, (pdata, plotsamples[pidx], values, plot_pct, pconfig), pid, base64_plot
+            )
+            if base64_plot:
                 html += '<div class="mqc_mplplot" id="{}"{}><img src="data:image/png;base64,{}" /></div>'.format(
                     pid, hidediv, b64_img
                 )
@@ -568,9 +446,119 @@ def matplotlib_bargraph(plotdata, plotsamples, pconfig=None):
                 plot_relpath = os.path.join(config.plots_dir_name, "png", "{}.png".format(pid))
                 html += '<div class="mqc_mplplot" id="{}"{}><img src="{}" /></div>'.format(pid, hidediv, plot_relpath)
 
-            plt.close(fig)
-
     # Close wrapping div
     html += "</div>"
 
     return html
+
+
+def bargraph_figure(pdata, samples, values, plot_pct, pconfig):
+    """Draw a MatPlotLib bar graph of one dataset, with a row of values for each series.
+    Returns the figure and legend, run by flat_queue.render()"""
+    import numpy as np
+
+    plt = flat_queue.pyplot()
+
+    # Same defaults as HighCharts for consistency
+    default_colors = [
+        "#7cb5ec",
+        "#434348",
+        "#90ed7d",
+        "#f7a35c",
+        "#8085e9",
+        "#f15c80",
+        "#e4d354",
+        "#2b908f",
+        "#f45b5b",
+        "#91e8e1",
+    ]
+
+    # Set up figure
+
+    # Height has a default, then adjusted by the number of samples
+    plt_height = len(samples) / 2.3  # Default in inches, empirically determined
+    plt_height = max(6, plt_height)  # At least 6" tall
+    plt_height = min(30, plt_height)  # Cap at 30" tall
+
+    # Use fixed height if pconfig['height'] is set (convert pixels -> inches)
+    if "height" in pconfig:
+        # Default interactive height in pixels = 512
+        # Not perfect replication, but good enough
+        plt_height = 6 * (pconfig["height"] / 512)
+
+    bar_width = 0.8
+
+    fig = plt.figure(figsize=(14, plt_height), frameon=False)
+    axes = fig.add_subplot(111)
+    y_ind = range(len(samples))
+
+    # Plot bars, stacking each series on the sum of the previous ones
+    offsets = np.zeros(values.shape)
+    offsets[1:] = np.cumsum(values, axis=0)[:-1]
+    dlabels = []
+    for idx, d in enumerate(pdata):
+        # Default colour index
+        cidx = idx
+        while cidx >= len(default_colors):
+            cidx -= len(default_colors)
+        # Save the name of this series
+        dlabels.append(d["name"])
+        # Add the series of bars to the plot
+        axes.barh(
+            y_ind,
+            values[idx],
+            bar_width,
+            left=offsets[idx],
+            color=d.get("color", default_colors[cidx]),
+            align="center",
+            linewidth=pconfig.get("borderWidth", 0),
+        )
+
+    # Tidy up axes
+    axes.tick_params(
+        labelsize=pconfig.get("labelSize", 8), direction="out", left=False, right=False, top=False, bottom=False
+    )
+    axes.set_xlabel(pconfig.get("ylab", ""))  # I know, I should fix the fact that the config is switched
+    axes.set_ylabel(pconfig.get("xlab", ""))
+    axes.set_yticks(y_ind)  # Specify where to put the labels
+    axes.set_yticklabels(samples)  # Set y axis sample name labels
+    axes.set_ylim((-0.5, len(y_ind) - 0.5))  # Reduce padding around plot area
+    if plot_pct is True:
+        axes.set_xlim((0, 100))
+        # Add percent symbols
+        vals = axes.get_xticks()
+        axes.set_xticks(axes.get_xticks())
+        axes.set_xticklabels(["{:.0f}%".format(x) for x in vals])
+    else:
+        default_xlimits = axes.get_xlim()
+        axes.set_xlim((pconfig.get("ymin", default_xlimits[0]), pconfig.get("ymax", default_xlimits[1])))
+    if "title" in pconfig:
+        top_gap = 1 + (0.5 / plt_height)
+        plt.text(0.5, top_gap, pconfig["title"], horizontalalignment="center", fontsize=16, transform=axes.transAxes)
+    axes.grid(True, zorder=0, which="both", axis="x", linestyle="-", color="#dedede", linewidth=1)
+    axes.set_axisbelow(True)
+    axes.spines["right"].set_visible(False)
+    axes.spines["top"].set_visible(False)
+    axes.spines["bottom"].set_visible(False)
+    axes.spines["left"].set_visible(False)
+    plt.gca().invert_yaxis()  # y axis is reverse sorted otherwise
+
+    # Hide some labels if we have a lot of samples
+    show_nth = max(1, math.ceil(len(pdata[0]["data"]) / 150))
+    for idx, label in enumerate(axes.get_yticklabels()):
+        if idx % show_nth != 0:
+            label.set_visible(False)
+
+    # Legend
+    bottom_gap = -1 * (1 - ((plt_height - 1.5) / plt_height))
+    lgd = axes.legend(
+        dlabels,
+        loc="lower center",
+        bbox_to_anchor=(0, bottom_gap, 1, 0.102),
+        ncol=5,
+        mode="expand",
+        fontsize=pconfig.get("labelSize", 8),
+        frameon=False,
+    )
+
+    return fig, (lgd,)
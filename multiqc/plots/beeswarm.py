@@ -68,16 +68,12 @@ def make_plot(dt):
             # Add the data
             thisdata = []
             these_snames = []
-            for (s_name, samp) in dt.data[idx].items():
-                if k in samp:
+            for s_name, val in dt.columns[idx][k].items():
+                if "modify" in header and callable(header["modify"]):
+                    val = header["modify"](val)
 
-                    val = samp[k]
-
-                    if "modify" in header and callable(header["modify"]):
-                        val = header["modify"](val)
-
-                    thisdata.append(val)
-                    these_snames.append(s_name)
+                thisdata.append(val)
+                these_snames.append(s_name)
 
             data.append(thisdata)
             s_names.append(these_snames)
@@ -9,35 +9,23 @@ import io
 import os
 
 from collections import OrderedDict
+from multiqc.plots import flat_queue
 from multiqc.utils import config, report
 
 logger = logging.getLogger(__name__)
 
-try:
-    # Import matplot lib but avoid default X environment
-    import matplotlib
-    matplotlib.use('Agg')
-    import matplotlib.pyplot as plt
-    logger.debug("Using matplotlib version {}".format(matplotlib.__version__))
-except Exception as e:
-    # MatPlotLib can break in a variety of ways. Fake an error message and continue without it if so.
-    # The lack of the library will be handled when plots are attempted
-    print("##### ERROR! MatPlotLib library could not be loaded!    #####", file=sys.stderr)
-    print("##### Flat plots will instead be plotted as interactive #####", file=sys.stderr)
-    print(e)
-
 letters = 'abcdefghijklmnopqrstuvwxyz'
 
 # Load the template so that we can access its configuration
 # Do this lazily to mitigate import-spaghetti when running unit tests
-_template_mod = None
+# Each template is loaded once, runs in different ReportContexts can use different templates
+_template_mods = dict()
 
 
 def get_template_mod():
-    global _template_mod
-    if not _template_mod:
-        _template_mod = config.avail_templates[config.template].load()
-    return _template_mod
+    if config.template not in _template_mods:
+        _template_mods[config.template] = config.avail_templates[config.template].load()
+    return _template_mods[config.template]
 
 
 def plot(data, pconfig=None):
@@ -80,6 +68,15 @@ def matplotlib_boxplot(plotdata, pconfig=None):
     encoded image within HTML or writes the plot and links to it. Should be called by
     plot_bargraph, which properly formats the input data.
     """
+    flat_queue.pyplot()
+    # Reports made in other threads draw their figures with the same pyplot
+    with flat_queue.pyplot_lock:
+        return draw_matplotlib_boxplot(plotdata, pconfig)
+
+
+def draw_matplotlib_boxplot(plotdata, pconfig=None):
+    plt = flat_queue.pyplot()
+
     if pconfig is None:
         pconfig = {}
 
@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+
+""" MultiQC queue for flat (MatPlotLib) plot images. With --parallel-plots, figures are
+drawn and saved in worker processes while modules carry on running. The plot HTML gets
+a placeholder for each image, which is replaced once all modules have finished. """
+
+import base64
+import concurrent.futures
+import io
+import itertools
+import logging
+import multiprocessing
+import os
+import re
+import sys
+import threading
+import types
+
+from multiqc.utils import config, context
+
+logger = logging.getLogger(__name__)
+
+# Worker process pool, created when the first plot is queued
+pool = None
+# Plots are only sent to worker processes between start() and close()
+active = False
+# Plots being drawn in worker processes: placeholder -> (future, job)
+pending = dict()
+placeholder_ids = itertools.count()
+
+# Each ReportContext has its own queue, so functions here use it through the module object
+flat_queue = context.context_module(__name__)
+
+
+def new_context_namespace():
+    return types.SimpleNamespace(pool=None, active=False, pending=dict(), placeholder_ids=itertools.count())
+
+
+placeholder_re = re.compile(r"mqc_flat_plot_placeholder_\d+")
+
+# pyplot has one current figure for the whole process, so reports made in different
+# threads take turns to draw their figures
+pyplot_lock = threading.RLock()
+
+
+def reset_pyplot_lock():
+    """New lock in a forked process, where the thread that held the lock no longer exists"""
+    global pyplot_lock
+    pyplot_lock = threading.RLock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=reset_pyplot_lock)
+
+
+def render(figure_fn, args, pid, base64_plot=True):
+    """
+    Draw a figure with figure_fn(*args), save it in the export formats and return it as
+    a base64 encoded PNG, or None if base64_plot is False. figure_fn must return the figure
+    and a list of artists to fit in exported images (or None).
+    If plots are drawn in worker processes, returns a placeholder for the base64 image
+    instead, which is replaced in the report HTML by finish().
+    """
+    # Load matplotlib here, so that plot functions can fall back to interactive plots if it fails
+    pyplot()
+    export_formats = config.export_plot_formats if config.export_plots else []
+    job = (figure_fn, args, pid, export_formats, config.plots_dir, base64_plot)
+    if get_pool() is None:
+        return render_figure(*job)
+    placeholder = "mqc_flat_plot_placeholder_{}".format(next(flat_queue.placeholder_ids))
+    flat_queue.pending[placeholder] = (flat_queue.pool.submit(render_figure, *job), job)
+    return placeholder
+
+
+def pyplot():
+    """
+    Import matplotlib.pyplot, without the default X environment. matplotlib is slow to import,
+    so it is only loaded when the first flat plot is drawn. It can also fail to load: plot
+    functions fall back to interactive plots if so.
+    """
+    if "matplotlib.pyplot" not in sys.modules:
+        try:
+            import matplotlib
+
+            matplotlib.use("Agg")
+            import matplotlib.pyplot
+
+            logger.debug("Using matplotlib version {}".format(matplotlib.__version__))
+        except Exception:
+            # MatPlotLib can break in a variety of ways
+            print("##### ERROR! MatPlotLib library could not be loaded!    #####", file=sys.stderr)
+            print("##### Flat plots will instead be plotted as interactive #####", file=sys.stderr)
+            raise
+    return sys.modules["matplotlib.pyplot"]
+
+
+def render_figure(figure_fn, args, pid, export_formats, plots_dir, base64_plot):
+    """Draw and save a figure, in the main process or a worker process"""
+    plt = pyplot()
+    with pyplot_lock:
+        fig, extra_artists = figure_fn(*args)
+        try:
+            # Save the plot to the data directory if export is requested
+            for fformat in export_formats:
+                # Make the directory if it doesn't already exist
+                plot_dir = os.path.join(plots_dir, fformat)
+                os.makedirs(plot_dir, exist_ok=True)
+                # Save the plot
+                plot_fn = os.path.join(plot_dir, "{}.{}".format(pid, fformat))
+                fig.savefig(plot_fn, format=fformat, bbox_extra_artists=extra_artists, bbox_inches="tight")
+
+            # Output the figure to a base64 encoded string
+            if base64_plot:
+                img_buffer = io.BytesIO()
+                fig.savefig(img_buffer, format="png", bbox_inches="tight")
+                b64_img = base64.b64encode(img_buffer.getvalue()).decode("utf8")
+                img_buffer.close()
+                return b64_img
+        finally:
+            plt.close(fig)
+
+
+def start():
+    """Draw plots in worker processes from now on, if --parallel-plots is set"""
+    flat_queue.active = True
+
+
+def get_pool():
+    """Process pool to draw plots in, or None to draw them in the main process"""
+    if flat_queue.pool is None and flat_queue.active and config.parallel_plots > 1:
+        # ProcessPoolExecutor only takes a start method (mp_context) from Python 3.7
+        if "fork" not in multiprocessing.get_all_start_methods() or sys.version_info < (3, 7):
+            logger.warning(
+                "Drawing plots in parallel is not supported on this platform or Python version, drawing them one by one"
+            )
+            config.parallel_plots = 1
+            return None
+        logger.info("Drawing flat plots in {} processes".format(config.parallel_plots))
+        flat_queue.pool = concurrent.futures.ProcessPoolExecutor(
+            config.parallel_plots, mp_context=multiprocessing.get_context("fork")
+        )
+    return flat_queue.pool
+
+
+def finish(modules):
+    """Wait for plots being drawn in worker processes and put their images into the modules' HTML"""
+    if not flat_queue.pending:
+        return
+    images = dict()
+    for placeholder, (future, job) in flat_queue.pending.items():
+        try:
+            images[placeholder] = future.result()
+        except Exception as e:
+            # Eg. the plot config can't be pickled: draw it here instead
+            logger.debug("Plot failed in worker process, drawing it again: {}".format(e))
+            try:
+                images[placeholder] = render_figure(*job)
+            except Exception as e:
+                # Too late to fall back to an interactive plot
+                logger.error("############### Error making MatPlotLib figure! Plot '{}' is missing.".format(job[2]))
+                logger.debug(e, exc_info=True)
+                images[placeholder] = ""
+    flat_queue.pending.clear()
+
+    def replace(html):
+        if isinstance(html, str) and "mqc_flat_plot_placeholder_" in html:
+            return placeholder_re.sub(lambda m: images.get(m.group(0), m.group(0)), html)
+        return html
+
+    for mod in modules:
+        for k, v in list(vars(mod).items()):
+            setattr(mod, k, replace(v))
+        for section in getattr(mod, "sections", []):
+            for k, v in section.items():
+                section[k] = replace(v)
+
+
+def close():
+    """Shut down the worker processes. Any later plots are drawn in the main process."""
+    flat_queue.active = False
+    if flat_queue.pool is not None:
+        flat_queue.pool.shutdown()
+        flat_queue.pool = None
+
+
+def reset():
+    """Forget the queue of the parent process in a forked process, and draw plots in this process"""
+    flat_queue.pool = None
+    flat_queue.active = False
+    flat_queue.pending.clear()
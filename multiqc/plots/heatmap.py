@@ -4,6 +4,7 @@
 
 
 import logging
+import math
 import random
 
 from multiqc.utils import config, report
@@ -42,27 +43,31 @@ def highcharts_heatmap(data, xcats, ycats, pconfig=None):
     Build the HTML needed for a HighCharts line graph. Should be
     called by plot_xy_data, which properly formats input data.
     """
+    import numpy as np
+
     if pconfig is None:
         pconfig = {}
 
-    # Reformat the data for highcharts
-    pdata = []
+    matrix = heatmap_matrix(data)
+
+    # Colour scale range, from the values before any downsampling
+    finite = np.isfinite(matrix)
     minval = None
     maxval = None
-    for i, arr in enumerate(data):
-        for j, val in enumerate(arr):
-            pdata.append([j, i, val])
-            if val is not None:
-                if minval is None or val < minval:
-                    minval = val
-                if maxval is None or val > maxval:
-                    maxval = val
-
+    if finite.any():
+        minval = matrix_value(data, matrix, np.where(finite, matrix, np.inf).argmin())
+        maxval = matrix_value(data, matrix, np.where(finite, matrix, -np.inf).argmax())
     if "min" not in pconfig:
         pconfig["min"] = minval
     if "max" not in pconfig:
         pconfig["max"] = maxval
 
+    # Merge rows and columns if there are too many cells to draw
+    max_cells = pconfig.get("max_cells", config.heatmap_max_cells)
+    if max_cells and matrix.size > max_cells:
+        method = pconfig.get("downsample_method", "block")
+        matrix, xcats, ycats = downsample_heatmap(matrix, xcats, ycats, max_cells, method)
+
     # Get the plot ID
     if pconfig.get("id") is None:
         pconfig["id"] = "mqc_hcplot_" + "".join(random.sample(letters, 10))
@@ -106,10 +111,124 @@ def highcharts_heatmap(data, xcats, ycats, pconfig=None):
 
     report.plot_data[pconfig["id"]] = {
         "plot_type": "heatmap",
-        "data": pdata,
+        "rows": matrix.tolist(),
         "xcats": xcats,
         "ycats": ycats,
         "config": pconfig,
     }
 
     return html
+
+
+def heatmap_matrix(data):
+    """Rows of values as a 2-D float array, with NaN for None and for missing values in short rows"""
+    import numpy as np
+
+    try:
+        matrix = np.array(data, dtype=float)
+        if matrix.ndim == 2:
+            return matrix
+    except ValueError:
+        pass  # Rows of different lengths
+    matrix = np.full((len(data), max((len(row) for row in data), default=0)), np.nan)
+    for i, row in enumerate(data):
+        matrix[i, : len(row)] = np.array(row, dtype=float)
+    return matrix
+
+
+def matrix_value(data, matrix, flat_idx):
+    """The value given in data at a flat index of the matrix, so that ints stay ints"""
+    import numpy as np
+
+    i, j = np.unravel_index(flat_idx, matrix.shape)
+    return data[i][j]
+
+
+def downsample_heatmap(matrix, xcats, ycats, max_cells, method="block"):
+    """
+    Merge groups of rows and columns until the matrix has no more than max_cells cells,
+    averaging the values of each block. Method "block" merges neighbouring rows / columns,
+    "cluster" merges rows / columns with similar values using hierarchical clustering.
+    Returns the new matrix and its x and y category labels.
+    """
+    import numpy as np
+
+    nrows, ncols = matrix.shape
+    scale = math.sqrt(max_cells / matrix.size)
+    num_rows = max(1, int(nrows * scale))
+    num_cols = max(1, int(ncols * scale))
+    logger.debug(
+        "Downsampling heatmap from {}x{} to {}x{} cells by {}".format(nrows, ncols, num_rows, num_cols, method)
+    )
+
+    if method not in ["block", "cluster"]:
+        logger.warning("Unknown heatmap downsample_method '{}', using 'block'".format(method))
+        method = "block"
+    row_order, row_edges = group_rows(matrix, num_rows, method)
+    # Sample-by-sample matrices keep the same order on both axes
+    if xcats == ycats and nrows == ncols:
+        col_order, col_edges = row_order, row_edges
+    else:
+        col_order, col_edges = group_rows(matrix.T, num_cols, method)
+
+    # Average each block, ignoring NaN values
+    blocks = matrix[row_order][:, col_order]
+    given = ~np.isnan(blocks)
+    sums = np.add.reduceat(np.add.reduceat(np.where(given, blocks, 0), row_edges, axis=0), col_edges, axis=1)
+    counts = np.add.reduceat(np.add.reduceat(given.astype(int), row_edges, axis=0), col_edges, axis=1)
+    with np.errstate(invalid="ignore"):
+        averages = np.where(counts > 0, sums / counts, np.nan)
+
+    return averages, group_labels(xcats, col_order, col_edges), group_labels(ycats, row_order, row_edges)
+
+
+def group_rows(matrix, num_groups, method):
+    """Row order and the start of each group of rows in it"""
+    if method == "cluster":
+        return cluster_groups(matrix, num_groups)
+    return block_groups(len(matrix), num_groups)
+
+
+def block_groups(n, num_groups):
+    """Split n rows into num_groups blocks of neighbouring rows: the row order and the start of each group"""
+    import numpy as np
+
+    return np.arange(n), np.unique(np.floor(np.linspace(0, n, num_groups, endpoint=False)).astype(int))
+
+
+def cluster_groups(matrix, num_groups):
+    """
+    Group the rows of a matrix into up to num_groups clusters with average-linkage hierarchical
+    clustering. Returns the dendrogram order of the rows and the start of each cluster in it.
+    """
+    import numpy as np
+
+    try:
+        from scipy.cluster import hierarchy
+    except ImportError:
+        logger.warning("Clustering heatmap rows needs scipy, which is not installed. Averaging blocks instead.")
+        return block_groups(len(matrix), num_groups)
+    if len(matrix) < 2 or num_groups >= len(matrix):
+        return block_groups(len(matrix), num_groups)
+    linkage = hierarchy.linkage(np.nan_to_num(matrix), method="average")
+    order = hierarchy.leaves_list(linkage)
+    clusters = hierarchy.fcluster(linkage, num_groups, criterion="maxclust")[order]
+    return order, np.flatnonzero(np.r_[True, clusters[1:] != clusters[:-1]])
+
+
+def group_labels(cats, order, edges):
+    """Axis labels for merged rows / columns: the first and last names of neighbouring rows, or the first name"""
+    import numpy as np
+
+    if cats is None:
+        return None
+    labels = list()
+    for start, end in zip(edges, list(edges[1:]) + [len(order)]):
+        first = cats[order[start]]
+        if end - start == 1:
+            labels.append(first)
+        elif order[end - 1] - order[start] == end - start - 1 and np.all(np.diff(order[start:end]) == 1):
+            labels.append("{} - {} ({})".format(first, cats[order[end - 1]], end - start))
+        else:
+            labels.append("{} + {} more".format(first, end - start - 1))
+    return labels
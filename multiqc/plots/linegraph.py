@@ -2,47 +2,31 @@
 
 """ MultiQC functions to plot a linegraph """
 
-import base64
 import inspect
 import io
 import logging
 import os
 import random
 import re
-import sys
 from collections import OrderedDict
 
+from multiqc.plots import flat_queue, table_object
 from multiqc.utils import config, report, util_functions
 
 logger = logging.getLogger(__name__)
 
-try:
-    # Import matplot lib but avoid default X environment
-    import matplotlib
-
-    matplotlib.use("Agg")
-    import matplotlib.pyplot as plt
-
-    logger.debug("Using matplotlib version {}".format(matplotlib.__version__))
-except Exception as e:
-    # MatPlotLib can break in a variety of ways. Fake an error message and continue without it if so.
-    # The lack of the library will be handled when plots are attempted
-    print("##### ERROR! MatPlotLib library could not be loaded!    #####", file=sys.stderr)
-    print("##### Flat plots will instead be plotted as interactive #####", file=sys.stderr)
-    print(e)
-
 letters = "abcdefghijklmnopqrstuvwxyz"
 
 # Load the template so that we can access its configuration
 # Do this lazily to mitigate import-spaghetti when running unit tests
-_template_mod = None
+# Each template is loaded once, runs in different ReportContexts can use different templates
+_template_mods = dict()
 
 
 def get_template_mod():
-    global _template_mod
-    if not _template_mod:
-        _template_mod = config.avail_templates[config.template].load()
-    return _template_mod
+    if config.template not in _template_mods:
+        _template_mods[config.template] = config.avail_templates[config.template].load()
+    return _template_mods[config.template]
 
 
 def plot(data, pconfig=None):
@@ -89,15 +73,18 @@ def plot(data, pconfig=None):
             logger.error(errmsg)
             report.lint_errors.append(errmsg)
 
-    # Smooth dataset if requested in config
-    if pconfig.get("smooth_points", None) is not None:
+    # Smooth dataset if requested in config, or down to the default maximum number of points per line
+    smooth_points = pconfig.get("smooth_points", None)
+    if smooth_points is None and config.linegraph_max_points and not pconfig.get("categories"):
+        smooth_points = config.linegraph_max_points
+    if smooth_points is not None:
         sumcounts = pconfig.get("smooth_points_sumcounts", True)
         for i, d in enumerate(data):
             if type(sumcounts) is list:
                 sumc = sumcounts[i]
             else:
                 sumc = sumcounts
-            data[i] = smooth_line_data(d, pconfig["smooth_points"], sumc)
+            data[i] = smooth_line_data(d, smooth_points, sumc, pconfig.get("smooth_method", "lttb"))
 
     # Add sane plotting config defaults
     for idx, yp in enumerate(pconfig.get("yPlotLines", [])):
@@ -120,85 +107,43 @@ def plot(data, pconfig=None):
     for data_index, d in enumerate(data):
         thisplotdata = list()
 
-        for s in sorted(d.keys()):
-
-            # Ensure any overwritten conditionals from data_labels (e.g. ymax) are taken in consideration
-            series_config = pconfig.copy()
-            if (
-                "data_labels" in pconfig and type(pconfig["data_labels"][data_index]) is dict
-            ):  # if not a dict: only dataset name is provided
-                series_config.update(pconfig["data_labels"][data_index])
+        # Ensure any overwritten conditionals from data_labels (e.g. ymax) are taken in consideration
+        series_config = pconfig.copy()
+        if (
+            "data_labels" in pconfig and type(pconfig["data_labels"][data_index]) is dict
+        ):  # if not a dict: only dataset name is provided
+            series_config.update(pconfig["data_labels"][data_index])
 
-            pairs = list()
-            maxval = 0
+        for s in sorted(d.keys()):
             if "categories" in series_config:
                 if "categories" not in pconfig or type(pconfig["categories"]) is not list:
                     pconfig["categories"] = list()
                 # Add any new categories
+                known_categories = set(pconfig["categories"])
                 for k in d[s].keys():
-                    if k not in pconfig["categories"]:
+                    if k not in known_categories:
                         pconfig["categories"].append(k)
+                        known_categories.add(k)
                 # Go through categories and add either data or a blank
-                for k in pconfig["categories"]:
-                    try:
-                        pairs.append(d[s][k])
-                        maxval = max(maxval, d[s][k])
-                    except KeyError:
-                        pairs.append(None)
+                pairs = [d[s].get(k) for k in pconfig["categories"]]
             else:
+                pairs = series_pairs(d[s], series_config)
 
-                # Discard > ymax or just hide?
-                # If it never comes back into the plot, discard. If it goes above then comes back, just hide.
-                discard_ymax = None
-                discard_ymin = None
-                for k in sorted(d[s].keys()):
-                    if "xmax" in series_config and float(k) > float(series_config["xmax"]):
-                        continue
-                    if "xmin" in series_config and float(k) < float(series_config["xmin"]):
-                        continue
-                    if d[s][k] is not None and "ymax" in series_config:
-                        if float(d[s][k]) > float(series_config["ymax"]):
-                            discard_ymax = True
-                        elif discard_ymax is True:
-                            discard_ymax = False
-                    if d[s][k] is not None and "ymin" in series_config:
-                        if float(d[s][k]) > float(series_config["ymin"]):
-                            discard_ymin = True
-                        elif discard_ymin is True:
-                            discard_ymin = False
-
-                # Build the plot data structure
-                for k in sorted(d[s].keys()):
-                    if k is not None:
-                        if "xmax" in series_config and float(k) > float(series_config["xmax"]):
-                            continue
-                        if "xmin" in series_config and float(k) < float(series_config["xmin"]):
-                            continue
-                    if d[s][k] is not None:
-                        if (
-                            "ymax" in series_config
-                            and float(d[s][k]) > float(series_config["ymax"])
-                            and discard_ymax is not False
-                        ):
-                            continue
-                        if (
-                            "ymin" in series_config
-                            and float(d[s][k]) < float(series_config["ymin"])
-                            and discard_ymin is not False
-                        ):
-                            continue
-                    pairs.append([k, d[s][k]])
+            if series_config.get("hide_empty") is True:
+                maxval = 0
+                for val in pairs if "categories" in series_config else [pair[1] for pair in pairs]:
                     try:
-                        maxval = max(maxval, d[s][k])
+                        maxval = max(maxval, val)
                     except TypeError:
                         pass
-            if maxval > 0 or series_config.get("hide_empty") is not True:
-                this_series = {"name": s, "data": pairs}
-                try:
-                    this_series["color"] = series_config["colors"][s]
-                except:
-                    pass
-                thisplotdata.append(this_series)
+                if not maxval > 0:
+                    continue
+            this_series = {"name": s, "data": pairs}
+            try:
+                this_series["color"] = series_config["colors"][s]
+            except:
+                pass
+            thisplotdata.append(this_series)
         plotdata.append(thisplotdata)
 
     # Add on annotation data series
@@ -237,6 +182,46 @@ def plot(data, pconfig=None):
             return highcharts_linegraph(plotdata, pconfig)
 
 
+def series_pairs(d, series_config):
+    """Build the [x, y] pairs of a line, sorted by x, applying the xmin / xmax / ymin / ymax limits.
+    Points beyond ymax (or ymin) are discarded if the line never comes back into the plot,
+    otherwise they are kept so that the line goes out of view and back again."""
+    import numpy as np
+
+    keys = sorted(d.keys())
+    vals = [d[k] for k in keys]
+    if not any(lim in series_config for lim in ["xmin", "xmax", "ymin", "ymax"]):
+        return [[k, v] for k, v in zip(keys, vals)]
+
+    keep = np.ones(len(keys), dtype=bool)
+    if "xmin" in series_config or "xmax" in series_config:
+        xs = np.array(keys, dtype=float)
+        if "xmax" in series_config:
+            keep &= ~(xs > float(series_config["xmax"]))
+        if "xmin" in series_config:
+            keep &= ~(xs < float(series_config["xmin"]))
+
+    if "ymin" in series_config or "ymax" in series_config:
+        # None is read as NaN, but missing values are skipped instead of counting as in the plot
+        ys = np.array(vals, dtype=float)
+        present = np.array([v is not None for v in vals], dtype=bool) if None in vals else True
+        # Only the last point in the x range matters: is the line still out of the plot at the end?
+        in_x = present & keep
+        last_points = np.flatnonzero(in_x)
+        with np.errstate(invalid="ignore"):
+            if "ymax" in series_config:
+                above = ys > float(series_config["ymax"])
+                if not (above & in_x).any() or above[last_points[-1]]:
+                    keep &= ~above
+            if "ymin" in series_config:
+                # The line is checked for points above ymin, not below
+                above = ys > float(series_config["ymin"])
+                if not (above & in_x).any() or above[last_points[-1]]:
+                    keep &= ~(ys < float(series_config["ymin"]))
+
+    return [[k, v] for k, v, kept in zip(keys, vals, keep.tolist()) if kept]
+
+
 def highcharts_linegraph(plotdata, pconfig=None):
     """
     Build the HTML needed for a HighCharts line graph. Should be
@@ -349,20 +334,6 @@ def matplotlib_linegraph(plotdata, pconfig=None):
     )
     html += '<div class="mqc_mplplot_plotgroup" id="{}">'.format(pconfig["id"])
 
-    # Same defaults as HighCharts for consistency
-    default_colors = [
-        "#7cb5ec",
-        "#434348",
-        "#90ed7d",
-        "#f7a35c",
-        "#8085e9",
-        "#f15c80",
-        "#e4d354",
-        "#2b908f",
-        "#f45b5b",
-        "#91e8e1",
-    ]
-
     # Buttons to cycle through different datasets
     if len(plotdata) > 1 and not config.simple_output:
         html += '<div class="btn-group mpl_switch_group mqc_mplplot_bargraph_switchds">\n'
@@ -421,180 +392,15 @@ def matplotlib_linegraph(plotdata, pconfig=None):
             else:
                 util_functions.write_data_file(fdata, pid)
 
-        plt_height = 6
-        # Use fixed height if pconfig['height'] is set (convert pixels -> inches)
-        if "height" in pconfig:
-            # Default interactive height in pixels = 512
-            # Not perfect replication, but good enough
-            plt_height = 6 * (pconfig["height"] / 512)
-
-        # Set up figure
-        fig = plt.figure(figsize=(14, plt_height), frameon=False)
-        axes = fig.add_subplot(111)
-
-        # Go through data series
-        for idx, d in enumerate(pdata):
-
-            # Default colour index
-            cidx = idx
-            while cidx >= len(default_colors):
-                cidx -= len(default_colors)
-
-            # Line style
-            linestyle = "solid"
-            if d.get("dashStyle", None) == "Dash":
-                linestyle = "dashed"
-
-            # Reformat data (again)
-            try:
-                axes.plot(
-                    [x[0] for x in d["data"]],
-                    [x[1] for x in d["data"]],
-                    label=d["name"],
-                    color=d.get("color", default_colors[cidx]),
-                    linestyle=linestyle,
-                    linewidth=1,
-                    marker=None,
-                )
-            except TypeError:
-                # Categorical data on x axis
-                axes.plot(
-                    d["data"], label=d["name"], color=d.get("color", default_colors[cidx]), linewidth=1, marker=None
-                )
-
-        # Tidy up axes
-        axes.tick_params(
-            labelsize=pconfig.get("labelSize", 8), direction="out", left=False, right=False, top=False, bottom=False
-        )
-        axes.set_xlabel(pconfig.get("xlab", ""))
-        axes.set_ylabel(pconfig.get("ylab", ""))
-
-        # Dataset specific y label
-        try:
-            axes.set_ylabel(pconfig["data_labels"][pidx]["ylab"])
-        except:
-            pass
-
-        # Axis limits
-        default_ylimits = axes.get_ylim()
-        ymin = default_ylimits[0]
-        if "ymin" in pconfig:
-            ymin = pconfig["ymin"]
-        elif "yFloor" in pconfig:
-            ymin = max(pconfig["yFloor"], default_ylimits[0])
-        ymax = default_ylimits[1]
-        if "ymax" in pconfig:
-            ymax = pconfig["ymax"]
-        elif "yCeiling" in pconfig:
-            ymax = min(pconfig["yCeiling"], default_ylimits[1])
-        if (ymax - ymin) < pconfig.get("yMinRange", 0):
-            ymax = ymin + pconfig["yMinRange"]
-        axes.set_ylim((ymin, ymax))
-
-        # Dataset specific ymax
-        try:
-            axes.set_ylim((ymin, pconfig["data_labels"][pidx]["ymax"]))
-        except:
-            pass
-
-        default_xlimits = axes.get_xlim()
-        xmin = default_xlimits[0]
-        if "xmin" in pconfig:
-            xmin = pconfig["xmin"]
-        elif "xFloor" in pconfig:
-            xmin = max(pconfig["xFloor"], default_xlimits[0])
-        xmax = default_xlimits[1]
-        if "xmax" in pconfig:
-            xmax = pconfig["xmax"]
-        elif "xCeiling" in pconfig:
-            xmax = min(pconfig["xCeiling"], default_xlimits[1])
-        if (xmax - xmin) < pconfig.get("xMinRange", 0):
-            xmax = xmin + pconfig["xMinRange"]
-        axes.set_xlim((xmin, xmax))
-
-        # Plot title
-        if "title" in pconfig:
-            plt.text(0.5, 1.05, pconfig["title"], horizontalalignment="center", fontsize=16, transform=axes.transAxes)
-        axes.grid(True, zorder=10, which="both", axis="y", linestyle="-", color="#dedede", linewidth=1)
-
-        # X axis categories, if specified
-        if "categories" in pconfig:
-            axes.set_xticks([i for i, v in enumerate(pconfig["categories"])])
-            axes.set_xticklabels(pconfig["categories"])
-
-        # Axis lines
-        xlim = axes.get_xlim()
-        axes.plot([xlim[0], xlim[1]], [0, 0], linestyle="-", color="#dedede", linewidth=2)
-        axes.set_axisbelow(True)
-        axes.spines["right"].set_visible(False)
-        axes.spines["top"].set_visible(False)
-        axes.spines["bottom"].set_visible(False)
-        axes.spines["left"].set_visible(False)
-
-        # Background colours, if specified
-        if "yPlotBands" in pconfig:
-            xlim = axes.get_xlim()
-            for pb in pconfig["yPlotBands"]:
-                axes.barh(
-                    pb["from"],
-                    xlim[1],
-                    height=pb["to"] - pb["from"],
-                    left=xlim[0],
-                    color=pb["color"],
-                    linewidth=0,
-                    zorder=0,
-                    align="edge",
-                )
-        if "xPlotBands" in pconfig:
-            ylim = axes.get_ylim()
-            for pb in pconfig["xPlotBands"]:
-                axes.bar(
-                    pb["from"],
-                    ylim[1],
-                    width=pb["to"] - pb["from"],
-                    bottom=ylim[0],
-                    color=pb["color"],
-                    linewidth=0,
-                    zorder=0,
-                    align="edge",
-                )
-
-        # Tight layout - makes sure that legend fits in and stuff
-        if len(pdata) <= 15:
-            axes.legend(
-                loc="lower center",
-                bbox_to_anchor=(0, -0.22, 1, 0.102),
-                ncol=5,
-                mode="expand",
-                fontsize=pconfig.get("labelSize", 8),
-                frameon=False,
-            )
-            plt.tight_layout(rect=[0, 0.08, 1, 0.92])
-        else:
-            plt.tight_layout(rect=[0, 0, 1, 0.92])
-
         # Should this plot be hidden on report load?
         hidediv = ""
         if pidx > 0:
             hidediv = ' style="display:none;"'
 
-        # Save the plot to the data directory if export is requests
-        if config.export_plots:
-            for fformat in config.export_plot_formats:
-                # Make the directory if it doesn't already exist
-                plot_dir = os.path.join(config.plots_dir, fformat)
-                if not os.path.exists(plot_dir):
-                    os.makedirs(plot_dir)
-                # Save the plot
-                plot_fn = os.path.join(plot_dir, "{}.{}".format(pid, fformat))
-                fig.savefig(plot_fn, format=fformat, bbox_inches="tight")
-
-        # Output the figure to a base64 encoded string
-        if getattr(get_template_mod(), "base64_plots", True) is True:
-            img_buffer = io.BytesIO()
-            fig.savefig(img_buffer, format="png", bbox_inches="tight")
-            b64_img = base64.b64encode(img_buffer.getvalue()).decode("utf8")
-            img_buffer.close()
+        # Draw the figure, and save it if export is requested
+        base64_plot = getattr(get_template_mod(), "base64_plots", True) is True
+        b64_img = flat_queue.render(linegraph_figure, (pdata, pconfig, pidx), pid, base64_plot)
+        if base64_plot:
             html += '<div class="mqc_mplplot" id="{}"{}><img src="data:image/png;base64,{}" /></div>'.format(
                 pid, hidediv, b64_img
             )
@@ -604,38 +410,204 @@ def matplotlib_linegraph(plotdata, pconfig=None):
             plot_relpath = os.path.join(config.plots_dir_name, "png", "{}.png".format(pid))
             html += '<div class="mqc_mplplot" id="{}"{}><img src="{}" /></div>'.format(pid, hidediv, plot_relpath)
 
-        plt.close(fig)
-
     # Close wrapping div
     html += "</div>"
 
     return html
 
 
-def smooth_line_data(data, numpoints, sumcounts=True):
+def linegraph_figure(pdata, pconfig, pidx):
+    """Draw a MatPlotLib line graph of one dataset. Returns the figure, run by flat_queue.render()"""
+    plt = flat_queue.pyplot()
+
+    # Same defaults as HighCharts for consistency
+    default_colors = [
+        "#7cb5ec",
+        "#434348",
+        "#90ed7d",
+        "#f7a35c",
+        "#8085e9",
+        "#f15c80",
+        "#e4d354",
+        "#2b908f",
+        "#f45b5b",
+        "#91e8e1",
+    ]
+
+    plt_height = 6
+    # Use fixed height if pconfig['height'] is set (convert pixels -> inches)
+    if "height" in pconfig:
+        # Default interactive height in pixels = 512
+        # Not perfect replication, but good enough
+        plt_height = 6 * (pconfig["height"] / 512)
+
+    # Set up figure
+    fig = plt.figure(figsize=(14, plt_height), frameon=False)
+    axes = fig.add_subplot(111)
+
+    # Go through data series
+    for idx, d in enumerate(pdata):
+
+        # Default colour index
+        cidx = idx
+        while cidx >= len(default_colors):
+            cidx -= len(default_colors)
+
+        # Line style
+        linestyle = "solid"
+        if d.get("dashStyle", None) == "Dash":
+            linestyle = "dashed"
+
+        # Reformat data (again)
+        try:
+            axes.plot(
+                [x[0] for x in d["data"]],
+                [x[1] for x in d["data"]],
+                label=d["name"],
+                color=d.get("color", default_colors[cidx]),
+                linestyle=linestyle,
+                linewidth=1,
+                marker=None,
+            )
+        except TypeError:
+            # Categorical data on x axis
+            axes.plot(
+                d["data"], label=d["name"], color=d.get("color", default_colors[cidx]), linewidth=1, marker=None
+            )
+
+    # Tidy up axes
+    axes.tick_params(
+        labelsize=pconfig.get("labelSize", 8), direction="out", left=False, right=False, top=False, bottom=False
+    )
+    axes.set_xlabel(pconfig.get("xlab", ""))
+    axes.set_ylabel(pconfig.get("ylab", ""))
+
+    # Dataset specific y label
+    try:
+        axes.set_ylabel(pconfig["data_labels"][pidx]["ylab"])
+    except:
+        pass
+
+    # Axis limits
+    default_ylimits = axes.get_ylim()
+    ymin = default_ylimits[0]
+    if "ymin" in pconfig:
+        ymin = pconfig["ymin"]
+    elif "yFloor" in pconfig:
+        ymin = max(pconfig["yFloor"], default_ylimits[0])
+    ymax = default_ylimits[1]
+    if "ymax" in pconfig:
+        ymax = pconfig["ymax"]
+    elif "yCeiling" in pconfig:
+        ymax = min(pconfig["yCeiling"], default_ylimits[1])
+    if (ymax - ymin) < pconfig.get("yMinRange", 0):
+        ymax = ymin + pconfig["yMinRange"]
+    axes.set_ylim((ymin, ymax))
+
+    # Dataset specific ymax
+    try:
+        axes.set_ylim((ymin, pconfig["data_labels"][pidx]["ymax"]))
+    except:
+        pass
+
+    default_xlimits = axes.get_xlim()
+    xmin = default_xlimits[0]
+    if "xmin" in pconfig:
+        xmin = pconfig["xmin"]
+    elif "xFloor" in pconfig:
+        xmin = max(pconfig["xFloor"], default_xlimits[0])
+    xmax = default_xlimits[1]
+    if "xmax" in pconfig:
+        xmax = pconfig["xmax"]
+    elif "xCeiling" in pconfig:
+        xmax = min(pconfig["xCeiling"], default_xlimits[1])
+    if (xmax - xmin) < pconfig.get("xMinRange", 0):
+        xmax = xmin + pconfig["xMinRange"]
+    axes.set_xlim((xmin, xmax))
+
+    # Plot title
+    if "title" in pconfig:
+        plt.text(0.5, 1.05, pconfig["title"], horizontalalignment="center", fontsize=16, transform=axes.transAxes)
+    axes.grid(True, zorder=10, which="both", axis="y", linestyle="-", color="#dedede", linewidth=1)
+
+    # X axis categories, if specified
+    if "categories" in pconfig:
+        axes.set_xticks([i for i, v in enumerate(pconfig["categories"])])
+        axes.set_xticklabels(pconfig["categories"])
+
+    # Axis lines
+    xlim = axes.get_xlim()
+    axes.plot([xlim[0], xlim[1]], [0, 0], linestyle="-", color="#dedede", linewidth=2)
+    axes.set_axisbelow(True)
+    axes.spines["right"].set_visible(False)
+    axes.spines["top"].set_visible(False)
+    axes.spines["bottom"].set_visible(False)
+    axes.spines["left"].set_visible(False)
+
+    # Background colours, if specified
+    if "yPlotBands" in pconfig:
+        xlim = axes.get_xlim()
+        for pb in pconfig["yPlotBands"]:
+            axes.barh(
+                pb["from"],
+                xlim[1],
+                height=pb["to"] - pb["from"],
+                left=xlim[0],
+                color=pb["color"],
+                linewidth=0,
+                zorder=0,
+                align="edge",
+            )
+    if "xPlotBands" in pconfig:
+        ylim = axes.get_ylim()
+        for pb in pconfig["xPlotBands"]:
+            axes.bar(
+                pb["from"],
+                ylim[1],
+                width=pb["to"] - pb["from"],
+                bottom=ylim[0],
+                color=pb["color"],
+                linewidth=0,
+                zorder=0,
+                align="edge",
+            )
+
+    # Tight layout - makes sure that legend fits in and stuff
+    if len(pdata) <= 15:
+        axes.legend(
+            loc="lower center",
+            bbox_to_anchor=(0, -0.22, 1, 0.102),
+            ncol=5,
+            mode="expand",
+            fontsize=pconfig.get("labelSize", 8),
+            frameon=False,
+        )
+        plt.tight_layout(rect=[0, 0.08, 1, 0.92])
+    else:
+        plt.tight_layout(rect=[0, 0, 1, 0.92])
+
+    return fig, None
+
+
+def smooth_line_data(data, numpoints, sumcounts=True, method="lttb"):
     """
-    Function to take an x-y dataset and use binning to smooth to a maximum number of datapoints.
-    Each datapoint in a smoothed dataset corresponds to the first point in a bin.
-
-    Examples to show the idea:
-
-    d=[0 1 2 3 4 5 6 7 8 9], numpoints=6
-    we want to keep the first and the last element, thus excluding the last element from the binning:
-    binsize = len([0 1 2 3 4 5 6 7 8]))/(numpoints-1) = 9/5 = 1.8
-    taking points in indices rounded from multiples of 1.8: [0, 1.8, 3.6, 5.4, 7.2, 9],
-    ...which evaluates to first_element_in_bin_indices=[0, 2, 4, 5, 7, 9]
-    picking up the elements: [0 _ 2 _ 4 5 _ 7 _ 9]
-
-    d=[0 1 2 3 4 5 6 7 8 9], numpoints=9
-    binsize = 9/8 = 1.125
-    indices: [0.0, 1.125, 2.25, 3.375, 4.5, 5.625, 6.75, 7.875, 9] -> [0, 1, 2, 3, 5, 6, 7, 8, 9]
-    picking up the elements: [0 1 2 3 _ 5 6 7 8 9]
-
-    d=[0 1 2 3 4 5 6 7 8 9], numpoints=3
-    binsize = len(d)/numpoints = 9/2 = 4.5
-    incides: [0.0, 4.5, 9] -> [0, 5, 9]
-    picking up the elements: [0 _ _ _ _ 5 _ _ _ 9]
+    Function to take an x-y dataset and downsample it to a maximum number of datapoints.
+    The first and last points of each line are always kept. Methods:
+
+    lttb: Largest-Triangle-Three-Buckets. The points are split into numpoints-2 buckets and
+        from each the point making the largest triangle with its neighbouring buckets is kept,
+        so that peaks and troughs survive. The left corner of each triangle is the average
+        of the previous bucket, so that all buckets can be done at once with NumPy.
+    minmax: the minimum and maximum points of numpoints/2 buckets, an envelope of the line.
+    first: the first point of each of numpoints-1 buckets, eg. for d=[0 1 2 3 4 5 6 7 8 9]
+        and numpoints=6, bucket size is 9/5 = 1.8 and points are kept at the rounded
+        multiples [0, 1.8, 3.6, 5.4, 7.2, 9]: [0 _ 2 _ 4 5 _ 7 _ 9]
+
+    Points are picked along numeric x values, or in the given order if x values are not numeric.
+    The kept points are returned in the given order.
     """
+    import numpy as np
+
     smoothed_data = dict()
     for s_name, d in data.items():
         # Check that we need to smooth this data
@@ -643,9 +615,94 @@ def smooth_line_data(data, numpoints, sumcounts=True):
             smoothed_data[s_name] = d
             continue
 
-        binsize = (len(d) - 1) / (numpoints - 1)
-        first_element_indices = [round(binsize * i) for i in range(numpoints)]
-        smoothed_d = OrderedDict(xy for i, xy in enumerate(d.items()) if i in first_element_indices)
-        smoothed_data[s_name] = smoothed_d
+        keys = list(d.keys())
+        if method == "first" or numpoints < 3:
+            binsize = (len(d) - 1) / (numpoints - 1)
+            indices = sorted(set(round(binsize * i) for i in range(numpoints)))
+        else:
+            try:
+                x = np.array(keys, dtype=float)
+            except (TypeError, ValueError):
+                x = np.arange(len(keys), dtype=float)
+            if np.isnan(x).any():
+                x = np.arange(len(keys), dtype=float)
+            order = np.argsort(x, kind="stable")
+            y = table_object.to_float_array(list(d.values()))[0][order]
+            if method == "minmax":
+                indices = minmax_indices(y, numpoints)
+            else:
+                indices = lttb_indices(x[order], y, numpoints)
+            indices = np.sort(order[indices]).tolist()
+
+        smoothed_data[s_name] = OrderedDict((keys[i], d[keys[i]]) for i in indices)
 
     return smoothed_data
+
+
+def bucket_edges(n, num_buckets):
+    """Start indices of num_buckets buckets splitting points 1 to n-2, and the end index"""
+    import numpy as np
+
+    return np.floor(np.linspace(1, n - 1, num_buckets + 1)).astype(int)
+
+
+def bucket_argmax(values, edges):
+    """Index of the largest value in each bucket, skipping buckets with only NaN values"""
+    import numpy as np
+
+    starts = edges[:-1]
+    sizes = np.diff(edges)
+    with np.errstate(invalid="ignore"):
+        maxes = np.fmax.reduceat(values[: edges[-1]], starts)
+    is_max = values[starts[0] : edges[-1]] == np.repeat(maxes, sizes)
+    hits = np.flatnonzero(is_max) + starts[0]
+    buckets = np.repeat(np.arange(len(starts)), sizes)[hits - starts[0]]
+    _, first = np.unique(buckets, return_index=True)
+    return hits[first]
+
+
+def lttb_indices(x, y, numpoints):
+    """Indices of the points kept by Largest-Triangle-Three-Buckets downsampling"""
+    import numpy as np
+
+    n = len(x)
+    edges = bucket_edges(n, numpoints - 2)
+    starts = edges[:-1]
+    sizes = np.diff(edges)
+
+    # Average point of each bucket, ignoring missing values
+    bx = x[1 : n - 1]
+    by = y[1 : n - 1]
+    valid = ~np.isnan(by)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        avg_x = np.add.reduceat(bx, starts - 1) / sizes
+        avg_y = np.add.reduceat(np.where(valid, by, 0), starts - 1) / np.add.reduceat(valid, starts - 1)
+    y0 = y[0] if not np.isnan(y[0]) else 0
+    yn = y[-1] if not np.isnan(y[-1]) else 0
+
+    # Triangle corners either side of each bucket: the neighbouring averages, or the end points
+    ax = np.repeat(np.concatenate(([x[0]], avg_x[:-1])), sizes)
+    ay = np.repeat(np.concatenate(([y0], avg_y[:-1])), sizes)
+    cx = np.repeat(np.concatenate((avg_x[1:], [x[-1]])), sizes)
+    cy = np.repeat(np.concatenate((avg_y[1:], [yn])), sizes)
+    with np.errstate(invalid="ignore"):
+        areas = np.abs((ax - cx) * (by - ay) - (ax - bx) * (cy - ay))
+
+    # Missing values, or neighbours with only missing values, give the smallest area
+    areas = np.concatenate(([0], np.where(np.isnan(areas), -1.0, areas), [0]))
+    return np.concatenate(([0], bucket_argmax(areas, edges), [n - 1]))
+
+
+def minmax_indices(y, numpoints):
+    """Indices of the minimum and maximum points in each bucket, in order"""
+    import numpy as np
+
+    n = len(y)
+    kept = [[0, n - 1]]
+    if numpoints < 4:
+        return np.array(kept[0])
+    edges = bucket_edges(n, (numpoints - 2) // 2)
+    with np.errstate(invalid="ignore"):
+        kept.append(bucket_argmax(y, edges))
+        kept.append(bucket_argmax(-y, edges))
+    return np.unique(np.concatenate(kept))
@@ -3,6 +3,7 @@
 """ MultiQC functions to plot a table """
 
 import logging
+import operator
 import random
 from collections import OrderedDict, defaultdict
 
@@ -53,6 +54,139 @@ def plot(data, headers=None, pconfig=None):
         return make_table(dt)
 
 
+def bar_percentages(header, values):
+    """Widths of the table cell bars for a column of values, as percentages"""
+    import numpy as np
+
+    floats, numeric = table_object.to_float_array(values)
+    dmin = header["dmin"]
+    dmax = header["dmax"]
+    if dmax - dmin == 0:
+        return [0] * len(values)
+    # Treat 0 as 0-width and make bars width of absoluate value
+    if header.get("bars_zero_centrepoint"):
+        dmax = max(abs(header["dmin"]), abs(header["dmax"]))
+        dmin = 0
+        floats = np.abs(floats)
+        if dmax - dmin == 0:
+            return [0] * len(values)
+    with np.errstate(all="ignore"):
+        percentages = ((floats - dmin) / (dmax - dmin)) * 100
+    return [
+        (100 if pc > 100 else 0 if pc < 0 else pc) if is_num else 0
+        for pc, is_num in zip(percentages.tolist(), numeric.tolist())
+    ]
+
+
+def cell_html(rid, hide, cell):
+    """HTML for a table cell: [value] or [value, bar width, bar colour] or [value, None, None, background colour]
+    Virtual tables build the same HTML in multiqc_tables.js"""
+    valstring = cell[0]
+    # Categorical background colour
+    if len(cell) > 3:
+        col = 'style="background-color:{} !important;"'.format(cell[3])
+        return '<td class="{rid} {h}" {c}>{v}</td>'.format(rid=rid, h=hide, c=col, v=valstring)
+    # Table cell background colour bar
+    if len(cell) > 1:
+        col = " background-color:{} !important;".format(cell[2]) if cell[2] is not None else ""
+        bar_html = '<span class="bar" style="width:{}%;{}"></span>'.format(cell[1], col)
+        val_html = '<span class="val">{}</span>'.format(valstring)
+        wrapper_html = '<div class="wrapper">{}{}</div>'.format(bar_html, val_html)
+        return '<td class="data-coloured {rid} {h}">{c}</td>'.format(rid=rid, h=hide, c=wrapper_html)
+    return '<td class="{rid} {h}">{v}</td>'.format(rid=rid, h=hide, v=valstring)
+
+
+# Conditional formatting comparisons on numbers, as value <op> rule
+cond_formatting_float_ops = {"eq": operator.eq, "ne": operator.ne, "gt": operator.gt, "lt": operator.lt}
+cond_formatting_str_ops = {"s_eq": operator.eq, "s_contains": operator.contains, "s_ne": operator.ne}
+
+
+def compile_cond_formatting_comparison(cmp):
+    """Turn a conditional formatting comparison dict, eg. {"gt": 10}, into a list of tests.
+    Each test takes the lower-case string and float of a cell value (None if not a number),
+    returns True if it matches and raises ValueError if the comparison can not be made."""
+
+    def bad_rule(sval, fval):
+        raise ValueError("Not a comparison dict")
+
+    def str_test(op, target):
+        return lambda sval, fval: op(sval, target)
+
+    def float_test(op, target):
+        def test(sval, fval):
+            if fval is None or target is None:
+                raise ValueError("Not a number")
+            return op(fval, target)
+
+        return test
+
+    # Malformed rules, eg. [5] or ["s_eq: pass"], never match and warn for each cell
+    if not isinstance(cmp, dict):
+        return [bad_rule]
+
+    tests = []
+    # Comparisons are applied in this order, stopping at the first that can not be made
+    for key in ["s_eq", "s_contains", "s_ne", "eq", "ne", "gt", "lt"]:
+        if key not in cmp:
+            continue
+        if key in cond_formatting_str_ops:
+            tests.append(str_test(cond_formatting_str_ops[key], str(cmp[key]).lower()))
+        else:
+            try:
+                target = float(cmp[key])
+            except Exception:
+                target = None
+            tests.append(float_test(cond_formatting_float_ops[key], target))
+    return tests
+
+
+def compile_cond_formatting(rules, colours, rule_keys):
+    """Compile conditional formatting rules for a table column into a single function.
+    :param rules: dict of rule keys ("all_columns", column ID or table ID) to dicts of formatting types to comparisons
+    :param colours: list of dicts of formatting type to colour, later entries taking precedence
+    :param rule_keys: rule keys that apply to this column, in order
+    :return: function returning the badge colour for a cell value, or None
+    """
+    ftypes = []
+    for cfc in colours:
+        for cfck in cfc:
+            if cfck not in ftypes:
+                ftypes.append(cfck)
+
+    comparisons = []
+    for cfk in rule_keys:
+        if cfk in rules:
+            for ftype in ftypes:
+                for cmp in rules[cfk].get(ftype, []):
+                    comparisons.append((ftype, cmp, compile_cond_formatting_comparison(cmp)))
+
+    def badge_colour(val):
+        if not comparisons:
+            return None
+        sval = str(val).lower()
+        try:
+            fval = float(val)
+        except Exception:
+            fval = None
+        matches = set()
+        for ftype, cmp, tests in comparisons:
+            try:
+                for test in tests:
+                    if test(sval, fval):
+                        matches.add(ftype)
+            except Exception:
+                logger.warning("Not able to apply table conditional formatting to '{}' ({})".format(val, cmp))
+        # Apply colours in order of config keys
+        badge_col = None
+        for cfc in colours:
+            for cfck in cfc:  # should always be one, but you never know
+                if cfck in matches:
+                    badge_col = cfc[cfck]
+        return badge_col
+
+    return badge_colour
+
+
 def make_table(dt):
     """
     Build the HTML needed for a MultiQC table.
@@ -67,6 +201,7 @@ def make_table(dt):
     t_rows_empty = OrderedDict()
     dt.raw_vals = defaultdict(lambda: dict())
     empty_cells = dict()
+    t_hide = dict()
     hidden_cols = 1
     table_title = dt.pconfig.get("table_title")
     if table_title is None:
@@ -103,6 +238,7 @@ def make_table(dt):
         )
 
         empty_cells[rid] = '<td class="data-coloured {rid} {h}"></td>'.format(rid=rid, h=hide)
+        t_hide[rid] = hide
 
         # Build the modal table row
         t_modal_headers[
@@ -145,131 +281,77 @@ def make_table(dt):
 
         cond_formatting_colours = header.get("cond_formatting_colours", [])
         cond_formatting_colours.extend(config.table_cond_formatting_colours)
+        cond_formatting = compile_cond_formatting(
+            cond_formatting_rules, cond_formatting_colours, ["all_columns", rid, table_id]
+        )
 
-        # Add the data table cells
-        for (s_name, samp) in dt.data[idx].items():
-            if k in samp:
-                val = samp[k]
-                kname = "{}_{}".format(header["namespace"], rid)
-                dt.raw_vals[s_name][kname] = val
+        # Collect the column values, modified for display
+        col_vals = dict()
+        kname = "{}_{}".format(header["namespace"], rid)
+        for s_name, val in dt.columns[idx][k].items():
+            dt.raw_vals[s_name][kname] = val
 
-                if "modify" in header and callable(header["modify"]):
-                    val = header["modify"](val)
+            if "modify" in header and callable(header["modify"]):
+                val = header["modify"](val)
+            col_vals[s_name] = val
 
-                try:
-                    dmin = header["dmin"]
-                    dmax = header["dmax"]
-                    percentage = ((float(val) - dmin) / (dmax - dmin)) * 100
-                    # Treat 0 as 0-width and make bars width of absoluate value
-                    if header.get("bars_zero_centrepoint"):
-                        dmax = max(abs(header["dmin"]), abs(header["dmax"]))
-                        dmin = 0
-                        percentage = ((abs(float(val)) - dmin) / (dmax - dmin)) * 100
-                    percentage = min(percentage, 100)
-                    percentage = max(percentage, 0)
-                except (ZeroDivisionError, ValueError, TypeError):
-                    percentage = 0
+        # Colour the whole column at once
+        if c_scale is not None:
+            col_colours = dict(zip(col_vals.keys(), c_scale.get_colour_list(list(col_vals.values()))))
 
+        # Work out the widths of the cell background bars for the whole column at once
+        percentages = bar_percentages(header, list(col_vals.values()))
+
+        # Add the data table cells
+        for s_name, val, percentage in zip(col_vals.keys(), col_vals.values(), percentages):
+            try:
+                valstring = str(header["format"].format(val))
+            except ValueError:
                 try:
-                    valstring = str(header["format"].format(val))
+                    valstring = str(header["format"].format(float(val)))
                 except ValueError:
-                    try:
-                        valstring = str(header["format"].format(float(val)))
-                    except ValueError:
-                        valstring = str(val)
-                except:
                     valstring = str(val)
+            except:
+                valstring = str(val)
+
+            # This is horrible, but Python locale settings are worse
+            if config.thousandsSep_format is None:
+                config.thousandsSep_format = '<span class="mqc_thousandSep"></span>'
+            if config.decimalPoint_format is None:
+                config.decimalPoint_format = "."
+            valstring = valstring.replace(".", "DECIMAL").replace(",", "THOUSAND")
+            valstring = valstring.replace("DECIMAL", config.decimalPoint_format).replace(
+                "THOUSAND", config.thousandsSep_format
+            )
+
+            # Percentage suffixes etc
+            valstring += header.get("suffix", "")
+
+            # Conditional formatting
+            badge_col = cond_formatting(val)
+            if badge_col is not None:
+                valstring = '<span class="badge" style="background-color:{}">{}</span>'.format(badge_col, valstring)
+
+            if s_name not in t_rows:
+                t_rows[s_name] = dict()
 
-                # This is horrible, but Python locale settings are worse
-                if config.thousandsSep_format is None:
-                    config.thousandsSep_format = '<span class="mqc_thousandSep"></span>'
-                if config.decimalPoint_format is None:
-                    config.decimalPoint_format = "."
-                valstring = valstring.replace(".", "DECIMAL").replace(",", "THOUSAND")
-                valstring = valstring.replace("DECIMAL", config.decimalPoint_format).replace(
-                    "THOUSAND", config.thousandsSep_format
-                )
-
-                # Percentage suffixes etc
-                valstring += header.get("suffix", "")
-
-                # Conditional formatting
-                # Build empty dict for cformatting matches
-                cmatches = {}
-                for cfc in cond_formatting_colours:
-                    for cfck in cfc:
-                        cmatches[cfck] = False
-                # Find general rules followed by column-specific rules
-                for cfk in ["all_columns", rid, table_id]:
-                    if cfk in cond_formatting_rules:
-                        # Loop through match types
-                        for ftype in cmatches.keys():
-                            # Loop through array of comparison types
-                            for cmp in cond_formatting_rules[cfk].get(ftype, []):
-                                try:
-                                    # Each comparison should be a dict with single key: val
-                                    if "s_eq" in cmp and str(cmp["s_eq"]).lower() == str(val).lower():
-                                        cmatches[ftype] = True
-                                    if "s_contains" in cmp and str(cmp["s_contains"]).lower() in str(val).lower():
-                                        cmatches[ftype] = True
-                                    if "s_ne" in cmp and str(cmp["s_ne"]).lower() != str(val).lower():
-                                        cmatches[ftype] = True
-                                    if "eq" in cmp and float(cmp["eq"]) == float(val):
-                                        cmatches[ftype] = True
-                                    if "ne" in cmp and float(cmp["ne"]) != float(val):
-                                        cmatches[ftype] = True
-                                    if "gt" in cmp and float(cmp["gt"]) < float(val):
-                                        cmatches[ftype] = True
-                                    if "lt" in cmp and float(cmp["lt"]) > float(val):
-                                        cmatches[ftype] = True
-                                except:
-                                    logger.warning(
-                                        "Not able to apply table conditional formatting to '{}' ({})".format(val, cmp)
-                                    )
-                # Apply HTML in order of config keys
-                badge_col = None
-                for cfc in cond_formatting_colours:
-                    for cfck in cfc:  # should always be one, but you never know
-                        if cmatches[cfck]:
-                            badge_col = cfc[cfck]
-                if badge_col is not None:
-                    valstring = '<span class="badge" style="background-color:{}">{}</span>'.format(badge_col, valstring)
-
-                # Categorical backgorund colours supplied
-                if val in header.get("bgcols", {}).keys():
-                    col = 'style="background-color:{} !important;"'.format(header["bgcols"][val])
-                    if s_name not in t_rows:
-                        t_rows[s_name] = dict()
-                    t_rows[s_name][rid] = '<td class="{rid} {h}" {c}>{v}</td>'.format(
-                        rid=rid, h=hide, c=col, v=valstring
-                    )
-
-                # Build table cell background colour bar
-                elif header["scale"]:
-                    if c_scale is not None:
-                        col = " background-color:{} !important;".format(c_scale.get_colour(val))
-                    else:
-                        col = ""
-                    bar_html = '<span class="bar" style="width:{}%;{}"></span>'.format(percentage, col)
-                    val_html = '<span class="val">{}</span>'.format(valstring)
-                    wrapper_html = '<div class="wrapper">{}{}</div>'.format(bar_html, val_html)
-
-                    if s_name not in t_rows:
-                        t_rows[s_name] = dict()
-                    t_rows[s_name][rid] = '<td class="data-coloured {rid} {h}">{c}</td>'.format(
-                        rid=rid, h=hide, c=wrapper_html
-                    )
-
-                # Scale / background colours are disabled
-                else:
-                    if s_name not in t_rows:
-                        t_rows[s_name] = dict()
-                    t_rows[s_name][rid] = '<td class="{rid} {h}">{v}</td>'.format(rid=rid, h=hide, v=valstring)
-
-                # Is this cell hidden or empty?
-                if s_name not in t_rows_empty:
-                    t_rows_empty[s_name] = dict()
-                t_rows_empty[s_name][rid] = header.get("hidden", False) or str(val).strip() == ""
+            # Categorical backgorund colours supplied
+            if val in header.get("bgcols", {}).keys():
+                t_rows[s_name][rid] = [valstring, None, None, header["bgcols"][val]]
+
+            # Build table cell background colour bar
+            elif header["scale"]:
+                col = col_colours[s_name] if c_scale is not None else None
+                t_rows[s_name][rid] = [valstring, percentage, col]
+
+            # Scale / background colours are disabled
+            else:
+                t_rows[s_name][rid] = [valstring]
+
+            # Is this cell hidden or empty?
+            if s_name not in t_rows_empty:
+                t_rows_empty[s_name] = dict()
+            t_rows_empty[s_name][rid] = header.get("hidden", False) or str(val).strip() == ""
 
         # Remove header if we don't have any filled cells for it
         if sum([len(rows) for rows in t_rows.values()]) == 0:
@@ -283,6 +365,9 @@ def make_table(dt):
     # Put everything together
     #
 
+    # Render large tables in the browser, only adding the rows that are in view to the page
+    virtual = dt.pconfig.get("virtual", len(t_rows) >= config.virtual_table_rows) and not config.simple_output
+
     # Buttons above the table
     html = ""
     if not config.simple_output:
@@ -356,9 +441,9 @@ def make_table(dt):
     html += """
         <div id="{tid}_container" class="mqc_table_container">
             <div class="table-responsive mqc-table-responsive {cc}">
-                <table id="{tid}" class="table table-condensed mqc_table" data-title="{title}">
+                <table id="{tid}" class="table table-condensed mqc_table{vc}" data-title="{title}">
         """.format(
-        tid=table_id, title=table_title, cc=collapse_class
+        tid=table_id, title=table_title, cc=collapse_class, vc=" mqc_table_virtual" if virtual else ""
     )
 
     # Build the header row
@@ -370,15 +455,28 @@ def make_table(dt):
     t_row_keys = t_rows.keys()
     if dt.pconfig.get("sortRows") is not False:
         t_row_keys = sorted(t_row_keys)
+    if virtual:
+        # The rows are added in the browser from the plot data, when they are scrolled into view
+        report.plot_data[table_id] = {
+            "plot_type": "table",
+            "columns": list(t_headers.keys()),
+            "rows": [[s_name, [t_rows[s_name].get(k) for k in t_headers]] for s_name in t_row_keys],
+        }
+        t_row_keys = []
+    t_body = []
     for s_name in t_row_keys:
         # Hide the row if all cells are empty or hidden
         row_hidden = ' style="display:none"' if all(t_rows_empty[s_name].values()) else ""
-        html += "<tr{}>".format(row_hidden)
+        t_body.append("<tr{}>".format(row_hidden))
         # Sample name row header
-        html += '<th class="rowheader" data-original-sn="{sn}">{sn}</th>'.format(sn=s_name)
+        t_body.append('<th class="rowheader" data-original-sn="{sn}">{sn}</th>'.format(sn=s_name))
         for k in t_headers:
-            html += t_rows[s_name].get(k, empty_cells[k])
-        html += "</tr>"
+            if k in t_rows[s_name]:
+                t_body.append(cell_html(k, t_hide[k], t_rows[s_name][k]))
+            else:
+                t_body.append(empty_cells[k])
+        t_body.append("</tr>")
+    html += "".join(t_body)
     html += "</tbody></table></div>"
     if len(t_rows) > 10 and config.collapse_tables:
         html += '<div class="mqc-table-expand"><span class="glyphicon glyphicon-chevron-down" aria-hidden="true"></span></div>'
@@ -4,6 +4,7 @@
 
 from collections import defaultdict, OrderedDict
 import logging
+import math
 import re
 
 from multiqc.utils import config, report
@@ -17,6 +18,8 @@ class datatable(object):
 
     def __init__(self, data, headers=None, pconfig=None):
         """Prepare data for use in a table or plot"""
+        import numpy as np
+
         if headers is None:
             headers = []
         if pconfig is None:
@@ -40,6 +43,7 @@ class datatable(object):
             "153,153,153",
         ]
         shared_keys = defaultdict(lambda: dict())
+        self.columns = list()
 
         # Go through each table section
         for idx, d in enumerate(data):
@@ -79,26 +83,24 @@ class datatable(object):
 
             # Ensure that keys are strings, not numeric
             keys = [str(k) for k in keys]
-            for k in list(headers[idx].keys()):
-                headers[idx][str(k)] = headers[idx].pop(k)
+            if not all(type(k) is str for k in headers[idx]):
+                for k in list(headers[idx].keys()):
+                    headers[idx][str(k)] = headers[idx].pop(k)
             # Ensure that all sample names are strings as well
             cdata = OrderedDict()
             for k, v in data[idx].items():
                 cdata[str(k)] = v
             data[idx] = cdata
-            for s_name in data[idx].keys():
-                for k in list(data[idx][s_name].keys()):
-                    data[idx][s_name][str(k)] = data[idx][s_name].pop(k)
+            for samp in data[idx].values():
+                if not all(type(k) is str for k in samp):
+                    for k in list(samp.keys()):
+                        samp[str(k)] = samp.pop(k)
+
+            # Collect the values for each column
+            self.columns.append(make_columns(data[idx]))
 
             # Check that we have some data in each column
-            empties = list()
-            for k in keys:
-                n = 0
-                for samp in d.values():
-                    if k in samp:
-                        n += 1
-                if n == 0:
-                    empties.append(k)
+            empties = [k for k in keys if k not in self.columns[idx]]
             for k in empties:
                 keys = [j for j in keys if j != k]
                 del headers[idx][k]
@@ -210,19 +212,14 @@ class datatable(object):
 
                 # Figure out the min / max if not supplied
                 if setdmax or setdmin:
-                    for s_name, samp in data[idx].items():
-                        try:
-                            val = float(samp[k])
-                            if callable(headers[idx][k]["modify"]):
-                                val = float(headers[idx][k]["modify"](val))
-                            if setdmax:
-                                headers[idx][k]["dmax"] = max(headers[idx][k]["dmax"], val)
-                            if setdmin:
-                                headers[idx][k]["dmin"] = min(headers[idx][k]["dmin"], val)
-                        except (ValueError, TypeError):
-                            val = samp[k]  # couldn't convert to float - keep as a string
-                        except KeyError:
-                            pass  # missing data - skip
+                    # Non-numeric values and missing data are skipped
+                    vals = self.columns[idx][k].modified_floats(headers[idx][k]["modify"])
+                    vals = vals[~np.isnan(vals)]
+                    if len(vals) > 0:
+                        if setdmax:
+                            headers[idx][k]["dmax"] = max(headers[idx][k]["dmax"], float(vals.max()))
+                        if setdmin:
+                            headers[idx][k]["dmin"] = min(headers[idx][k]["dmin"], float(vals.min()))
                     # Limit auto-generated scales with floor, ceiling and minRange.
                     if headers[idx][k]["ceiling"] is not None and headers[idx][k]["max"] is None:
                         headers[idx][k]["dmax"] = min(headers[idx][k]["dmax"], float(headers[idx][k]["ceiling"]))
@@ -288,3 +285,89 @@ class datatable(object):
             for idx, k in self.headers_in_order[bucket]:
                 res.append((idx, k, self.headers[idx][k]))
         return res
+
+
+class datacolumn(object):
+    """Values of one table column, held by column rather than by sample.
+    Keeps the names of the samples with a value in the column, the raw values,
+    and the values as a float array for vectorised calculations."""
+
+    def __init__(self, s_names, values):
+        self.s_names = s_names
+        self.values = values
+        # Numeric values, NaN where the value can't be converted to a float
+        self.floats, self.numeric = to_float_array(values)
+
+    def items(self):
+        """Sample names and raw values, in sample order"""
+        return zip(self.s_names, self.values)
+
+    def modified_floats(self, modify=None):
+        """Numeric values with a header modify function applied, NaN where not numeric"""
+        floats = self.floats.copy()
+        if callable(modify) and self.numeric.any():
+            floats[self.numeric] = apply_modify(modify, self.floats[self.numeric])
+        return floats
+
+
+def make_columns(data):
+    """Convert a dict of samples, each a dict of values, to a dict of columns"""
+    columns = OrderedDict()
+    for s_name, samp in data.items():
+        for k, val in samp.items():
+            if k not in columns:
+                columns[k] = ([], [])
+            columns[k][0].append(s_name)
+            columns[k][1].append(val)
+    return OrderedDict((k, datacolumn(s_names, values)) for k, (s_names, values) in columns.items())
+
+
+def to_float_array(values):
+    """Convert a list of values to a float array, and a mask of the values that could be converted"""
+    import numpy as np
+
+    if all(type(val) in (int, float) for val in values):
+        try:
+            return np.array(values, dtype=float), np.ones(len(values), dtype=bool)
+        except OverflowError:
+            pass
+    floats = np.full(len(values), np.nan)
+    numeric = np.zeros(len(values), dtype=bool)
+    for i, val in enumerate(values):
+        try:
+            floats[i] = float(val)
+            numeric[i] = True
+        except (ValueError, TypeError, OverflowError):
+            pass
+    return floats, numeric
+
+
+def apply_modify(modify, floats):
+    """Apply a header modify function to an array of floats.
+    Most modify functions are simple arithmetic that works on the whole array at once. The
+    result is checked against calling the function with single values, and if the function
+    doesn't work on arrays or gives a different result, it is called with one value at a time.
+    Values that the function doesn't return a number for are NaN."""
+    import numpy as np
+
+    try:
+        with np.errstate(all="ignore"):
+            result = np.asarray(modify(floats), dtype=float)
+        if result.shape != floats.shape:
+            raise ValueError("modify function did not return an array")
+        nonzero = np.flatnonzero(np.isfinite(floats) & (floats != 0))
+        check_idxs = {nonzero[0], nonzero[len(nonzero) // 2], nonzero[-1]} if len(nonzero) > 0 else {0}
+        for i in check_idxs:
+            expected = float(modify(float(floats[i])))
+            if not (expected == result[i] or (math.isnan(expected) and math.isnan(result[i]))):
+                raise ValueError("modify function gives a different result for arrays")
+        return result
+    except Exception:
+        pass
+    result = np.full(len(floats), np.nan)
+    for i, val in enumerate(floats.tolist()):
+        try:
+            result[i] = float(modify(val))
+        except (ValueError, TypeError):
+            pass
+    return result
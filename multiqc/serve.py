@@ -0,0 +1,346 @@
+#!/usr/bin/env python
+
+""" MultiQC report server. Keeps a Python process running with MultiQC and its modules
+already loaded, and makes a report for every job sent to it over HTTP, on a Unix socket
+that only the same user can use, or on a local port with a token. Started with
+'multiqc serve'. Jobs are run one at a time, each in a new ReportContext so that
+nothing is left over from the job before. """
+
+import hmac
+import http.server
+import json
+import os
+import secrets
+import shutil
+import socketserver
+import stat
+import sys
+import time
+
+import rich_click as click
+
+from . import multiqc
+from .plots import flat_queue
+from .utils import config, context, log, search_cache
+
+logger = config.logger
+
+# Arguments of multiqc.run() that jobs can set. Not --incremental, which would load
+# saved module output from any directory that the job names.
+job_args = [
+    "analysis_dir",
+    "dirs",
+    "dirs_depth",
+    "no_clean_sname",
+    "title",
+    "report_comment",
+    "template",
+    "module_tag",
+    "module",
+    "exclude",
+    "outdir",
+    "ignore",
+    "ignore_samples",
+    "use_filename_as_sample_name",
+    "replace_names",
+    "sample_names",
+    "sample_filters",
+    "file_list",
+    "filename",
+    "make_data_dir",
+    "no_data_dir",
+    "data_format",
+    "zip_data_dir",
+    "force",
+    "ignore_symlinks",
+    "no_report",
+    "export_plots",
+    "plots_flat",
+    "plots_interactive",
+    "lint",
+    "make_pdf",
+    "no_megaqc_upload",
+    "config_file",
+    "cl_config",
+    "verbose",
+    "quiet",
+    "profile_runtime",
+    "search_threads",
+    "search_cache",
+    "no_search_cache",
+    "parallel_modules",
+    "parallel_plots",
+    "no_ansi",
+    "custom_css_files",
+]
+
+# Config options that jobs can't set, in their config or in config files
+job_config_overrides = {"incremental": False}
+
+
+@click.command(context_settings=dict(help_option_names=["-h", "--help"]))
+@click.option(
+    "--socket",
+    "socket_path",
+    type=click.Path(),
+    help="Unix socket to listen on [default: multiqc_serve.sock in $XDG_RUNTIME_DIR or the MultiQC cache directory]",
+)
+@click.option("--port", type=int, help="Listen on a TCP port instead of a Unix socket. Requests need the token.")
+@click.option("--host", default="127.0.0.1", show_default=True, help="Address to listen on with --port")
+@click.option(
+    "--token",
+    envvar="MULTIQC_SERVE_TOKEN",
+    help="Token for requests with --port, sent as 'Authorization: Bearer <token>'. Generated if not given.",
+)
+@click.option("--no-preload", is_flag=True, help="Don't import all MultiQC modules when the server starts")
+@click.option("-v", "--verbose", count=True, default=0, help="Increase output verbosity")
+@click.option("--no-ansi", is_flag=True, help="Disable coloured log output")
+def serve_cli(**kwargs):
+    """Run MultiQC as a server, that makes a report for each job it receives.
+
+    Jobs are POSTed to [blue bold]/run[/] as JSON objects with the arguments of [blue bold]multiqc.run()[/],
+    for example [blue bold]{"analysis_dir": ["/data/run_1"], "outdir": "/reports/run_1"}[/].
+    Use [blue bold]"config"[/] to set config options for one job.
+    Listens on a Unix socket that only this user can use, or with [blue bold]--port[/] on a TCP port,
+    where requests need the token.
+    """
+    serve(**kwargs)
+
+
+def serve(socket_path=None, port=None, host="127.0.0.1", token=None, no_preload=False, verbose=0, no_ansi=False):
+    """
+    Start the report server and handle jobs until it is stopped. Listens on a Unix socket
+    that only this user can use, or on a TCP port if one is given or Unix sockets aren't
+    supported. Any local user can connect to a port, so requests to it need the token.
+    """
+    log.init_log(logger, loglevel=log.LEVELS.get(min(verbose, 1), "INFO"), no_ansi=no_ansi)
+    # The server only logs to the console. Jobs have their own log handlers, which only get job messages.
+    log.close_log_file(logger)
+    remove_tmp_log()
+
+    if not no_preload:
+        preload()
+
+    unix_sockets = hasattr(socketserver, "UnixStreamServer")
+    if socket_path is not None and not unix_sockets:
+        logger.error("Unix sockets are not supported on this platform, use --port instead")
+        sys.exit(1)
+    if port is None and not unix_sockets:
+        port = 7650
+    if port is None:
+        if socket_path is None:
+            socket_path = default_socket_path()
+        # Remove the socket left behind by a server that didn't shut down cleanly
+        if os.path.exists(socket_path) and stat.S_ISSOCK(os.stat(socket_path).st_mode):
+            os.remove(socket_path)
+        # Only this user can send jobs. Set with umask so that the socket is never open to others.
+        old_umask = os.umask(0o177)
+        try:
+            server = UnixJobServer(socket_path, JobHandler)
+        finally:
+            os.umask(old_umask)
+        server.token = None
+        address = socket_path
+    else:
+        socket_path = None
+        server = TCPJobServer((host, port), JobHandler)
+        server.token = token if token else new_token()
+        address = "http://{}:{}".format(host, port)
+    server.num_jobs = 0
+    server.start_time = time.time()
+
+    logger.info("MultiQC server listening on {}".format(address))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("Stopping MultiQC server")
+    finally:
+        server.server_close()
+        if socket_path is not None and os.path.exists(socket_path):
+            os.remove(socket_path)
+
+
+def default_socket_path():
+    """Unix socket in the user's runtime directory if there is one, otherwise in the MultiQC cache directory"""
+    socket_dir = os.environ.get("XDG_RUNTIME_DIR") or search_cache.get_cache_dir()
+    os.makedirs(socket_dir, mode=0o700, exist_ok=True)
+    return os.path.join(socket_dir, "multiqc_serve.sock")
+
+
+def new_token():
+    """Make a token for requests, and write it to a file that only this user can read"""
+    token = secrets.token_urlsafe(32)
+    token_fn = os.path.join(search_cache.get_cache_dir(), "serve_token")
+    os.makedirs(os.path.dirname(token_fn), mode=0o700, exist_ok=True)
+    if os.path.exists(token_fn):
+        os.remove(token_fn)
+    with os.fdopen(os.open(token_fn, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600), "w") as fh:
+        fh.write(token + "\n")
+    logger.info("Token for requests written to {}".format(token_fn))
+    return token
+
+
+def preload():
+    """Import all modules, plot functions and matplotlib, so that jobs don't have to"""
+    start = time.time()
+    for name, entry_point in config.avail_modules.items():
+        try:
+            entry_point.load()
+        except Exception as e:
+            logger.debug("Could not preload module '{}': {}".format(name, e))
+    config.avail_templates[config.template].load()
+    # Imported to load them, they are used by the modules
+    from .plots import bargraph, beeswarm, boxplot, heatmap, linegraph, scatter, table
+
+    try:
+        flat_queue.pyplot()
+    except Exception:
+        pass  # Falls back to interactive plots in each job
+    logger.info("Loaded {} modules in {:.2f}s".format(len(config.avail_modules), time.time() - start))
+
+
+def remove_tmp_log():
+    """Delete the temporary log file of this thread's ReportContext, if it wasn't moved to the data directory"""
+    if log.log_tmp_dir is not None:
+        shutil.rmtree(log.log_tmp_dir, ignore_errors=True)
+        log.log_tmp_dir = None
+
+
+def check_job(job):
+    """Raise ValueError if a job isn't a dict of multiqc.run() arguments"""
+    if not isinstance(job, dict):
+        raise ValueError("Job must be a JSON object with multiqc.run() arguments")
+    if not job.get("analysis_dir"):
+        raise ValueError("Job has no 'analysis_dir'")
+    unknown_args = [k for k in job if k not in job_args and k != "config"]
+    if len(unknown_args) > 0:
+        raise ValueError("Job arguments not allowed: {}".format(", ".join(unknown_args)))
+    if not isinstance(job.get("config", {}), dict):
+        raise ValueError("Job 'config' must be a JSON object of config options")
+    config_not_allowed = [k for k in job.get("config", {}) if k in job_config_overrides]
+    if len(config_not_allowed) > 0:
+        raise ValueError("Job config options not allowed: {}".format(", ".join(config_not_allowed)))
+
+
+def run_job(job):
+    """Make a report for a job. Returns the exit code, output paths and timings."""
+    args = dict(job)
+    if isinstance(args["analysis_dir"], str):
+        args["analysis_dir"] = [args["analysis_dir"]]
+    # Config options for this job are applied like --cl-config, after any config files,
+    # then the options that jobs can't set, in case a config file set them
+    args["cl_config"] = list(args.get("cl_config", []))
+    if args.get("config"):
+        args["cl_config"].append(json.dumps(args["config"]))
+    args["cl_config"].append(json.dumps(job_config_overrides))
+    args.pop("config", None)
+
+    exit_code = 0
+    error = None
+    with context.ReportContext() as ctx:
+        try:
+            exit_code = multiqc.run(**args)["sys_exit_code"]
+        except SystemExit as e:
+            exit_code = e.code or 0
+        except Exception as e:
+            exit_code = 1
+            error = e
+        finally:
+            # A failed job can leave plots being drawn in worker processes
+            flat_queue.close()
+            log.remove_handlers(logger)
+            remove_tmp_log()
+
+    if error is not None:
+        logger.error("MultiQC job failed: {}".format(error))
+        logger.debug(error, exc_info=error)
+
+    def output_path(config_key):
+        # Not set if the job stopped early
+        path = getattr(ctx.config, config_key, None)
+        return os.path.abspath(path) if isinstance(path, str) and os.path.exists(path) else None
+
+    runtimes = ctx.report.runtimes
+    return {
+        "exit_code": exit_code,
+        "error": None if error is None else str(error),
+        "report": output_path("output_fn"),
+        "data_dir": output_path("data_dir"),
+        "plots_dir": output_path("plots_dir"),
+        "timings": {
+            "total": time.time() - ctx.start_time,
+            "search": runtimes["total_sp"],
+            "modules": runtimes["total_mods"],
+            "compression": runtimes["total_compression"],
+            "module_times": dict(runtimes["mods"]),
+        },
+    }
+
+
+class JobHandler(http.server.BaseHTTPRequestHandler):
+    """HTTP requests to the server: POST /run to make a report, GET /status for server details"""
+
+    def do_GET(self):
+        if not self.authorised():
+            return
+        if self.path != "/status":
+            return self.send_json(404, {"error": "Not found: {}".format(self.path)})
+        status = {
+            "version": config.version,
+            "jobs": self.server.num_jobs,
+            "uptime": time.time() - self.server.start_time,
+        }
+        self.send_json(200, status)
+
+    def do_POST(self):
+        if not self.authorised():
+            return
+        if self.path != "/run":
+            return self.send_json(404, {"error": "Not found: {}".format(self.path)})
+        try:
+            job = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            check_job(job)
+        except ValueError as e:
+            return self.send_json(400, {"error": str(e)})
+        result = run_job(job)
+        self.server.num_jobs += 1
+        logger.info("Job {} finished in {:.2f}s".format(self.server.num_jobs, result["timings"]["total"]))
+        self.send_json(200 if result["error"] is None else 500, result)
+
+    def authorised(self):
+        """Check the request's token if the server needs one, sending a 401 response if it's wrong"""
+        if self.server.token is None:
+            return True
+        expected = "Bearer {}".format(self.server.token)
+        if hmac.compare_digest(self.headers.get("Authorization", "").encode("utf-8"), expected.encode("utf-8")):
+            return True
+        self.send_json(401, {"error": "Missing or wrong token, send 'Authorization: Bearer <token>'"})
+        return False
+
+    def send_json(self, status, data):
+        body = (json.dumps(data, indent=4) + "\n").encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self):
+        # Clients connected to a Unix socket don't have an address
+        return self.client_address[0] if self.client_address else "socket"
+
+    def log_message(self, format, *args):
+        logger.debug("Request from {}: {}".format(self.address_string(), format % args))
+
+
+class TCPJobServer(socketserver.TCPServer):
+    allow_reuse_address = True
+    # Jobs that arrive while a report is being made wait for it to finish
+    request_queue_size = 64
+
+
+# Unix sockets aren't available on Windows
+if hasattr(socketserver, "UnixStreamServer"):
+
+    class UnixJobServer(socketserver.UnixStreamServer):
+        request_queue_size = 64
@@ -0,0 +1,325 @@
+////////////////////////////////////////////////
+// Plot data decompression
+////////////////////////////////////////////////
+
+// Plot data for each plot in the report, from the compressed plot data elements.
+// The data for a plot is only decompressed the first time that it is used.
+// Templates that embed all plot data as one LZString compressed string
+// (report.plot_compressed_json) can pass that string instead.
+function mqc_lazy_plotdata(elements) {
+  if (typeof elements === "string") {
+    var all_plots = JSON.parse(LZString.decompressFromBase64(elements));
+    Object.keys(all_plots).forEach(function (pid) {
+      mqc_decode_typed_arrays(all_plots[pid]);
+    });
+    return all_plots;
+  }
+  var plots = {};
+  function set_plot(pid, plot) {
+    Object.defineProperty(plots, pid, { value: plot, writable: true, enumerable: true, configurable: true });
+  }
+  Array.prototype.forEach.call(elements, function (el) {
+    var pid = el.getAttribute("data-plot-id");
+    Object.defineProperty(plots, pid, {
+      enumerable: true,
+      configurable: true,
+      get: function () {
+        var json = mqc_decompress_plotdata(el.textContent, el.getAttribute("data-compression"));
+        var plot = mqc_decode_typed_arrays(JSON.parse(json));
+        set_plot(pid, plot);
+        // Free the compressed string
+        el.textContent = "";
+        return plot;
+      },
+      set: function (plot) {
+        set_plot(pid, plot);
+      },
+    });
+  });
+  return plots;
+}
+
+// Decompress the base64-encoded report plot data to a JSON string.
+// `compression` is the algorithm that MultiQC used: "deflate" or "lzstring".
+function mqc_decompress_plotdata(compressed, compression) {
+  if (compression == "lzstring") {
+    return LZString.decompressFromBase64(compressed);
+  }
+  var binary = atob(compressed);
+  var bytes = new Uint8Array(binary.length);
+  for (var i = 0; i < binary.length; i++) {
+    bytes[i] = binary.charCodeAt(i);
+  }
+  return new TextDecoder("utf-8").decode(mqc_inflate(bytes));
+}
+
+// Minimal decoder for raw DEFLATE data (RFC 1951), as written by Python's zlib
+var mqc_inflate = (function () {
+  // Length and distance codes: base values and number of extra bits
+  var length_base = [3, 4, 5, 6, 7, 8, 9, 10, 11, 13, 15, 17, 19, 23, 27, 31, 35, 43, 51, 59, 67, 83, 99, 115, 131, 163, 195, 227, 258];
+  var length_bits = [0, 0, 0, 0, 0, 0, 0, 0, 1, 1, 1, 1, 2, 2, 2, 2, 3, 3, 3, 3, 4, 4, 4, 4, 5, 5, 5, 5, 0];
+  var dist_base = [
+    1, 2, 3, 4, 5, 7, 9, 13, 17, 25, 33, 49, 65, 97, 129, 193, 257, 385, 513, 769, 1025, 1537, 2049, 3073, 4097, 6145,
+    8193, 12289, 16385, 24577,
+  ];
+  var dist_bits = [0, 0, 0, 0, 1, 1, 2, 2, 3, 3, 4, 4, 5, 5, 6, 6, 7, 7, 8, 8, 9, 9, 10, 10, 11, 11, 12, 12, 13, 13];
+  // Order in which code length code lengths are stored
+  var clen_order = [16, 17, 18, 0, 8, 7, 9, 6, 10, 5, 11, 4, 12, 3, 13, 2, 14, 1, 15];
+
+  // Huffman tree: number of codes of each length, and symbols ordered by code
+  function Tree() {
+    this.counts = new Uint16Array(16);
+    this.symbols = new Uint16Array(288);
+  }
+
+  function build_tree(tree, lengths, offset, num) {
+    var offsets = new Uint16Array(16);
+    var i, sum;
+    tree.counts.fill(0);
+    for (i = 0; i < num; i++) {
+      tree.counts[lengths[offset + i]]++;
+    }
+    tree.counts[0] = 0;
+    for (i = 0, sum = 0; i < 16; i++) {
+      offsets[i] = sum;
+      sum += tree.counts[i];
+    }
+    for (i = 0; i < num; i++) {
+      if (lengths[offset + i]) {
+        tree.symbols[offsets[lengths[offset + i]]++] = i;
+      }
+    }
+  }
+
+  // Fixed Huffman trees for block type 1
+  var fixed_lit = new Tree();
+  var fixed_dist = new Tree();
+  (function () {
+    var lengths = new Uint8Array(288);
+    lengths.fill(8, 0, 144);
+    lengths.fill(9, 144, 256);
+    lengths.fill(7, 256, 280);
+    lengths.fill(8, 280, 288);
+    build_tree(fixed_lit, lengths, 0, 288);
+    lengths.fill(5, 0, 30);
+    build_tree(fixed_dist, lengths, 0, 30);
+  })();
+
+  return function (src) {
+    var src_pos = 0;
+    var tag = 0;
+    var bitcount = 0;
+    var out = new Uint8Array(Math.max(src.length * 4, 1024));
+    var out_pos = 0;
+    var lit_tree = new Tree();
+    var dist_tree = new Tree();
+    var clen_tree = new Tree();
+    var lengths = new Uint8Array(288 + 32);
+
+    // Make sure that at least n bits are buffered
+    function need(n) {
+      while (bitcount < n) {
+        tag |= (src[src_pos++] | 0) << bitcount;
+        bitcount += 8;
+      }
+    }
+
+    function read_bits(n, base) {
+      if (!n) {
+        return base;
+      }
+      need(n);
+      var val = tag & ((1 << n) - 1);
+      tag >>>= n;
+      bitcount -= n;
+      return val + base;
+    }
+
+    function decode_symbol(tree) {
+      need(16);
+      var sum = 0;
+      var cur = 0;
+      var len = 0;
+      do {
+        cur = 2 * cur + (tag & 1);
+        tag >>>= 1;
+        len++;
+        sum += tree.counts[len];
+        cur -= tree.counts[len];
+      } while (cur >= 0);
+      bitcount -= len;
+      return tree.symbols[sum + cur];
+    }
+
+    function ensure_space(n) {
+      if (out_pos + n > out.length) {
+        var bigger = new Uint8Array(Math.max(out.length * 2, out_pos + n));
+        bigger.set(out);
+        out = bigger;
+      }
+    }
+
+    function read_dynamic_trees() {
+      var hlit = read_bits(5, 257);
+      var hdist = read_bits(5, 1);
+      var hclen = read_bits(4, 4);
+      var i;
+      lengths.fill(0, 0, 19);
+      for (i = 0; i < hclen; i++) {
+        lengths[clen_order[i]] = read_bits(3, 0);
+      }
+      build_tree(clen_tree, lengths, 0, 19);
+      for (i = 0; i < hlit + hdist; ) {
+        var sym = decode_symbol(clen_tree);
+        var repeat, fill;
+        if (sym < 16) {
+          lengths[i++] = sym;
+          continue;
+        } else if (sym == 16) {
+          fill = lengths[i - 1];
+          repeat = read_bits(2, 3);
+        } else if (sym == 17) {
+          fill = 0;
+          repeat = read_bits(3, 3);
+        } else {
+          fill = 0;
+          repeat = read_bits(7, 11);
+        }
+        lengths.fill(fill, i, i + repeat);
+        i += repeat;
+      }
+      build_tree(lit_tree, lengths, 0, hlit);
+      build_tree(dist_tree, lengths, hlit, hdist);
+    }
+
+    function inflate_block(lt, dt) {
+      while (true) {
+        var sym = decode_symbol(lt);
+        if (sym < 256) {
+          ensure_space(1);
+          out[out_pos++] = sym;
+        } else if (sym == 256) {
+          return;
+        } else {
+          sym -= 257;
+          var len = read_bits(length_bits[sym], length_base[sym]);
+          var dsym = decode_symbol(dt);
+          var from = out_pos - read_bits(dist_bits[dsym], dist_base[dsym]);
+          ensure_space(len);
+          for (var i = 0; i < len; i++) {
+            out[out_pos++] = out[from + i];
+          }
+        }
+      }
+    }
+
+    function inflate_stored() {
+      // Skip to the next byte boundary, returning any whole buffered bytes to the input
+      src_pos -= bitcount >> 3;
+      tag = 0;
+      bitcount = 0;
+      var len = src[src_pos] | (src[src_pos + 1] << 8);
+      src_pos += 4;
+      ensure_space(len);
+      out.set(src.subarray(src_pos, src_pos + len), out_pos);
+      src_pos += len;
+      out_pos += len;
+    }
+
+    var final_block;
+    do {
+      final_block = read_bits(1, 0);
+      var block_type = read_bits(2, 0);
+      if (block_type == 0) {
+        inflate_stored();
+      } else if (block_type == 1) {
+        inflate_block(fixed_lit, fixed_dist);
+      } else if (block_type == 2) {
+        read_dynamic_trees();
+        inflate_block(lit_tree, dist_tree);
+      } else {
+        throw new Error("Invalid DEFLATE block type");
+      }
+    } while (!final_block);
+
+    return out.subarray(0, out_pos);
+  };
+})();
+
+////////////////////////////////////////////////
+// Typed array plot series
+////////////////////////////////////////////////
+
+// Unpack the numeric plot series that MultiQC stored as base64 typed arrays
+// (config.plot_data_encoding), back to the arrays that the plotting code expects.
+function mqc_decode_typed_arrays(plot) {
+  if (plot.plot_type == "xy_line" || plot.plot_type == "bar_graph") {
+    var x_axes = (plot.typed_x_axes || []).map(mqc_unpack_typed);
+    delete plot.typed_x_axes;
+    plot.datasets.forEach(function (dataset) {
+      dataset.forEach(function (series) {
+        if (series.data !== undefined) {
+          series.data = mqc_decode_typed(series.data, x_axes);
+        }
+      });
+    });
+  } else if (plot.plot_type == "beeswarm") {
+    plot.datasets = plot.datasets.map(function (dataset) {
+      return mqc_decode_typed(dataset);
+    });
+  } else if (plot.plot_type == "heatmap") {
+    plot.rows = mqc_decode_typed(plot.rows);
+  }
+  return plot;
+}
+
+// Decode one packed series. Anything else is returned as it is.
+function mqc_decode_typed(val, x_axes) {
+  if (val === null || typeof val !== "object" || val.mqc_typed === undefined) {
+    return val;
+  }
+  if (val.mqc_typed == "xy") {
+    var x = x_axes[val.x];
+    return mqc_unpack_typed(val.y).map(function (y, i) {
+      return [x[i], y];
+    });
+  }
+  if (val.mqc_typed == "matrix") {
+    var values = mqc_unpack_typed(val.values);
+    var rows = [];
+    for (var i = 0; i < values.length; i += val.ncols) {
+      rows.push(values.slice(i, i + val.ncols));
+    }
+    return rows;
+  }
+  return mqc_unpack_typed(val);
+}
+
+// Decode a base64 little-endian Float32/Float64 buffer to an array of numbers, with NaN as null
+var mqc_unpack_typed = (function () {
+  var little_endian = new Uint8Array(new Uint16Array([1]).buffer)[0] == 1;
+
+  return function (packed) {
+    var size = packed.mqc_typed == "f4" ? 4 : 8;
+    var binary = atob(packed.data);
+    var bytes = new Uint8Array(binary.length);
+    for (var i = 0; i < binary.length; i++) {
+      // Typed arrays use the byte order of the platform
+      bytes[little_endian ? i : i - (i % size) + size - 1 - (i % size)] = binary.charCodeAt(i);
+    }
+    var values = size == 4 ? new Float32Array(bytes.buffer) : new Float64Array(bytes.buffer);
+    var out = new Array(values.length);
+    for (var j = 0; j < values.length; j++) {
+      var v = values[j];
+      if (isNaN(v)) {
+        out[j] = null;
+      } else if (size == 4 && v !== Math.floor(v)) {
+        // Drop the digits that Float32 can't hold, so that 0.1 isn't shown as 0.10000000149
+        out[j] = parseFloat(v.toPrecision(7));
+      } else {
+        out[j] = v;
+      }
+    }
+    return out;
+  };
+})();
@@ -22,8 +22,11 @@ $(function () {
   // Show loading warning
   $(".mqc_loading_warning").show();
 
-  // Decompress the JSON plot data
-  mqc_plots = JSON.parse(LZString.decompressFromBase64(mqc_compressed_plotdata));
+  // Get the JSON plot data, decompressed when each plot is used
+  mqc_plots = mqc_lazy_plotdata(mqc_compressed_plotdata);
+
+  // Render the tables that are saved in the plot data
+  mqc_vtables_init();
 
   // HighCharts Defaults
   window.HCDefaults = $.extend(true, {}, Highcharts.getOptions(), {});
@@ -61,21 +64,51 @@ $(function () {
     },
   });
 
-  // Render plots on page load
-  $(".hc-plot.not_rendered:visible:not(.gt_max_num_ds)").each(function () {
-    var target = $(this).attr("id");
+  // Render plots as they are scrolled into view, so that the data for plots
+  // further down the page is only decompressed when it's needed
+  function render_on_load(target) {
     // Only one point per dataset, so multiply limit by arbitrary number.
     var max_num = mqc_config["num_datasets_plot_limit"] * 50;
     // Deferring each plot call prevents browser from locking up
     setTimeout(function () {
-      plot_graph(target, undefined, max_num);
-      if ($(".hc-plot.not_rendered:visible:not(.gt_max_num_ds)").length == 0) {
-        $(".mqc_loading_warning").hide();
+      if ($("#" + target).is(".not_rendered:visible:not(.gt_max_num_ds)")) {
+        plot_graph(target, undefined, max_num);
       }
     }, 50);
-  });
-  if ($(".hc-plot.not_rendered:visible:not(.gt_max_num_ds)").length == 0) {
-    $(".mqc_loading_warning").hide();
+  }
+  // Runs after the plots that have been deferred so far
+  function hide_loading_warning() {
+    setTimeout(function () {
+      $(".mqc_loading_warning").hide();
+    }, 50);
+  }
+  if ("IntersectionObserver" in window) {
+    var plot_observer = new IntersectionObserver(
+      function (entries) {
+        entries.forEach(function (entry) {
+          if (entry.isIntersecting) {
+            plot_observer.unobserve(entry.target);
+            render_on_load(entry.target.id);
+          }
+        });
+        hide_loading_warning();
+      },
+      { rootMargin: "500px 0px" }
+    );
+    $(".hc-plot.not_rendered:not(.gt_max_num_ds)").each(function () {
+      // Skip plots without plot data, such as the table scatter plot
+      if (this.id in mqc_plots) {
+        plot_observer.observe(this);
+      }
+    });
+    if ($(".hc-plot.not_rendered:not(.gt_max_num_ds)").length == 0) {
+      hide_loading_warning();
+    }
+  } else {
+    $(".hc-plot.not_rendered:visible:not(.gt_max_num_ds)").each(function () {
+      render_on_load($(this).attr("id"));
+    });
+    hide_loading_warning();
   }
 
   // Render a plot when clicked
@@ -1420,6 +1453,17 @@ function plot_beeswarm_graph(target, ds) {
 }
 
 // Heatmap plot
+// Heatmap cells as [x,y,value] for each value of a matrix, given as a list of rows
+function heatmap_cells(rows) {
+  var cells = [];
+  for (var i = 0; i < rows.length; i++) {
+    for (var j = 0; j < rows[i].length; j++) {
+      cells.push([j, i, rows[i][j]]);
+    }
+  }
+  return cells;
+}
+
 function plot_heatmap(target, ds) {
   if (mqc_plots[target] === undefined || mqc_plots[target]["plot_type"] !== "heatmap") {
     return false;
@@ -1436,9 +1480,9 @@ function plot_heatmap(target, ds) {
     config["ycats_samples"] = true;
   }
 
-  // Make a clone of the data, so that we can mess with it,
+  // Make the data from the rows of the matrix, so that we can mess with it,
   // while keeping the original data in tact
-  var data = JSON.parse(JSON.stringify(mqc_plots[target]["data"]));
+  var data = heatmap_cells(mqc_plots[target]["rows"]);
   var xcats = JSON.parse(JSON.stringify(mqc_plots[target]["xcats"]));
   var ycats = JSON.parse(JSON.stringify(mqc_plots[target]["ycats"]));
   // "xcats" and "ycats" are labels of columns and rows respectively
@@ -1503,8 +1547,8 @@ function plot_heatmap(target, ds) {
           }
         });
       }
-      // Reshape the data - needs deepcopy as indexes are updated
-      var newdata = JSON.parse(JSON.stringify(mqc_plots[target]["data"]));
+      // Reshape the data - needs a new copy as indexes are updated
+      var newdata = heatmap_cells(mqc_plots[target]["rows"]);
       var new_xcats = [],
         new_ycats = [];
       var xidx = 0,
@@ -47,15 +47,24 @@ $(function () {
     var strip_non_numeric = function (node) {
       return node.innerText.replace(/[^\d.-]/g, "");
     };
-    $(".mqc_table").tablesorter({ sortInitialOrder: "desc", textExtraction: strip_non_numeric });
+    // Virtual tables are sorted in mqc_vtable_sort()
+    $(".mqc_table")
+      .not(".mqc_table_virtual")
+      .tablesorter({ sortInitialOrder: "desc", textExtraction: strip_non_numeric });
 
     // Update tablesorter if samples renamed
     $(document).on("mqc_renamesamples", function (e, f_texts, t_texts, regex_mode) {
-      $(".mqc_table").trigger("update");
+      $(".mqc_table").not(".mqc_table_virtual").trigger("update");
     });
 
     // Copy table contents to clipboard
-    var clipboard = new Clipboard(".mqc_table_copy_btn");
+    // Virtual tables only have some of their rows in the page, so are copied from the plot data
+    var clipboard = new Clipboard(".mqc_table_copy_btn", {
+      text: function (trigger) {
+        var vt = mqc_vtables[String($(trigger).data("clipboard-target")).replace(/^#/, "")];
+        return vt === undefined ? undefined : mqc_vtable_tsv(vt);
+      },
+    });
     clipboard.on("success", function (e) {
       e.clearSelection();
     });
@@ -115,22 +124,26 @@ $(function () {
         }
       });
       // Hide empty rows
-      $(target + " tbody tr").show();
-      $(target + " tbody tr").each(function () {
-        var hasVal = false;
-        $(this)
-          .find("td:visible")
-          .each(function () {
-            if (!$(this).hasClass("sorthandle") && $(this).text() !== "") {
-              hasVal = true;
-            }
-          });
-        if (!hasVal) {
-          $(this).hide();
-        }
-      });
+      if (mqc_vtables[target.replace(/^#/, "")] !== undefined) {
+        mqc_vtable_update(mqc_vtables[target.replace(/^#/, "")]);
+      } else {
+        $(target + " tbody tr").show();
+        $(target + " tbody tr").each(function () {
+          var hasVal = false;
+          $(this)
+            .find("td:visible")
+            .each(function () {
+              if (!$(this).hasClass("sorthandle") && $(this).text() !== "") {
+                hasVal = true;
+              }
+            });
+          if (!hasVal) {
+            $(this).hide();
+          }
+        });
+        $(target + "_numrows").text($(target + " tbody tr:visible").length);
+      }
       // Update counts
-      $(target + "_numrows").text($(target + " tbody tr:visible").length);
       $(target + "_numcols").text($(target + " thead th:visible").length - 1);
     }
 
@@ -158,8 +171,8 @@ $(function () {
     // highlight samples
     $(document).on("mqc_highlights", function (e, f_texts, f_cols, regex_mode) {
       $(".mqc_table_sortHighlight").hide();
-      $(".mqc_table tbody th").removeClass("highlighted").removeData("highlight");
-      $(".mqc_table tbody th").each(function (i) {
+      $(".mqc_table:not(.mqc_table_virtual) tbody th").removeClass("highlighted").removeData("highlight");
+      $(".mqc_table:not(.mqc_table_virtual) tbody th").each(function (i) {
         var th = $(this);
         var thtext = $(this).text();
         var thiscol = "#333";
@@ -172,12 +185,24 @@ $(function () {
         });
         $(this).css("color", thiscol);
       });
+      $.each(mqc_vtables, function (tid, vt) {
+        mqc_vtable_highlight_samples(vt, f_texts, f_cols, regex_mode);
+        mqc_vtable_render(vt, true);
+      });
     });
 
     // Sort MultiQC tables by highlight
     $(".mqc_table_sortHighlight").click(function (e) {
       e.preventDefault();
       var target = $(this).data("target");
+      var vt = mqc_vtables[target.replace(/^#/, "")];
+      if (vt !== undefined) {
+        vt.sort = { highlight: true, desc: $(this).data("direction") == "desc" };
+        vt.table.find("thead th").removeClass("headerSortDown headerSortUp");
+        $(this).data("direction", vt.sort.desc ? "asc" : "desc");
+        mqc_vtable_update(vt);
+        return;
+      }
       // collect highlighted rows
       var hrows = $(target + " tbody th.highlighted")
         .parent()
@@ -197,7 +222,11 @@ $(function () {
 
     // Rename samples
     $(document).on("mqc_renamesamples", function (e, f_texts, t_texts, regex_mode) {
-      $(".mqc_table tbody th").each(function () {
+      $.each(mqc_vtables, function (tid, vt) {
+        mqc_vtable_rename_samples(vt, f_texts, t_texts, regex_mode);
+        mqc_vtable_update(vt);
+      });
+      $(".mqc_table:not(.mqc_table_virtual) tbody th").each(function () {
         var s_name = String($(this).data("original-sn"));
         $.each(f_texts, function (idx, f_text) {
           if (regex_mode) {
@@ -214,7 +243,11 @@ $(function () {
     // Hide samples
     $(document).on("mqc_hidesamples", function (e, f_texts, regex_mode) {
       // Hide rows in MultiQC tables
-      $(".mqc_table tbody th").each(function () {
+      $.each(mqc_vtables, function (tid, vt) {
+        mqc_vtable_hide_samples(vt, f_texts, regex_mode);
+        mqc_vtable_update(vt);
+      });
+      $(".mqc_table:not(.mqc_table_virtual) tbody th").each(function () {
         var match = false;
         var hfilter = $(this).text();
         $.each(f_texts, function (idx, f_text) {
@@ -233,11 +266,13 @@ $(function () {
       });
       $(".mqc_table_numrows").each(function () {
         var tid = $(this).attr("id").replace("_numrows", "");
-        $(this).text($("#" + tid + " tbody tr:visible").length);
+        if (mqc_vtables[tid] === undefined) {
+          $(this).text($("#" + tid + " tbody tr:visible").length);
+        }
       });
 
       // Hide empty columns
-      $(".mqc_table").each(function () {
+      $(".mqc_table:not(.mqc_table_virtual)").each(function () {
         var table = $(this);
         var gsthidx = 0;
         table.find("thead th, tbody tr td").show();
@@ -335,16 +370,9 @@ $(function () {
         },
         datasets: [[]],
       };
-      $(tid + " tbody tr").each(function (e) {
-        var s_name = $(this).children("th.rowheader").text();
-        var val_1 = $(this)
-          .children("td." + col1)
-          .text()
-          .replace(/[^\d\.]/g, "");
-        var val_2 = $(this)
-          .children("td." + col2)
-          .text()
-          .replace(/[^\d\.]/g, "");
+      var add_point = function (s_name, val_1, val_2) {
+        val_1 = val_1.replace(/[^\d\.]/g, "");
+        val_2 = val_2.replace(/[^\d\.]/g, "");
         if (!isNaN(parseFloat(val_1)) && isFinite(val_1) && !isNaN(parseFloat(val_2)) && isFinite(val_2)) {
           mqc_plots["tableScatterPlot"]["datasets"][0].push({
             name: s_name,
@@ -352,7 +380,27 @@ $(function () {
             y: parseFloat(val_2),
           });
         }
-      });
+      };
+      var vt = mqc_vtables[tid.replace(/^#/, "")];
+      if (vt !== undefined) {
+        var col1_idx = vt.columns.indexOf(col1);
+        var col2_idx = vt.columns.indexOf(col2);
+        $.each(vt.order, function (n, i) {
+          add_point(vt.names[i], mqc_vtable_text(vt, col1_idx, i), mqc_vtable_text(vt, col2_idx, i));
+        });
+      } else {
+        $(tid + " tbody tr").each(function (e) {
+          add_point(
+            $(this).children("th.rowheader").text(),
+            $(this)
+              .children("td." + col1)
+              .text(),
+            $(this)
+              .children("td." + col2)
+              .text()
+          );
+        });
+      }
       if (Object.keys(mqc_plots["tableScatterPlot"]["datasets"][0]).length > 0) {
         if (plot_scatter_plot("tableScatterPlot") == false) {
           $("#tableScatterPlot").html("<small>Error: Something went wrong when plotting the scatter plot.</small>");
@@ -405,4 +453,381 @@ function change_mqc_table_col_order(table) {
       }
     }
   });
+  // Virtual tables render their rows in the order of the header
+  if (mqc_vtables[target] !== undefined) {
+    mqc_vtable_render(mqc_vtables[target], true);
+  }
+}
+
+////////////////////////////////////////////////
+// Virtual tables
+////////////////////////////////////////////////
+
+// Large tables are saved in the plot data instead of as HTML, and only
+// the rows that are scrolled into view are added to the page.
+var mqc_vtables = {};
+
+// Number of rows to render above and below the visible rows
+var mqc_vtable_buffer = 20;
+
+// Set up the virtual tables. Called once the plot data has been decompressed.
+function mqc_vtables_init() {
+  $(".mqc_table_virtual").each(function () {
+    var tid = $(this).attr("id");
+    if (mqc_plots[tid] === undefined || mqc_plots[tid]["plot_type"] !== "table") {
+      return true;
+    }
+    var vt = {
+      tid: tid,
+      table: $(this),
+      container: $(this).closest(".mqc-table-responsive"),
+      columns: mqc_plots[tid]["columns"],
+      rows: mqc_plots[tid]["rows"],
+      names: [],
+      hidden: [],
+      highlights: [],
+      highlight_default: undefined,
+      texts: {},
+      order: [],
+      sort: null,
+      empty_cols: {},
+      row_height: 30,
+      first: -1,
+      last: -1,
+      frame: null,
+    };
+    for (var i = 0; i < vt.rows.length; i++) {
+      vt.names.push(vt.rows[i][0]);
+      vt.hidden.push(false);
+      vt.highlights.push(null);
+    }
+    mqc_vtables[tid] = vt;
+
+    // Sort rows when a column header is clicked. Descending first, as for other tables.
+    vt.table.find("thead th").click(function () {
+      var col = -1;
+      if (!$(this).hasClass("rowheader")) {
+        col = vt.columns.indexOf($(this).attr("id").replace(/^header_/, ""));
+      }
+      var desc = true;
+      if (vt.sort !== null && vt.sort.col === col) {
+        desc = !vt.sort.desc;
+      }
+      vt.sort = { col: col, desc: desc };
+      vt.table.find("thead th").removeClass("headerSortDown headerSortUp");
+      $(this).addClass(desc ? "headerSortDown" : "headerSortUp");
+      mqc_vtable_update(vt);
+    });
+
+    // Render the rows in view when scrolling, at most once per frame
+    var schedule_render = function () {
+      if (vt.frame === null) {
+        vt.frame = window.requestAnimationFrame(function () {
+          vt.frame = null;
+          mqc_vtable_render(vt);
+        });
+      }
+    };
+    vt.container.scroll(schedule_render);
+    $(window).on("scroll resize", schedule_render);
+    vt.container.parent().find(".mqc-table-expand").click(schedule_render);
+
+    // Apply any toolbox filters that are already set
+    mqc_vtable_rename_samples(vt, window.mqc_rename_f_texts, window.mqc_rename_t_texts, window.mqc_rename_regex_mode);
+    mqc_vtable_hide_samples(vt, window.mqc_hide_f_texts, window.mqc_hide_regex_mode);
+    if (window.mqc_highlight_f_texts.length > 0) {
+      mqc_vtable_highlight_samples(
+        vt,
+        window.mqc_highlight_f_texts,
+        window.mqc_highlight_f_cols,
+        window.mqc_highlight_regex_mode
+      );
+    }
+    mqc_vtable_update(vt);
+  });
+}
+
+// Text of a table cell, without HTML tags
+function mqc_vtable_text(vt, col, row) {
+  if (vt.texts[col] === undefined) {
+    vt.texts[col] = [];
+    for (var i = 0; i < vt.rows.length; i++) {
+      var cell = vt.rows[i][1][col];
+      vt.texts[col].push(cell === null ? "" : String(cell[0]).replace(/<[^>]*>/g, ""));
+    }
+  }
+  return vt.texts[col][row];
+}
+
+// Columns in the order of the table header, which can be changed with the Configure Columns modal
+function mqc_vtable_columns(vt) {
+  var cols = [];
+  vt.table.find("thead th").each(function () {
+    if ($(this).hasClass("rowheader")) {
+      return true;
+    }
+    var rid = $(this).attr("id").replace(/^header_/, "");
+    cols.push({
+      idx: vt.columns.indexOf(rid),
+      rid: rid,
+      hide: $(this).hasClass("hidden") ? "hidden" : "",
+      empty: vt.empty_cols[rid] === true,
+    });
+  });
+  return cols;
+}
+
+// Work out which rows to show and their order, then render them
+function mqc_vtable_update(vt) {
+  var cols = mqc_vtable_columns(vt);
+  vt.order = [];
+  for (var i = 0; i < vt.rows.length; i++) {
+    if (vt.hidden[i]) {
+      continue;
+    }
+    // Hide rows if all visible cells are empty
+    for (var j = 0; j < cols.length; j++) {
+      if (cols[j].hide === "" && !cols[j].empty && mqc_vtable_text(vt, cols[j].idx, i).trim() !== "") {
+        vt.order.push(i);
+        break;
+      }
+    }
+  }
+  mqc_vtable_sort(vt);
+  $("#" + vt.tid + "_numrows").text(vt.order.length);
+  mqc_vtable_render(vt, true);
+}
+
+// Sort the rows to show by a column or by highlight
+function mqc_vtable_sort(vt) {
+  if (vt.sort === null) {
+    return;
+  }
+  var dir = vt.sort.desc ? -1 : 1;
+  var keys = {};
+  for (var n = 0; n < vt.order.length; n++) {
+    var i = vt.order[n];
+    if (vt.sort.highlight) {
+      keys[i] = vt.highlights[i] === null ? null : vt.highlights[i][0];
+    } else if (vt.sort.col < 0) {
+      keys[i] = vt.names[i].toLowerCase();
+    } else {
+      // Numeric values are compared as numbers, like tablesorter does with the numbers in the cell text
+      var text = mqc_vtable_text(vt, vt.sort.col, i);
+      var num = parseFloat(text.replace(/[^\d.-]/g, ""));
+      keys[i] = isNaN(num) ? text.toLowerCase() : num;
+    }
+  }
+  vt.order.sort(function (a, b) {
+    var ka = keys[a];
+    var kb = keys[b];
+    if (vt.sort.highlight) {
+      // Highlighted rows go to the top (descending) or bottom (ascending), the rest keep their order
+      if (ka === null || kb === null) {
+        return ka === kb ? a - b : (ka === null ? 1 : -1) * -dir;
+      }
+    } else if (typeof ka !== typeof kb) {
+      // Numbers before text, in either direction
+      return typeof ka === "number" ? -1 : 1;
+    }
+    return (ka < kb ? -1 : ka > kb ? 1 : 0) * dir || a - b;
+  });
+}
+
+// Escape text for use in HTML
+function mqc_vtable_escape(text) {
+  return String(text)
+    .replace(/&/g, "&amp;")
+    .replace(/</g, "&lt;")
+    .replace(/>/g, "&gt;")
+    .replace(/"/g, "&quot;");
+}
+
+// HTML for a table cell, as built for other tables by table.cell_html() in Python
+function mqc_vtable_cell_html(col, cell) {
+  var classes = col.rid + " " + col.hide;
+  var display = col.empty ? "display:none;" : "";
+  var style = display ? ' style="' + display + '"' : "";
+  if (cell === null) {
+    return '<td class="data-coloured ' + classes + '"' + style + "></td>";
+  }
+  // Categorical background colour
+  if (cell.length > 3) {
+    style = ' style="background-color:' + cell[3] + " !important;" + display + '"';
+    return '<td class="' + classes + '"' + style + ">" + cell[0] + "</td>";
+  }
+  // Table cell background colour bar
+  if (cell.length > 1) {
+    var bar_col = cell[2] !== null ? " background-color:" + cell[2] + " !important;" : "";
+    var bar_html = '<span class="bar" style="width:' + cell[1] + "%;" + bar_col + '"></span>';
+    var val_html = '<span class="val">' + cell[0] + "</span>";
+    var wrapper_html = '<div class="wrapper">' + bar_html + val_html + "</div>";
+    return '<td class="data-coloured ' + classes + '"' + style + ">" + wrapper_html + "</td>";
+  }
+  return '<td class="' + classes + '"' + style + ">" + cell[0] + "</td>";
+}
+
+// HTML for a table row
+function mqc_vtable_row_html(vt, i, cols) {
+  var th_class = "rowheader";
+  var th_style = "";
+  if (vt.highlights[i] !== null) {
+    th_class += " highlighted";
+    th_style = ' style="color:' + vt.highlights[i][1] + '"';
+  } else if (vt.highlight_default !== undefined) {
+    th_style = ' style="color:' + vt.highlight_default + '"';
+  }
+  var html =
+    '<tr><th class="' +
+    th_class +
+    '" data-original-sn="' +
+    mqc_vtable_escape(vt.rows[i][0]) +
+    '"' +
+    th_style +
+    ">" +
+    mqc_vtable_escape(vt.names[i]) +
+    "</th>";
+  for (var j = 0; j < cols.length; j++) {
+    html += mqc_vtable_cell_html(cols[j], vt.rows[i][1][cols[j].idx]);
+  }
+  return html + "</tr>";
+}
+
+// Add the rows that are in view to the table, with spacer rows for those above and below
+function mqc_vtable_render(vt, force) {
+  var tbody = vt.table.children("tbody");
+  var view = vt.container[0].getBoundingClientRect();
+  var view_top = Math.max(view.top, 0);
+  var view_bottom = Math.min(view.bottom, window.innerHeight);
+  var body_top = tbody[0].getBoundingClientRect().top;
+  var first = Math.floor((view_top - body_top) / vt.row_height) - mqc_vtable_buffer;
+  var last = Math.ceil((view_bottom - body_top) / vt.row_height) + mqc_vtable_buffer;
+  first = Math.min(Math.max(first, 0), vt.order.length);
+  last = Math.min(Math.max(last, first), vt.order.length);
+  if (!force && first == vt.first && last == vt.last) {
+    return;
+  }
+  vt.first = first;
+  vt.last = last;
+
+  var cols = mqc_vtable_columns(vt);
+  var spacer = function (num_rows) {
+    return (
+      '<tr class="mqc_vtable_spacer"><td colspan="' +
+      (cols.length + 1) +
+      '" style="height:' +
+      num_rows * vt.row_height +
+      'px; padding:0; border:0;"></td></tr>'
+    );
+  };
+  var html = [];
+  if (first > 0) {
+    html.push(spacer(first));
+  }
+  for (var n = first; n < last; n++) {
+    html.push(mqc_vtable_row_html(vt, vt.order[n], cols));
+  }
+  if (last < vt.order.length) {
+    html.push(spacer(vt.order.length - last));
+  }
+  tbody.html(html.join(""));
+
+  // Use the height of the rendered rows to size the spacers
+  var row = tbody.children("tr:not(.mqc_vtable_spacer)").first();
+  var row_height = row.length > 0 ? row.outerHeight() : 0;
+  if (row_height > 0 && Math.abs(row_height - vt.row_height) > 0.5) {
+    vt.row_height = row_height;
+    mqc_vtable_render(vt, true);
+  }
+}
+
+// Rename samples with the toolbox
+function mqc_vtable_rename_samples(vt, f_texts, t_texts, regex_mode) {
+  for (var i = 0; i < vt.rows.length; i++) {
+    var s_name = String(vt.rows[i][0]);
+    $.each(f_texts, function (idx, f_text) {
+      if (regex_mode) {
+        var re = new RegExp(f_text, "g");
+        s_name = s_name.replace(re, t_texts[idx]);
+      } else {
+        s_name = s_name.replace(f_text, t_texts[idx]);
+      }
+    });
+    vt.names[i] = s_name;
+  }
+}
+
+// Highlight samples with the toolbox
+function mqc_vtable_highlight_samples(vt, f_texts, f_cols, regex_mode) {
+  vt.highlight_default = "#333";
+  for (var i = 0; i < vt.rows.length; i++) {
+    var s_name = vt.names[i];
+    vt.highlights[i] = null;
+    $.each(f_texts, function (idx, f_text) {
+      if ((regex_mode && s_name.match(f_text)) || (!regex_mode && s_name.indexOf(f_text) > -1)) {
+        vt.highlights[i] = [idx, f_cols[idx]];
+      }
+    });
+    if (vt.highlights[i] !== null) {
+      $(".mqc_table_sortHighlight[data-target='#" + vt.tid + "']").show();
+    }
+  }
+}
+
+// Hide samples with the toolbox, and columns that are then empty
+function mqc_vtable_hide_samples(vt, f_texts, regex_mode) {
+  for (var i = 0; i < vt.rows.length; i++) {
+    var s_name = vt.names[i];
+    var match = false;
+    $.each(f_texts, function (idx, f_text) {
+      if ((regex_mode && s_name.match(f_text)) || (!regex_mode && s_name.indexOf(f_text) > -1)) {
+        match = true;
+      }
+    });
+    if (window.mqc_hide_mode == "show") {
+      match = !match;
+    }
+    vt.hidden[i] = match;
+  }
+  vt.empty_cols = {};
+  for (var col = 0; col < vt.columns.length; col++) {
+    var count = 0;
+    var empties = 0;
+    for (var i = 0; i < vt.rows.length; i++) {
+      if (!vt.hidden[i]) {
+        count += 1;
+        if (mqc_vtable_text(vt, col, i) == "") {
+          empties += 1;
+        }
+      }
+    }
+    var th = vt.table.find("thead th#header_" + vt.columns[col]);
+    if (count > 0 && count == empties) {
+      vt.empty_cols[vt.columns[col]] = true;
+      th.hide();
+    } else {
+      th.show();
+    }
+  }
+}
+
+// Table contents as tab-separated text, for copying to the clipboard
+function mqc_vtable_tsv(vt) {
+  var cols = mqc_vtable_columns(vt).filter(function (col) {
+    return col.hide === "" && !col.empty;
+  });
+  var lines = [];
+  var header = [vt.table.find("thead th.rowheader").text()];
+  $.each(cols, function (j, col) {
+    header.push(vt.table.find("thead th#header_" + col.rid).text());
+  });
+  lines.push(header.join("\t"));
+  $.each(vt.order, function (n, i) {
+    var line = [vt.names[i]];
+    $.each(cols, function (j, col) {
+      line.push(mqc_vtable_text(vt, col.idx, i));
+    });
+    lines.push(line.join("\t"));
+  });
+  return lines.join("\n");
 }
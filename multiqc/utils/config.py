@@ -1,7 +1,8 @@
 #!/usr/bin/env python
 
 """ MultiQC config module. Holds a single copy of
-config variables to be used across all other modules """
+config variables to be used across all other modules.
+Each ReportContext has its own copy, see context.py """
 
 
 import collections
@@ -9,72 +10,158 @@ import inspect
 
 # Default logger will be replaced by caller
 import logging
+import marshal
 import os
-import subprocess
 import sys
 from datetime import datetime
 
-import pkg_resources
 import yaml
 
 import multiqc
 
+from . import context, registry
+
 logger = logging.getLogger("multiqc")
 
+# Config values are per ReportContext, so functions here use them through the module object
+config = context.context_module(__name__)
+
+
+def get_git_hash(path):
+    """
+    Commit hash of the git repository that MultiQC is running from, or None if it was
+    installed from a package. Reads the files in the .git directory instead of running git.
+    """
+    git_dir = os.path.join(path, ".git")
+    try:
+        # Worktrees have a .git file pointing to their git directory
+        if os.path.isfile(git_dir):
+            with open(git_dir) as fh:
+                git_dir = os.path.join(path, fh.read().split("gitdir:", 1)[1].strip())
+        with open(os.path.join(git_dir, "HEAD")) as fh:
+            head = fh.read().strip()
+        if not head.startswith("ref:"):
+            return head
+        ref = head[4:].strip()
+        # Branches are in the main git directory for worktrees
+        git_dirs = [git_dir]
+        if os.path.isfile(os.path.join(git_dir, "commondir")):
+            with open(os.path.join(git_dir, "commondir")) as fh:
+                git_dirs.append(os.path.join(git_dir, fh.read().strip()))
+        for d in git_dirs:
+            if os.path.isfile(os.path.join(d, ref)):
+                with open(os.path.join(d, ref)) as fh:
+                    return fh.read().strip()
+            if os.path.isfile(os.path.join(d, "packed-refs")):
+                with open(os.path.join(d, "packed-refs")) as fh:
+                    for line in fh:
+                        if line.rstrip().endswith(" " + ref):
+                            return line.split()[0]
+    except (OSError, IndexError):
+        pass
+    return None
+
+
 # Get the MultiQC version
-version = pkg_resources.get_distribution("multiqc").version
-short_version = pkg_resources.get_distribution("multiqc").version
+version = registry.get_version()
+short_version = version
 script_path = os.path.dirname(os.path.realpath(__file__))
-git_hash = None
+git_hash = get_git_hash(os.path.dirname(os.path.dirname(script_path)))
 git_hash_short = None
-try:
-    git_hash = subprocess.check_output(
-        ["git", "rev-parse", "HEAD"], cwd=script_path, stderr=subprocess.STDOUT, universal_newlines=True
-    ).strip()
+if git_hash is not None:
     git_hash_short = git_hash[:7]
     version = "{} ({})".format(version, git_hash)
-except:
-    pass
 
 # Constants
 MULTIQC_DIR = os.path.dirname(os.path.realpath(inspect.getfile(multiqc)))
 
+# Use the LibYAML parser if PyYAML was built with it, it's much faster
+YamlLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+
+def load_defaults():
+    """
+    Parse the default config and the module filename search patterns. The parsed YAML is
+    cached, so that the files are only parsed again when they change or MultiQC is updated.
+    """
+    yaml_fns = [os.path.join(MULTIQC_DIR, "utils", fn) for fn in ["config_defaults.yaml", "search_patterns.yaml"]]
+    key = [version, sys.version]
+    for fn in yaml_fns:
+        fn_stat = os.stat(fn)
+        key.append([fn, fn_stat.st_mtime_ns, fn_stat.st_size])
+    cache_fn = registry.get_cache_fn("config_defaults", "marshal")
+    try:
+        with open(cache_fn, "rb") as fh:
+            cache = marshal.load(fh)
+        if cache["key"] == key:
+            return cache["defaults"]
+    except (OSError, EOFError, ValueError, TypeError, KeyError):
+        pass
+    defaults = list()
+    for fn in yaml_fns:
+        with open(fn) as f:
+            defaults.append(yaml.load(f, Loader=YamlLoader))
+    try:
+        registry.save_cache_file(cache_fn, marshal.dumps({"key": key, "defaults": defaults}))
+    except ValueError:
+        pass  # Not a type that marshal can save, eg. a date
+    return defaults
+
+
 ##### MultiQC Defaults
-# Default MultiQC config
-searchp_fn = os.path.join(MULTIQC_DIR, "utils", "config_defaults.yaml")
-with open(searchp_fn) as f:
-    configs = yaml.safe_load(f)
-    for c, v in configs.items():
-        globals()[c] = v
-# Module filename search patterns
-searchp_fn = os.path.join(MULTIQC_DIR, "utils", "search_patterns.yaml")
-with open(searchp_fn) as f:
-    sp = yaml.safe_load(f)
-
-# Other defaults that can't be set in YAML
-data_tmp_dir = "/tmp"  # will be overwritten by core script
-modules_dir = os.path.join(MULTIQC_DIR, "modules")
-creation_date = datetime.now().astimezone().strftime("%Y-%m-%d, %H:%M %Z")
-working_dir = os.getcwd()
-analysis_dir = [os.getcwd()]
-output_dir = os.path.realpath(os.getcwd())
-megaqc_access_token = os.environ.get("MEGAQC_ACCESS_TOKEN")
+def default_values():
+    """Default values of the config options that a MultiQC run can change, as new objects"""
+    # Default MultiQC config and module filename search patterns
+    configs, sp = load_defaults()
+    values = dict(configs, sp=sp)
+
+    # Other defaults that can't be set in YAML
+    values["data_tmp_dir"] = "/tmp"  # will be overwritten by core script
+    values["modules_dir"] = os.path.join(MULTIQC_DIR, "modules")
+    values["creation_date"] = datetime.now().astimezone().strftime("%Y-%m-%d, %H:%M %Z")
+    values["working_dir"] = os.getcwd()
+    values["analysis_dir"] = [os.getcwd()]
+    values["output_dir"] = os.path.realpath(os.getcwd())
+    values["megaqc_access_token"] = os.environ.get("MEGAQC_ACCESS_TOKEN")
+    return values
+
+
+globals().update(default_values())
+
+
+class RunConfig(object):
+    """
+    Config of a ReportContext, starting from the defaults. Values that runs don't change,
+    like version and avail_modules, are read from the config module.
+    """
+
+    def __init__(self):
+        self.__dict__.update(default_values())
+
+    def __getattr__(self, name):
+        try:
+            return globals()[name]
+        except KeyError:
+            raise AttributeError("Config has no attribute '{}'".format(name))
+
+
+def new_context_namespace():
+    return RunConfig()
+
 
 ##### Available modules
 # Modules must be listed in setup.py under entry_points['multiqc.modules.v1']
 # Get all modules, including those from other extension packages
 avail_modules = dict()
-for entry_point in pkg_resources.iter_entry_points("multiqc.modules.v1"):
-    nicename = str(entry_point).split("=")[0].strip()
-    avail_modules[nicename] = entry_point
+for entry_point in registry.get_entry_points("multiqc.modules.v1"):
+    avail_modules[entry_point.name] = entry_point
 
 ##### Available templates
 # Templates must be listed in setup.py under entry_points['multiqc.templates.v1']
 # Get all templates, including those from other extension packages
 avail_templates = {}
-for entry_point in pkg_resources.iter_entry_points("multiqc.templates.v1"):
-    nicename = str(entry_point).split("=")[0].strip()
-    avail_templates[nicename] = entry_point
+for entry_point in registry.get_entry_points("multiqc.templates.v1"):
+    avail_templates[entry_point.name] = entry_point
 
 ##### Check we have modules & templates
 # Check that we were able to find some modules and templates
@@ -125,7 +212,7 @@ def mqc_load_config(yaml_config):
     if os.path.isfile(yaml_config):
         try:
             with open(yaml_config) as f:
-                new_config = yaml.safe_load(f)
+                new_config = yaml.load(f, Loader=YamlLoader)
                 logger.debug("Loading config settings from: {}".format(yaml_config))
                 mqc_add_config(new_config, yaml_config)
         except (IOError, AttributeError) as e:
@@ -138,11 +225,11 @@ def mqc_load_config(yaml_config):
 def mqc_cl_config(cl_config):
     for clc_str in cl_config:
         try:
-            parsed_clc = yaml.safe_load(clc_str)
+            parsed_clc = yaml.load(clc_str, Loader=YamlLoader)
             # something:var fails as it needs a space. Fix this (a common mistake)
             if isinstance(parsed_clc, str) and ":" in clc_str:
                 clc_str = ": ".join(clc_str.split(":"))
-                parsed_clc = yaml.safe_load(clc_str)
+                parsed_clc = yaml.load(clc_str, Loader=YamlLoader)
             assert isinstance(parsed_clc, dict)
         except yaml.scanner.ScannerError as e:
             logger.error("Could not parse command line config: {}\n{}".format(clc_str, e))
@@ -155,7 +242,6 @@ def mqc_cl_config(cl_config):
 
 def mqc_add_config(conf, conf_path=None):
     """Add to the global config with given MultiQC config dict"""
-    global custom_css_files, fn_clean_exts, fn_clean_trim
     log_new_config = {}
     log_filename_patterns = []
     log_filename_clean_extensions = []
@@ -163,15 +249,15 @@ def mqc_add_config(conf, conf_path=None):
     for c, v in conf.items():
         if c == "sp":
             # Merge filename patterns instead of replacing
-            sp.update(v)
+            config.sp.update(v)
             log_filename_patterns.append(v)
         elif c == "extra_fn_clean_exts":
             # Prepend to filename cleaning patterns instead of replacing
-            fn_clean_exts[0:0] = v
+            config.fn_clean_exts[0:0] = v
             log_filename_clean_extensions.append(v)
         elif c == "extra_fn_clean_trim":
             # Prepend to filename cleaning patterns instead of replacing
-            fn_clean_trim[0:0] = v
+            config.fn_clean_trim[0:0] = v
             log_filename_clean_trimmings.append(v)
         elif c in ["custom_logo"] and v:
             # Resolve file paths - absolute or cwd, or relative to config file
@@ -195,9 +281,9 @@ def mqc_add_config(conf, conf_path=None):
                     logger.error("CSS path '{}' path not found, skipping ({})".format(c, fpath))
                     continue
                 logger.debug("Adding css file '{}': {}".format(c, fpath))
-                if not custom_css_files:
-                    custom_css_files = []
-                custom_css_files.append(fpath)
+                if not config.custom_css_files:
+                    config.custom_css_files = []
+                config.custom_css_files.append(fpath)
         else:
             log_new_config[c] = v
             update({c: v})
@@ -215,7 +301,6 @@ def mqc_add_config(conf, conf_path=None):
 # Essentially a fancy way of loading stuff into the sample_names_rename config var
 # As such, can also be done directly using a config file
 def load_sample_names(snames_file):
-    global sample_names_rename_buttons, sample_names_rename
     num_cols = None
     try:
         with open(snames_file) as f:
@@ -233,33 +318,31 @@ def load_sample_names(snames_file):
                             )
                         )
                     # Parse the line
-                    if len(sample_names_rename_buttons) == 0:
-                        sample_names_rename_buttons = s
+                    if len(config.sample_names_rename_buttons) == 0:
+                        config.sample_names_rename_buttons = s
                     else:
-                        sample_names_rename.append(s)
+                        config.sample_names_rename.append(s)
                 elif len(l.strip()) > 0:
                     logger.warning("Sample names file line did not have columns (must use tabs): {}".format(l.strip()))
     except (IOError, AttributeError) as e:
         logger.error("Error loading sample names file: {}".format(e))
-    logger.debug("Found {} sample renaming patterns".format(len(sample_names_rename_buttons)))
+    logger.debug("Found {} sample renaming patterns".format(len(config.sample_names_rename_buttons)))
 
 
 def load_replace_names(rnames_file):
-    global sample_names_replace
     try:
         with open(rnames_file) as f:
             logger.debug("Loading sample replace config settings from: {}".format(rnames_file))
             for l in f:
                 s = l.strip().split("\t")
                 if len(s) == 2:
-                    sample_names_replace[s[0]] = s[1]
+                    config.sample_names_replace[s[0]] = s[1]
     except (IOError, AttributeError) as e:
         logger.error("Error loading sample names replacement file: {}".format(e))
-    logger.debug("Found {} sample replacing patterns".format(len(sample_names_replace)))
+    logger.debug("Found {} sample replacing patterns".format(len(config.sample_names_replace)))
 
 
 def load_show_hide(sh_file):
-    global show_hide_buttons, show_hide_patterns, show_hide_mode
     if sh_file:
         try:
             with open(sh_file, "r") as f:
@@ -267,25 +350,28 @@ def load_show_hide(sh_file):
                 for l in f:
                     s = l.strip().split("\t")
                     if len(s) >= 3 and s[1] in ["show", "hide", "show_re", "hide_re"]:
-                        show_hide_buttons.append(s[0])
-                        show_hide_mode.append(s[1])
-                        show_hide_patterns.append(s[2:])
-                        show_hide_regex.append(s[1] not in ["show", "hide"])  # flag whether or not regex is turned on
+                        config.show_hide_buttons.append(s[0])
+                        config.show_hide_mode.append(s[1])
+                        config.show_hide_patterns.append(s[2:])
+                        config.show_hide_regex.append(
+                            s[1] not in ["show", "hide"]
+                        )  # flag whether or not regex is turned on
         except (AttributeError) as e:
             logger.error("Error loading show patterns file: {}".format(e))
 
     # Prepend a "Show all" button if we have anything
     # Do this outside of the file load block in case it was set in the config
-    if len(show_hide_buttons) > 0:
-        logger.debug("Found {} show/hide patterns".format(len(show_hide_buttons)))
-        show_hide_buttons.insert(0, "Show all")
-        show_hide_mode.insert(0, "hide")
-        show_hide_patterns.insert(0, [])
-        show_hide_regex.insert(0, False)
+    if len(config.show_hide_buttons) > 0:
+        logger.debug("Found {} show/hide patterns".format(len(config.show_hide_buttons)))
+        config.show_hide_buttons.insert(0, "Show all")
+        config.show_hide_mode.insert(0, "hide")
+        config.show_hide_patterns.insert(0, [])
+        config.show_hide_regex.insert(0, False)
 
 
 def update(u):
-    return update_dict(globals(), u)
+    ctx = context.get_context()
+    return update_dict(globals() if ctx is None else vars(ctx.config), u)
 
 
 def update_dict(d, u):
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+
+""" MultiQC report contexts. The config, report and log modules hold the settings and
+results of a MultiQC run as module attributes, so only one report could be made in a
+process at a time. A ReportContext has its own copy of these attributes: while it is
+active in a thread, config.*, report.* etc. in that thread are read from and written to
+the context. Without an active context, the module attributes are used, as before. """
+
+import sys
+import threading
+import time
+import types
+from contextlib import contextmanager
+
+
+class _ThreadContext(threading.local):
+    # ReportContext that is active in each thread
+    context = None
+
+
+_local = _ThreadContext()
+
+
+def get_context():
+    """The ReportContext that is active in this thread, or None if the module attributes are used"""
+    return _local.context
+
+
+@contextmanager
+def activate(ctx):
+    """Make ctx the active ReportContext of this thread, or none if ctx is None"""
+    previous = _local.context
+    _local.context = ctx
+    try:
+        yield ctx
+    finally:
+        _local.context = previous
+
+
+def wrap(fn):
+    """Wrap a function to run in the ReportContext that is active now, eg. when called from a worker thread"""
+    ctx = get_context()
+    if ctx is None:
+        return fn
+
+    def run_in_context(*args, **kwargs):
+        with activate(ctx):
+            return fn(*args, **kwargs)
+
+    return run_in_context
+
+
+class ReportContext(object):
+    """
+    Config and results of one MultiQC run. To make several reports at the same time,
+    run MultiQC in a new context in each thread:
+
+        with ReportContext() as ctx:
+            multiqc.run(...)
+
+    Each context starts with the default config. Afterwards, the config and results of
+    the run are in ctx.config and ctx.report.
+    """
+
+    def __init__(self):
+        # Module -> namespace object with the context's attributes for that module
+        self.namespaces = dict()
+        self.start_time = time.time()
+        # Thread ID -> contexts that were active before this one was entered
+        self._previous = dict()
+
+    def namespace(self, module):
+        """Attributes of a context module in this context, made when they are first used"""
+        ns = self.namespaces.get(module)
+        if ns is None:
+            ns = types.ModuleType.__getattribute__(module, "new_context_namespace")()
+            ns = self.namespaces.setdefault(module, ns)
+        return ns
+
+    @property
+    def config(self):
+        return self.namespace(sys.modules["multiqc.utils.config"])
+
+    @property
+    def report(self):
+        return self.namespace(sys.modules["multiqc.utils.report"])
+
+    def __enter__(self):
+        self._previous.setdefault(threading.get_ident(), []).append(get_context())
+        _local.context = self
+        return self
+
+    def __exit__(self, *exc_info):
+        _local.context = self._previous[threading.get_ident()].pop()
+
+
+class ContextModule(types.ModuleType):
+    """
+    Module with attributes that belong to the active ReportContext. Attributes are read from
+    the context's namespace for the module if it has them, otherwise from the module itself,
+    as for functions and imports. Attributes are always set in the context's namespace.
+    The module needs a new_context_namespace() function that returns the namespace.
+    """
+
+    def __getattribute__(self, name):
+        ctx = _local.context
+        if ctx is not None:
+            ns = ctx.namespace(self).__dict__
+            if name in ns:
+                return ns[name]
+        return types.ModuleType.__getattribute__(self, name)
+
+    def __setattr__(self, name, value):
+        ctx = _local.context
+        if ctx is None:
+            types.ModuleType.__setattr__(self, name, value)
+        else:
+            setattr(ctx.namespace(self), name, value)
+
+    def __delattr__(self, name):
+        ctx = _local.context
+        if ctx is None:
+            types.ModuleType.__delattr__(self, name)
+        else:
+            delattr(ctx.namespace(self), name)
+
+    def context_vars(self):
+        """Attributes of the module, with those of the active ReportContext, like vars(module)"""
+        values = dict(types.ModuleType.__getattribute__(self, "__dict__"))
+        ctx = _local.context
+        if ctx is not None:
+            values.update(vars(ctx.namespace(self)))
+        return values
+
+
+def context_module(name):
+    """Make a module's attributes belong to the active ReportContext. Returns the module."""
+    module = sys.modules[name]
+    module.__class__ = ContextModule
+    return module
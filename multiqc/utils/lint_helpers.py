@@ -33,7 +33,7 @@ def check_mods_docs_readme():
         return None
     logger.info("Checking docs readme '{}' as --lint specified".format(readme_fn))
     with open(readme_fn) as f:
-        fm = next(yaml.load_all(f, Loader=yaml.SafeLoader))
+        fm = next(yaml.load_all(f, Loader=config.YamlLoader))
 
     for section in fm["MultiQC Modules"]:
         for name, fn in fm["MultiQC Modules"][section].items():
@@ -9,15 +9,42 @@ import os
 import shutil
 import sys
 import tempfile
+import types
 
 import coloredlogs
 
-from multiqc.utils import config, util_functions
+from multiqc.utils import config, context, util_functions
 
 LEVELS = {0: "INFO", 1: "DEBUG"}
 log_tmp_dir = None
 log_tmp_fn = "/dev/null"
 
+# Each ReportContext has its own log file, so functions here use it through the module object
+log = context.context_module(__name__)
+
+
+def new_context_namespace():
+    return types.SimpleNamespace(log_tmp_dir=None, log_tmp_fn="/dev/null")
+
+
+class ContextFilter(logging.Filter):
+    """Only log the messages of the ReportContext that was active when the handler was added"""
+
+    def __init__(self):
+        super().__init__()
+        self.context = context.get_context()
+
+    def filter(self, record):
+        return context.get_context() is self.context
+
+
+def handler_context(handler):
+    """ReportContext of a log handler, or None for handlers of runs without a context"""
+    for f in handler.filters:
+        if isinstance(f, ContextFilter):
+            return f.context
+    return None
+
 
 def init_log(logger, loglevel=0, no_ansi=False):
     """
@@ -30,17 +57,15 @@ def init_log(logger, loglevel=0, no_ansi=False):
         loglevel (str): Determines the level of the log output.
     """
     # File for logging
-    global log_tmp_dir, log_tmp_fn
-    log_tmp_dir = tempfile.mkdtemp()
-    log_tmp_fn = os.path.join(log_tmp_dir, "multiqc.log")
+    log.log_tmp_dir = tempfile.mkdtemp()
+    log.log_tmp_fn = os.path.join(log.log_tmp_dir, "multiqc.log")
 
     # Logging templates
     debug_template = "[%(asctime)s] %(name)-50s [%(levelname)-7s]  %(message)s"
     info_template = "|%(module)18s | %(message)s"
 
-    # Remove log handlers left from previous calls to multiqc.run
-    while logger.handlers:
-        logger.removeHandler(logger.handlers[0])
+    # Remove log handlers left from previous calls to multiqc.run in the same ReportContext
+    remove_handlers(logger)
 
     # Base level setup
     logger.setLevel(getattr(logging, "DEBUG"))
@@ -71,29 +96,49 @@ def init_log(logger, loglevel=0, no_ansi=False):
             console.setFormatter(
                 coloredlogs.ColoredFormatter(fmt=info_template, level_styles=level_styles, field_styles=field_styles)
             )
+    console.addFilter(ContextFilter())
     logger.addHandler(console)
 
     # Now set up the file logging stream if we have a data directory
-    file_handler = logging.FileHandler(log_tmp_fn, encoding="utf-8")
+    file_handler = logging.FileHandler(log.log_tmp_fn, encoding="utf-8")
     file_handler.setLevel(getattr(logging, "DEBUG"))  # always DEBUG for the file
     file_handler.setFormatter(logging.Formatter(debug_template))
+    file_handler.addFilter(ContextFilter())
     logger.addHandler(file_handler)
 
 
+def remove_handlers(logger):
+    """Remove and close the log handlers of the active ReportContext"""
+    ctx = context.get_context()
+    for handler in list(logger.handlers):
+        if handler_context(handler) is ctx:
+            logger.removeHandler(handler)
+            if isinstance(handler, logging.FileHandler):
+                handler.close()
+
+
 def move_tmp_log(logger):
     """Move the temporary log file to the MultiQC data directory
     if it exists."""
 
     try:
         # https://stackoverflow.com/questions/15435652/python-does-not-release-filehandles-to-logfile
-        logging.shutdown()
-        shutil.copy(log_tmp_fn, os.path.join(config.data_dir, "multiqc.log"))
-        os.remove(log_tmp_fn)
-        util_functions.robust_rmtree(log_tmp_dir)
+        close_log_file(logger)
+        shutil.copy(log.log_tmp_fn, os.path.join(config.data_dir, "multiqc.log"))
+        os.remove(log.log_tmp_fn)
+        util_functions.robust_rmtree(log.log_tmp_dir)
     except (AttributeError, TypeError, IOError):
         pass
 
 
+def close_log_file(logger):
+    """Close the log file of the active ReportContext. Other runs carry on logging to theirs."""
+    for handler in list(logger.handlers):
+        if isinstance(handler, logging.FileHandler) and handler_context(handler) is context.get_context():
+            logger.removeHandler(handler)
+            handler.close()
+
+
 def get_log_stream(logger):
     """
     Returns a stream to the root log file.
@@ -106,6 +151,8 @@ def get_log_stream(logger):
     file_stream = None
     log_stream = None
     for handler in logger.handlers:
+        if handler_context(handler) is not context.get_context():
+            continue
         if isinstance(handler, logging.FileHandler):
             file_stream = handler.stream
         else:
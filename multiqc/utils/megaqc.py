@@ -11,19 +11,10 @@ import os
 import requests
 
 from . import config
+from .util_functions import dump_json
 
 log = config.logger
 
-# Custom encoder to handle lambda functions
-class MQCJSONEncoder(json.JSONEncoder):
-    def default(self, obj):
-        if callable(obj):
-            try:
-                return obj(1)
-            except:
-                return None
-        return json.JSONEncoder.default(self, obj)
-
 
 def multiqc_dump_json(report):
     exported_data = dict()
@@ -57,7 +48,7 @@ def multiqc_dump_json(report):
                     d = {"{}_{}".format(s, k): getattr(config, k)}
                 elif s == "report":
                     d = {"{}_{}".format(s, k): getattr(report, k)}
-                json.dumps(d, cls=MQCJSONEncoder, ensure_ascii=False)  # Test that exporting to JSON works
+                dump_json(d, ensure_ascii=False)  # Test that exporting to JSON works
                 exported_data.update(d)
             except (TypeError, KeyError, AttributeError):
                 log.warning("Couldn't export data key '{}.{}'".format(s, k))
@@ -75,7 +66,7 @@ def multiqc_api_post(exported_data):
     headers = {"Content-Type": "application/json", "content-encoding": "gzip"}
     if config.megaqc_access_token is not None:
         headers["access_token"] = config.megaqc_access_token
-    post_data = json.dumps({"data": exported_data}, cls=MQCJSONEncoder, ensure_ascii=False, indent=2)
+    post_data = dump_json({"data": exported_data}, ensure_ascii=False, indent=2)
     post_data = post_data.encode("utf-8", "ignore")
 
     # Gzip the JSON for massively decreased filesize
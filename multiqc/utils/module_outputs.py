@@ -0,0 +1,478 @@
+#!/usr/bin/env python
+
+""" MultiQC module outputs. Captures everything that a module adds to the report,
+so that it can be saved and added to the report later without running the module
+again. Used by incremental mode (--incremental) and to run modules in worker
+processes (--parallel-modules). """
+
+import base64
+import concurrent.futures
+import copy
+import hashlib
+import io
+import itertools
+import json
+import multiprocessing
+import numbers
+import os
+import random
+import shutil
+import sys
+import tempfile
+from collections import OrderedDict, defaultdict
+
+from ..plots import flat_queue
+from . import config, report
+
+logger = config.logger
+
+# Name of the incremental cache file in the multiqc_data directory
+incremental_cache_fn = "multiqc_incremental.json"
+
+# Key for values in the incremental cache JSON with types that JSON doesn't have
+json_type_key = "__mqc_type__"
+
+# Default value factories of defaultdicts that can be saved in the incremental cache
+default_factories = {
+    "None": None,
+    "list": list,
+    "dict": dict,
+    "set": set,
+    "int": int,
+    "float": float,
+    "str": str,
+    "OrderedDict": OrderedDict,
+}
+
+# Module attributes used by the report template and section ordering
+module_attrs = [
+    "name",
+    "anchor",
+    "href",
+    "info",
+    "comment",
+    "extra",
+    "doi",
+    "doi_link",
+    "mname",
+    "intro",
+    "sections",
+    "css",
+    "js",
+]
+
+# Config options that don't change the output of a module
+ignored_config = {
+    "analysis_dir",
+    "cache_dir",
+    "creation_date",
+    "data_dir",
+    "data_dir_name",
+    "data_dump_file",
+    "data_tmp_dir",
+    "force",
+    "incremental",
+    "make_pdf",
+    "megaqc_upload",
+    "megaqc_url",
+    "no_version_check",
+    "output_dir",
+    "output_fn",
+    "output_fn_name",
+    "parallel_modules",
+    "parallel_plots",
+    "plots_dir",
+    "plots_dir_name",
+    "plots_tmp_dir",
+    "profile_runtime",
+    "quiet",
+    "search_cache",
+    "search_threads",
+    "verbose",
+    "working_dir",
+    "zip_data_dir",
+}
+
+
+class ModifyLookup(object):
+    """
+    Stand-in for a general stats header `modify` function, which can't be pickled.
+    Holds the result of the function for every value in the column.
+    """
+
+    def __init__(self, modify, values):
+        self.results = dict()
+        # Tables call modify() with both the raw and float values, the JSON dump uses 1
+        for val in itertools.chain(values, [1]):
+            keys = [val]
+            try:
+                keys.append(float(val))
+            except (ValueError, TypeError):
+                pass
+            for k in keys:
+                if k not in self.results:
+                    try:
+                        self.results[k] = modify(k)
+                    except Exception:
+                        pass
+
+    def __call__(self, val):
+        return self.results.get(val, val)
+
+
+class CachedModule(object):
+    """A module restored from saved output, with the attributes needed to build the report"""
+
+    def __init__(self, attrs):
+        self.__dict__.update(attrs)
+
+
+class ModuleOutput(object):
+    """Everything that one module run added to the report"""
+
+    def __init__(self, start, modules):
+        self.modules = [{k: getattr(m, k) for k in module_attrs if hasattr(m, k)} for m in modules]
+        self.general_stats_data = report.general_stats_data[start["general_stats"] :]
+        self.general_stats_headers = [
+            picklable_headers(headers, data)
+            for headers, data in zip(report.general_stats_headers[start["general_stats"] :], self.general_stats_data)
+        ]
+        self.plot_data = {k: v for k, v in report.plot_data.items() if k not in start["plot_data"]}
+        self.saved_raw_data = {k: v for k, v in report.saved_raw_data.items() if k not in start["saved_raw_data"]}
+        self.data_sources = [s for s in list_data_sources() if s[:3] not in start["data_sources"]]
+        self.html_ids = report.html_ids[start["html_ids"] :]
+        self.lint_errors = report.lint_errors[start["lint_errors"] :]
+        self.num_hc_plots = report.num_hc_plots - start["num_hc_plots"]
+        self.num_mpl_plots = report.num_mpl_plots - start["num_mpl_plots"]
+        self.data_files = read_new_files(config.data_dir, start["data_files"])
+        self.plot_files = read_new_files(config.plots_dir, start["plot_files"])
+        self.config_updates = {
+            k: v for k, v in config.context_vars().items() if k not in start["config"] or start["config"][k] != v
+        }
+
+    def restore(self):
+        """Add the saved output to the report. Returns the module objects."""
+        report.general_stats_data.extend(self.general_stats_data)
+        report.general_stats_headers.extend(self.general_stats_headers)
+        report.plot_data.update(self.plot_data)
+        report.saved_raw_data.update(self.saved_raw_data)
+        for mod, section, s_name, source in self.data_sources:
+            report.data_sources[mod][section][s_name] = source
+        report.html_ids.extend(self.html_ids)
+        report.lint_errors.extend(self.lint_errors)
+        report.num_hc_plots += self.num_hc_plots
+        report.num_mpl_plots += self.num_mpl_plots
+        write_files(config.data_dir, self.data_files)
+        write_files(config.plots_dir, self.plot_files)
+        for k, v in self.config_updates.items():
+            setattr(config, k, v)
+        return [CachedModule(attrs) for attrs in self.modules]
+
+
+def start_capture():
+    """Note the current state of the report, before running a module"""
+    return {
+        "general_stats": len(report.general_stats_data),
+        "plot_data": set(report.plot_data),
+        "saved_raw_data": set(report.saved_raw_data),
+        "data_sources": {s[:3] for s in list_data_sources()},
+        "html_ids": len(report.html_ids),
+        "lint_errors": len(report.lint_errors),
+        "num_hc_plots": report.num_hc_plots,
+        "num_mpl_plots": report.num_mpl_plots,
+        "data_files": list_files(config.data_dir),
+        "plot_files": list_files(config.plots_dir),
+        "config": {
+            k: copy.copy(v) if isinstance(v, (dict, list, set)) else v for k, v in config.context_vars().items()
+        },
+    }
+
+
+def parallel_pool(num_processes, mod_keys=()):
+    """Process pool to run modules in, or None if worker processes can't be forked on this platform"""
+    # ProcessPoolExecutor only takes a start method (mp_context) from Python 3.7
+    if "fork" not in multiprocessing.get_all_start_methods() or sys.version_info < (3, 7):
+        logger.warning(
+            "Running modules in parallel is not supported on this platform or Python version, running them one by one"
+        )
+        return None
+    # Import the modules before forking. A report made in another thread could be importing
+    # one of them, and its import lock would never be released in the worker processes.
+    for mod_key in mod_keys:
+        try:
+            config.avail_modules[mod_key].load()
+        except Exception:
+            pass  # Reported when the module is run
+    return concurrent.futures.ProcessPoolExecutor(num_processes, mp_context=multiprocessing.get_context("fork"))
+
+
+def run_module(mod_key, mod_cust_config):
+    """
+    Run a module in a worker process and return its output, or None if it found no samples.
+    Files are written to temporary directories, to be copied over by the main process.
+    """
+    random.seed()  # Forked processes share the random state, which is used for plot IDs
+    flat_queue.reset()  # Draw flat plots in this process, so that they are in the output
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        if config.data_dir is not None:
+            config.data_dir = os.path.join(tmp_dir, "data")
+            os.makedirs(config.data_dir)
+        if config.plots_dir is not None:
+            config.plots_dir = os.path.join(tmp_dir, "plots")
+            os.makedirs(config.plots_dir)
+        start = start_capture()
+        mod = config.avail_modules[mod_key].load()
+        mod.mod_cust_config = mod_cust_config
+        try:
+            output = mod()
+        except UserWarning:
+            return None
+        if type(output) != list:
+            output = [output]
+        return ModuleOutput(start, output)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def parallel_result(future):
+    """
+    Output of a module run in a worker process, raising UserWarning if it found no samples.
+    Returns None if the module needs to run again in the main process instead: if it
+    failed, so that the error is reported as normal, or if its HTML IDs clash with
+    those of earlier modules, so that they are deduplicated the same way as a serial run.
+    """
+    try:
+        output = future.result()
+    except Exception as e:
+        logger.debug("Module failed in worker process, running it again: {}".format(e))
+        return None
+    if output is None:
+        raise UserWarning
+    html_ids = set(report.html_ids)
+    if any(html_id in html_ids for html_id in output.html_ids):
+        logger.debug("HTML IDs from worker process clash with earlier modules, running module again")
+        return None
+    return output
+
+
+def picklable_headers(headers, data):
+    """Copy general stats headers, replacing modify functions with a lookup of their results"""
+    # Keep the container types, as tables sort columns by title unless given an OrderedDict
+    headers_copy = copy.copy(headers)
+    for k, header in headers.items():
+        if callable(header.get("modify")):
+            header = copy.copy(header)
+            header["modify"] = ModifyLookup(header["modify"], [d[k] for d in data.values() if k in d])
+            headers_copy[k] = header
+    return headers_copy
+
+
+def list_data_sources():
+    """Flatten report.data_sources to (module, section, sample, source) tuples"""
+    return [
+        (mod, section, s_name, source)
+        for mod, sections in report.data_sources.items()
+        for section, sources in sections.items()
+        for s_name, source in sources.items()
+    ]
+
+
+def list_files(path):
+    """Set of file paths under a directory, relative to it"""
+    if path is None:
+        return set()
+    return {
+        os.path.relpath(os.path.join(root, fn), path) for root, dirnames, filenames in os.walk(path) for fn in filenames
+    }
+
+
+def read_new_files(path, start_files):
+    """Read the contents of files created in a directory since start_files was listed"""
+    files = dict()
+    for fn in sorted(list_files(path) - start_files):
+        with open(os.path.join(path, fn), "rb") as fh:
+            files[fn] = fh.read()
+    return files
+
+
+def write_files(path, files):
+    """Write saved files back to a directory"""
+    if path is None:
+        return
+    for fn, contents in files.items():
+        fn = os.path.join(path, fn)
+        os.makedirs(os.path.dirname(fn), exist_ok=True)
+        with open(fn, "wb") as fh:
+            fh.write(contents)
+
+
+class IncrementalCache(object):
+    """
+    Module outputs from the previous run in the same output directory. Outputs are
+    reused for whole modules: a module is run again, parsing all of its files, if
+    any of its input files or the MultiQC config have changed. The outputs are saved
+    as JSON in the data directory, so loading them can't run code. Incremental runs
+    overwrite the previous report, so the data directory doesn't move on to eg. multiqc_data_1.
+    """
+
+    def __init__(self):
+        self.new_outputs = dict()
+        self.num_reused = 0
+        self.config_fingerprint = config_fingerprint()
+        self.outputs = dict()
+
+        cache_fn = os.path.join(config.output_dir, config.data_dir_name, incremental_cache_fn)
+        if os.path.isfile(cache_fn):
+            try:
+                with io.open(cache_fn, "r", encoding="utf-8") as fh:
+                    cache = json.load(fh)
+                if cache.get("version") == config.version:
+                    self.outputs = cache["outputs"]
+                    logger.debug("Loaded saved output for {} modules from {}".format(len(self.outputs), cache_fn))
+            except Exception as e:
+                logger.warning("Could not load incremental cache '{}': {}".format(cache_fn, e))
+
+    def module_key(self, mod_key, mod_cust_config):
+        """
+        Hash everything that the module output depends on: the module and its config,
+        the MultiQC config and the path, size and modification time of its input files.
+        Returns None if the input files can't be checked.
+        """
+        search_keys = [k for k in report.files if k.split("/")[0] == mod_key]
+        if mod_key == "custom_content":
+            search_keys.extend(k for k in getattr(config, "custom_data", {}) if k in report.files)
+        source_files = list()
+        for k in sorted(set(search_keys)):
+            for f in report.files[k]:
+                path = os.path.abspath(os.path.join(f["root"], f["fn"]))
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    return None
+                source_files.append([k, path, st.st_size, st.st_mtime_ns])
+        key = [mod_key, mod_cust_config, self.config_fingerprint, source_files]
+        try:
+            key_json = json.dumps(key, sort_keys=True)
+        except (TypeError, ValueError):
+            return None
+        return hashlib.sha1(key_json.encode("utf-8")).hexdigest()
+
+    def has(self, key):
+        """Whether there is saved output for a module key"""
+        return key is not None and key in self.outputs
+
+    def get(self, key):
+        """Saved output for a module key, or None"""
+        if key is None or key not in self.outputs:
+            return None
+        try:
+            output = ModuleOutput.__new__(ModuleOutput)
+            output.__dict__.update(from_json_value(self.outputs[key]))
+        except Exception as e:
+            logger.debug("Could not load saved module output: {}".format(e))
+            return None
+        self.num_reused += 1
+        self.new_outputs[key] = self.outputs[key]
+        return output
+
+    def add(self, key, output):
+        """
+        Remember the output of a module that has just run. The output is converted for
+        JSON straight away, before later steps of the run modify the report data.
+        """
+        if key is None:
+            return
+        try:
+            self.new_outputs[key] = to_json_value(vars(output))
+        except Exception as e:
+            logger.debug("Could not save module output for incremental runs: {}".format(e))
+
+    def save(self):
+        """Write the outputs from this run to the data directory"""
+        if config.data_dir is None:
+            return
+        cache_fn = os.path.join(config.data_dir, incremental_cache_fn)
+        with io.open(cache_fn, "w", encoding="utf-8") as fh:
+            json.dump({"version": config.version, "outputs": self.new_outputs}, fh, separators=(",", ":"))
+        logger.debug("Saved output for {} modules to {}".format(len(self.new_outputs), cache_fn))
+
+
+def config_fingerprint():
+    """Hash the config options that can change the output of a module"""
+    values = dict()
+    for k, v in config.context_vars().items():
+        if k.startswith("_") or k in ignored_config:
+            continue
+        try:
+            values[k] = json.dumps(v, sort_keys=True)
+        except (TypeError, ValueError):
+            continue  # Not a config value (functions, modules, entry points)
+    values_json = json.dumps(values, sort_keys=True)
+    return hashlib.sha1(values_json.encode("utf-8")).hexdigest()
+
+
+def to_json_value(obj):
+    """
+    Convert a module output value to one that can be saved as JSON. Types that JSON doesn't
+    have are saved as dicts with a json_type_key, so that from_json_value() gives back the same
+    value. Raises TypeError for values that can't be saved, eg. functions.
+    """
+    if obj is None or isinstance(obj, (bool, str)):
+        return obj
+    if isinstance(obj, numbers.Integral):
+        return int(obj)
+    if isinstance(obj, numbers.Real):
+        return float(obj)
+    if type(obj).__module__ == "numpy" and getattr(obj, "ndim", None) == 0:
+        return to_json_value(obj.item())  # NumPy scalars that aren't numbers, eg. numpy.bool_
+    if type(obj) is list:
+        return [to_json_value(v) for v in obj]
+    if type(obj) in (tuple, set, frozenset):
+        return {json_type_key: type(obj).__name__, "items": [to_json_value(v) for v in obj]}
+    if type(obj) is bytes:
+        return {json_type_key: "bytes", "base64": base64.b64encode(obj).decode("ascii")}
+    if type(obj) is dict and json_type_key not in obj and all(type(k) is str for k in obj):
+        return {k: to_json_value(v) for k, v in obj.items()}
+    if type(obj) in (dict, OrderedDict, defaultdict):
+        value = {
+            json_type_key: type(obj).__name__,
+            "items": [[to_json_value(k), to_json_value(v)] for k, v in obj.items()],
+        }
+        if type(obj) is defaultdict:
+            factory = getattr(obj.default_factory, "__name__", None) if obj.default_factory is not None else "None"
+            if default_factories.get(factory, False) is not obj.default_factory:
+                raise TypeError("Can't save defaultdict with default_factory {}".format(obj.default_factory))
+            value["default_factory"] = factory
+        return value
+    if type(obj) is ModifyLookup:
+        return {json_type_key: "ModifyLookup", "results": to_json_value(obj.results)}
+    raise TypeError("Can't save {} in the incremental cache".format(type(obj).__name__))
+
+
+def from_json_value(value):
+    """Value saved with to_json_value()"""
+    if type(value) is list:
+        return [from_json_value(v) for v in value]
+    if type(value) is not dict:
+        return value
+    value_type = value.get(json_type_key)
+    if value_type is None:
+        return {k: from_json_value(v) for k, v in value.items()}
+    if value_type in ("tuple", "set", "frozenset"):
+        items = [from_json_value(v) for v in value["items"]]
+        return {"tuple": tuple, "set": set, "frozenset": frozenset}[value_type](items)
+    if value_type == "bytes":
+        return base64.b64decode(value["base64"])
+    if value_type in ("dict", "OrderedDict", "defaultdict"):
+        items = [(from_json_value(k), from_json_value(v)) for k, v in value["items"]]
+        if value_type == "defaultdict":
+            d = defaultdict(default_factories[value["default_factory"]])
+            d.update(items)
+            return d
+        return OrderedDict(items) if value_type == "OrderedDict" else dict(items)
+    if value_type == "ModifyLookup":
+        lookup = ModifyLookup.__new__(ModifyLookup)
+        lookup.results = from_json_value(value["results"])
+        return lookup
+    raise ValueError("Unknown type in incremental cache: {}".format(value_type))
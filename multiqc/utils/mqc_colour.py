@@ -9,9 +9,6 @@ import logging
 import os
 import re
 
-import numpy as np
-import spectra
-
 logger = logging.getLogger(__name__)
 
 
@@ -24,6 +21,10 @@ class mqc_colour_scale(object):
         self.colours = self.get_colours(name)
         self.name = name
 
+        # Colour stops and lightened colours, computed when first needed
+        self._stops = None
+        self._stop_hexcodes = dict()
+
         # Sanity checks
         minval = re.sub("[^0-9\.-e]", "", str(minval))
         maxval = re.sub("[^0-9\.-e]", "", str(maxval))
@@ -43,47 +44,103 @@ class mqc_colour_scale(object):
 
     def get_colour(self, val, colformat="hex", lighten=0.3):
         """Given a value, return a colour within the colour scale"""
+        return self.get_colour_list([val], colformat, lighten)[0]
 
-        # Ported from the original JavaScript for continuity
-        # Seems to work better than adjusting brightness / saturation / luminosity
-        rgb_converter = lambda x: max(0, min(1, 1 + ((x - 1) * lighten)))
-
+    def get_colour_list(self, values, colformat="hex", lighten=0.3):
+        """
+        Given a list of values, return a list of colours within the colour scale.
+        Colours a whole table column in one go, interpolating along the scale with NumPy.
+        """
         try:
             # When we have non-numeric values (e.g. Male/Female, Yes/No, chromosome names, etc), and a qualitive
             # scale (Set1, Set3, etc), we don't want to attempt to parse numbers, otherwise we will end up with all
             # values assigned with the same color. But instead we will geta has from a string to hope to assign
             # a unique color for each possible enumeration value.
-            if self.name in mqc_colour_scale.qualitative_scales and isinstance(val, str):
-                thecolour = spectra.html(self.colours[hash(val) % len(self.colours)])
-                thecolour = spectra.rgb(*[rgb_converter(v) for v in thecolour.rgb])
-                return thecolour.hexcode
-
-            # When there is only 1 color in scale, spectra.scale() will crash with DevisionByZero
-            elif len(self.colours) == 1:
-                thecolour = spectra.html(self.colours[0])
-                thecolour = spectra.rgb(*[rgb_converter(v) for v in thecolour.rgb])
-                return thecolour.hexcode
-
-            else:
-                # Sanity checks
-                val = re.sub("[^0-9\.-e]", "", str(val))
-                if val == "":
-                    val = self.minval
+            qualitative = self.name in mqc_colour_scale.qualitative_scales
+            stop_hexcodes = self.stop_hexcodes(lighten)
+            results = list()
+            nums = list()
+            num_idxs = list()
+            for idx, val in enumerate(values):
+                if qualitative and isinstance(val, str):
+                    results.append(stop_hexcodes[hash(val) % len(self.colours)])
+                # When there is only 1 color in scale, there is nothing to interpolate
+                elif len(self.colours) == 1:
+                    results.append(stop_hexcodes[0])
+                else:
+                    results.append("")
+                    num = self.parse_value(val)
+                    if num is not None:
+                        nums.append(num)
+                        num_idxs.append(idx)
+            for idx, hexcode in zip(num_idxs, self.interpolate_hex(nums, lighten)):
+                results[idx] = hexcode
+            return results
+
+        except:
+            # Shouldn't crash all of MultiQC just for colours
+            return ["" for _ in values]
+
+    def parse_value(self, val):
+        """Value as a float clamped to the scale range, or None if it can't be parsed"""
+        # Skip the regex for numbers that it leaves unchanged: those without a minus sign or exponent
+        if (type(val) is int and val >= 0) or (type(val) is float and (val == 0 or 1e-4 <= val < 1e16)):
+            val = float(val)
+        else:
+            # Sanity checks
+            val = re.sub("[^0-9\.-e]", "", str(val))
+            if val == "":
+                val = self.minval
+            try:
                 val = float(val)
-                val = max(val, self.minval)
-                val = min(val, self.maxval)
+            except ValueError:
+                return None
+        val = max(val, self.minval)
+        val = min(val, self.maxval)
+        return val
 
-                domain_nums = list(np.linspace(self.minval, self.maxval, len(self.colours)))
-                my_scale = spectra.scale(self.colours).domain(domain_nums)
+    @property
+    def stops(self):
+        """The scale colours as an array of RGB values, with their positions along the scale"""
+        import numpy as np
 
-                # Lighten colours
-                thecolour = spectra.rgb(*[rgb_converter(v) for v in my_scale(val).rgb])
+        if self._stops is None:
+            rgb = np.array([html_rgb(c) for c in self.colours], dtype=float)
+            domain = np.array(np.linspace(self.minval, self.maxval, len(self.colours)), dtype=float)
+            self._stops = (rgb, domain)
+        return self._stops
 
-                return thecolour.hexcode
+    def stop_hexcodes(self, lighten=0.3):
+        """Hex codes of the lightened scale colours, used as they are for qualitative and single-colour scales"""
+        if lighten not in self._stop_hexcodes:
+            rgb, _ = self.stops
+            self._stop_hexcodes[lighten] = self.to_hex(rgb, lighten)
+        return self._stop_hexcodes[lighten]
 
-        except:
-            # Shouldn't crash all of MultiQC just for colours
-            return ""
+    def interpolate_hex(self, nums, lighten=0.3):
+        """Lightened hex colours for an array of numbers within the scale range"""
+        import numpy as np
+
+        rgb, domain = self.stops
+        nums = np.asarray(nums, dtype=float)
+        if len(nums) == 0:
+            return []
+        # Each number is blended between the colours at either end of its segment of the scale
+        seg = np.clip(np.searchsorted(domain, nums, side="left") - 1, 0, len(domain) - 2)
+        ratio = (nums - domain[seg]) / (domain[seg + 1] - domain[seg])
+        blended = rgb[seg] * (1.0 - ratio)[:, np.newaxis] + rgb[seg + 1] * ratio[:, np.newaxis]
+        return self.to_hex(blended, lighten)
+
+    @staticmethod
+    def to_hex(rgb, lighten=0.3):
+        """Lighten an array of RGB values and convert them to hex codes"""
+        import numpy as np
+
+        # Ported from the original JavaScript for continuity
+        # Seems to work better than adjusting brightness / saturation / luminosity
+        rgb = np.clip(1 + ((rgb - 1) * lighten), 0, 1)
+        rgb = np.floor(0.5 + rgb * 255).astype(int)
+        return ["#{:02x}{:02x}{:02x}".format(*c) for c in rgb.tolist()]
 
     def get_colours(self, name="GnBu"):
         """Function to get a colour scale by name
@@ -556,3 +613,14 @@ class mqc_colour_scale(object):
         "lightyellow": "#FFFFE0",
         "ivory": "#FFFFF0",
     }
+
+
+def html_rgb(colour):
+    """RGB values between 0 and 1 for a HTML colour. Hex codes are parsed here, as
+    spectra is slow to import. Other colours (eg. names) are parsed with spectra."""
+    if re.match(r"^#(?:[0-9a-fA-F]{3}){1,2}$", colour):
+        hexcode = colour[1:] if len(colour) == 7 else "".join(c * 2 for c in colour[1:])
+        return tuple(int(hexcode[i : i + 2], 16) / 255 for i in (0, 2, 4))
+    import spectra
+
+    return spectra.html(colour).rgb
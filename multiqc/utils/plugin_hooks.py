@@ -4,18 +4,18 @@
 to run their own custom subroutines at predefined
 trigger points during MultiQC execution. """
 
-import pkg_resources
+from . import registry
 
-# Load the hooks
+# Find the hooks. They are only imported when they are first triggered.
+# Plugins can also add their own functions to these lists.
 hook_functions = {}
-for entry_point in pkg_resources.iter_entry_points("multiqc.hooks.v1"):
-    nicename = str(entry_point).split("=")[0].strip()
-    try:
-        hook_functions[nicename].append(entry_point.load())
-    except KeyError:
-        hook_functions[nicename] = [entry_point.load()]
+for entry_point in registry.get_entry_points("multiqc.hooks.v1"):
+    hook_functions.setdefault(entry_point.name, []).append(entry_point)
 
 # Function to run the hooks
 def mqc_trigger(trigger):
-    for hook in hook_functions.get(trigger, []):
+    hooks = hook_functions.get(trigger, [])
+    for i, hook in enumerate(hooks):
+        if isinstance(hook, registry.EntryPoint):
+            hook = hooks[i] = hook.load()
         hook()
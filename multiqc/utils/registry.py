@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+
+""" MultiQC registry of the modules, templates, plugin hooks and command line options
+provided by MultiQC and by plugin packages, as setuptools entry points. Entry points are
+read with importlib.metadata and cached on disk, so that MultiQC doesn't need to scan
+all installed packages every time that it starts. Entry points are only imported when
+they are loaded. Also has the helpers for the other MultiQC startup cache files. """
+
+import hashlib
+import importlib
+import json
+import os
+import re
+import sys
+import tempfile
+
+# Change this if the format of the cache file changes
+cache_format = 1
+
+# Entry points and MultiQC version, read once per process
+_registry = None
+
+entry_point_re = re.compile(r"^(?P<module>[\w.]+)\s*(:\s*(?P<attr>[\w.]+))?\s*(\[.*\])?\s*$")
+
+
+class EntryPoint(object):
+    """A named object provided by an installed package, which is imported when it is loaded"""
+
+    def __init__(self, name, value, group):
+        self.name = name
+        self.value = value
+        self.group = group
+
+    def load(self):
+        """Import the entry point and return the object that it refers to"""
+        m = entry_point_re.match(self.value)
+        if m is None:
+            raise ImportError("Could not parse entry point '{}'".format(self))
+        obj = importlib.import_module(m.group("module"))
+        for attr in (m.group("attr") or "").split("."):
+            if attr:
+                obj = getattr(obj, attr)
+        return obj
+
+    def __str__(self):
+        return "{} = {}".format(self.name, self.value)
+
+    def __repr__(self):
+        return "EntryPoint('{}', '{}', '{}')".format(self.name, self.value, self.group)
+
+
+def get_entry_points(group):
+    """List of the entry points in a group, eg. multiqc.modules.v1, from all installed packages"""
+    return [EntryPoint(name, value, group) for name, value in get_registry()["entry_points"].get(group, [])]
+
+
+def get_version():
+    """Installed version of MultiQC, or None if MultiQC is not installed"""
+    return get_registry()["version"]
+
+
+def get_registry():
+    """Load the registry from the cache file if it is up to date, otherwise read it from the installed packages"""
+    global _registry
+    if _registry is None:
+        key = distributions_key()
+        cache_fn = get_cache_fn("entry_points", "json")
+        try:
+            with open(cache_fn) as fh:
+                cache = json.load(fh)
+            if cache.get("key") == key:
+                _registry = cache
+        except (OSError, ValueError):
+            pass
+        if _registry is None:
+            _registry = read_registry()
+            _registry["key"] = key
+            save_cache_file(cache_fn, json.dumps(_registry).encode("utf-8"))
+    return _registry
+
+
+def distributions_key():
+    """
+    Names and versions of the installed distributions, with the modification time of their
+    entry points file. Installing, upgrading or reinstalling a package changes the key.
+    """
+    key = [cache_format, sys.version]
+    for path in sys.path:
+        path = os.path.abspath(path or os.curdir)
+        try:
+            fns = sorted(os.listdir(path))
+        except OSError:
+            continue
+        for fn in fns:
+            if fn.endswith((".dist-info", ".egg-info")):
+                try:
+                    mtime = os.stat(os.path.join(path, fn, "entry_points.txt")).st_mtime
+                except OSError:
+                    mtime = None
+                key.append([path, fn, mtime])
+    return key
+
+
+def read_registry():
+    """Read the MultiQC version and the MultiQC entry points of all installed packages"""
+    try:
+        import importlib.metadata as importlib_metadata
+    except ImportError:
+        # Python < 3.8
+        import importlib_metadata
+
+    try:
+        version = importlib_metadata.version("multiqc")
+    except importlib_metadata.PackageNotFoundError:
+        version = None
+    all_entry_points = importlib_metadata.entry_points()
+    if hasattr(all_entry_points, "select"):
+        groups = [(group, all_entry_points.select(group=group)) for group in all_entry_points.groups]
+    else:
+        # Dict of group -> entry points before Python 3.10
+        groups = all_entry_points.items()
+    entry_points = dict()
+    for group, group_eps in groups:
+        if group.startswith("multiqc."):
+            entry_points[group] = [[ep.name, ep.value] for ep in group_eps]
+    return {"version": version, "entry_points": entry_points}
+
+
+def get_cache_fn(name, ext):
+    """Path to a cache file. Each Python installation or virtual environment has its own files."""
+    cache_home = os.environ.get("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache"))
+    env_hash = hashlib.sha1(sys.executable.encode("utf-8")).hexdigest()[:12]
+    return os.path.join(cache_home, "multiqc", "{}_{}.{}".format(name, env_hash, ext))
+
+
+def save_cache_file(cache_fn, content):
+    """Write bytes to a cache file. Does nothing if the cache directory is not writable."""
+    try:
+        os.makedirs(os.path.dirname(cache_fn), exist_ok=True)
+        # Write to a temporary file first, in case another MultiQC process reads the cache
+        fd, tmp_fn = tempfile.mkstemp(dir=os.path.dirname(cache_fn), suffix=".tmp")
+        with os.fdopen(fd, "wb") as fh:
+            fh.write(content)
+        os.replace(tmp_fn, cache_fn)
+    except OSError:
+        pass
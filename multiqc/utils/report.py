@@ -2,25 +2,33 @@
 
 """ MultiQC report module. Holds the output from each
 module. Is available to subsequent modules. Contains
-helper functions to generate markup for report. """
+helper functions to generate markup for report.
+Each ReportContext has its own copy of the output, see context.py """
 
 
+import base64
 import fnmatch
 import inspect
 import io
 import json
 import mimetypes
+import numbers
 import os
 import re
 import time
-from collections import OrderedDict, defaultdict
+import types
+import warnings
+import zlib
+from collections import OrderedDict, defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
 
 import lzstring
 import rich
 import rich.progress
 import yaml
 
-from . import config
+from . import config, context, search_cache, util_functions
+from .search_matcher import SearchMatcher
 
 logger = config.logger
 
@@ -35,70 +43,61 @@ except NameError:
     pass  # Python 3
 
 
+# Compiled search patterns from the last run: (fingerprint, SearchMatcher). Not reset by init().
+last_search_matcher = None
+
+
+# Report variables are per ReportContext, so functions here use them through the module object
+report = context.context_module(__name__)
+
+
+def initial_values():
+    """Empty report variables, shared across modules"""
+    return {
+        "general_stats_data": list(),
+        "general_stats_headers": list(),
+        "general_stats_html": "",
+        "data_sources": defaultdict(lambda: defaultdict(lambda: defaultdict())),
+        "plot_data": dict(),
+        "html_ids": list(),
+        "lint_errors": list(),
+        "num_hc_plots": 0,
+        "num_mpl_plots": 0,
+        "saved_raw_data": dict(),
+        "last_found_file": None,
+        "runtimes": {
+            "total": 0,
+            "total_sp": 0,
+            "total_mods": 0,
+            "total_compression": 0,
+            "sp": defaultdict(),
+            "mods": defaultdict(),
+        },
+        "file_search_stats": {
+            "skipped_symlinks": 0,
+            "skipped_not_a_file": 0,
+            "skipped_ignore_pattern": 0,
+            "skipped_filesize_limit": 0,
+            "skipped_module_specific_max_filesize": 0,
+            "skipped_no_match": 0,
+            "skipped_directory_fn_ignore_dirs": 0,
+            "skipped_file_contents_search_errors": 0,
+        },
+        "searchfiles": list(),
+        # Make a dict of discovered files for each search key
+        "files": dict(),
+    }
+
+
 # Set up global variables shared across modules
 # Inside a function so that the global vars are reset if MultiQC is run more than once within a single session / environment
 def init():
-    global general_stats_data
-    general_stats_data = list()
-
-    global general_stats_headers
-    general_stats_headers = list()
-
-    global general_stats_html
-    general_stats_html = ""
-
-    global data_sources
-    data_sources = defaultdict(lambda: defaultdict(lambda: defaultdict()))
-
-    global plot_data
-    plot_data = dict()
-
-    global html_ids
-    html_ids = list()
-
-    global lint_errors
-    lint_errors = list()
-
-    global num_hc_plots
-    num_hc_plots = 0
-
-    global num_mpl_plots
-    num_mpl_plots = 0
-
-    global saved_raw_data
-    saved_raw_data = dict()
-
-    global last_found_file
-    last_found_file = None
-
-    global runtimes
-    runtimes = {
-        "total": 0,
-        "total_sp": 0,
-        "total_mods": 0,
-        "total_compression": 0,
-        "sp": defaultdict(),
-        "mods": defaultdict(),
-    }
+    for k, v in initial_values().items():
+        setattr(report, k, v)
 
-    global file_search_stats
-    file_search_stats = {
-        "skipped_symlinks": 0,
-        "skipped_not_a_file": 0,
-        "skipped_ignore_pattern": 0,
-        "skipped_filesize_limit": 0,
-        "skipped_module_specific_max_filesize": 0,
-        "skipped_no_match": 0,
-        "skipped_directory_fn_ignore_dirs": 0,
-        "skipped_file_contents_search_errors": 0,
-    }
-
-    global searchfiles
-    searchfiles = list()
 
-    # Make a dict of discovered files for each search key
-    global files
-    files = dict()
+def new_context_namespace():
+    return types.SimpleNamespace(**initial_values())
 
 
 def get_filelist(run_module_names):
@@ -108,7 +107,7 @@ def get_filelist(run_module_names):
     """
     # Prep search patterns
     spatterns = [{}, {}, {}, {}, {}, {}, {}]
-    runtimes["sp"] = defaultdict()
+    report.runtimes["sp"] = defaultdict()
     ignored_patterns = []
     skipped_patterns = []
     for key, sps in config.sp.items():
@@ -116,7 +115,8 @@ def get_filelist(run_module_names):
         if mod_name.lower() not in [m.lower() for m in run_module_names]:
             ignored_patterns.append(key)
             continue
-        files[key] = list()
+        report.files[key] = list()
+        report.runtimes["sp"][key] = 0
         if not isinstance(sps, list):
             sps = [sps]
 
@@ -168,58 +168,103 @@ def get_filelist(run_module_names):
         logger.info("Skipping {} file search patterns".format(len(skipped_patterns)))
         logger.debug("Skipping search patterns: {}".format(", ".join(skipped_patterns)))
 
+    # Compile all search patterns once, so that each file only needs to be read once
+    matcher = get_search_matcher(spatterns)
+
+    # Load search results from previous runs, unless disabled
+    cache = search_cache.open_cache(spatterns, config.analysis_dir)
+
+    def search_patterns(f, stats, sp_times):
+        """
+        Test a file against each search pattern and
+        return the list of search keys that it matched.
+        """
+        matched_keys = []
+        # The file contents are read once and checked against all content patterns
+        # on the first content search, so that time is counted against that search key.
+        # Only the search patterns that could match this filename are tried.
+        with matcher.scan(f) as scan:
+            for key, patterns in scan.patterns():
+                start = time.time()
+                for pattern in patterns:
+                    if scan.search(pattern, stats):
+                        # Check that we shouldn't exclude this file
+                        if not exclude_file(pattern.sp, f):
+                            # Looks good! Remember this file
+                            matched_keys.append(key)
+                        # Don't keep searching this file for other modules
+                        if not pattern.shared:
+                            sp_times[key] += time.time() - start
+                            return matched_keys
+                        # Don't look at other patterns for this module
+                        else:
+                            break
+                sp_times[key] += time.time() - start
+        return matched_keys
+
     def add_file(fn, root):
         """
         Function applied to each file found when walking the analysis
-        directories. Runs through all search patterns and returns True
-        if a match is found.
+        directories. Runs through all search patterns and returns a tuple
+        of the file dict, the list of matched search keys, the search
+        stats / runtimes for this file and the file stat result if the
+        search result should be cached. Does not touch the shared report
+        variables, so that it can be run from multiple threads at once.
         """
         f = {"fn": fn, "root": root}
+        path = os.path.join(root, fn)
+        stats = defaultdict(int)
+        sp_times = defaultdict(float)
 
         # Check that this is a file and not a pipe or anything weird
-        if not os.path.isfile(os.path.join(root, fn)):
-            file_search_stats["skipped_not_a_file"] += 1
-            return False
+        if not os.path.isfile(path):
+            stats["skipped_not_a_file"] += 1
+            return f, [], stats, sp_times, None
 
         # Check that we don't want to ignore this file
         i_matches = [n for n in config.fn_ignore_files if fnmatch.fnmatch(fn, n)]
         if len(i_matches) > 0:
-            file_search_stats["skipped_ignore_pattern"] += 1
-            return False
+            stats["skipped_ignore_pattern"] += 1
+            return f, [], stats, sp_times, None
 
         # Limit search to small files, to avoid 30GB FastQ files etc.
         try:
-            f["filesize"] = os.path.getsize(os.path.join(root, fn))
+            st = os.stat(path)
+            f["filesize"] = st.st_size
         except (IOError, OSError, ValueError, UnicodeDecodeError):
+            st = None
             logger.debug("Couldn't read file when checking filesize: {}".format(fn))
         else:
             if f["filesize"] > config.log_filesize_limit:
-                file_search_stats["skipped_filesize_limit"] += 1
-                return False
+                stats["skipped_filesize_limit"] += 1
+                return f, [], stats, sp_times, None
 
-        # Test file for each search pattern
-        file_matched = False
-        for patterns in spatterns:
-            for key, sps in patterns.items():
-                start = time.time()
-                for sp in sps:
-                    if search_file(sp, f, key):
-                        # Check that we shouldn't exclude this file
-                        if not exclude_file(sp, f):
-                            # Looks good! Remember this file
-                            files[key].append(f)
-                            file_search_stats[key] = file_search_stats.get(key, 0) + 1
-                            file_matched = True
-                        # Don't keep searching this file for other modules
-                        if not sp.get("shared", False):
-                            runtimes["sp"][key] = runtimes["sp"].get(key, 0) + (time.time() - start)
-                            return True
-                        # Don't look at other patterns for this module
-                        else:
-                            break
-                runtimes["sp"][key] = runtimes["sp"].get(key, 0) + (time.time() - start)
+        # Use the result from a previous run if the file hasn't changed
+        if cache is not None and st is not None:
+            cached = cache.get(path, st)
+            if cached is not None:
+                matched_keys, cached_stats = cached
+                stats.update(cached_stats)
+                return f, matched_keys, stats, sp_times, None
+
+        return f, search_patterns(f, stats, sp_times), stats, sp_times, st
 
-        return file_matched
+    def merge_file(f, matched_keys, stats, sp_times, st):
+        """
+        Add the search results for a single file to the report. Always
+        called from the main thread, in the order that the files were found.
+        Returns True if the file matched any search pattern.
+        """
+        for key in matched_keys:
+            report.files[key].append(f)
+            report.file_search_stats[key] = report.file_search_stats.get(key, 0) + 1
+        for key, count in stats.items():
+            report.file_search_stats[key] = report.file_search_stats.get(key, 0) + count
+        for key, t in sp_times.items():
+            report.runtimes["sp"][key] = report.runtimes["sp"].get(key, 0) + t
+        if cache is not None and st is not None:
+            cache.add(os.path.join(f["root"], f["fn"]), st, matched_keys, stats)
+        return len(matched_keys) > 0
 
     # Go through the analysis directories and get file list
     multiqc_installation_dir_files = [
@@ -233,58 +278,97 @@ def get_filelist(run_module_names):
         "setup.py",
         ".gitignore",
     ]
+
+    def prune_dir(root, dirnames, filenames):
+        """
+        Remove ignored sub-directories from dirnames in-place, as with os.walk().
+        Returns False if the files in this directory should be skipped.
+        """
+        bname = os.path.basename(root)
+
+        # Skip any sub-directories matching ignore params
+        orig_dirnames = dirnames[:]
+        for n in config.fn_ignore_dirs:
+            dirnames[:] = [d for d in dirnames if not fnmatch.fnmatch(d, n.rstrip(os.sep))]
+            if len(orig_dirnames) != len(dirnames):
+                removed_dirs = [os.path.join(root, d) for d in set(orig_dirnames).symmetric_difference(set(dirnames))]
+                report.file_search_stats["skipped_directory_fn_ignore_dirs"] += len(removed_dirs)
+                orig_dirnames = dirnames[:]
+        for n in config.fn_ignore_paths:
+            dirnames[:] = [d for d in dirnames if not fnmatch.fnmatch(os.path.join(root, d), n.rstrip(os.sep))]
+            if len(orig_dirnames) != len(dirnames):
+                removed_dirs = [os.path.join(root, d) for d in set(orig_dirnames).symmetric_difference(set(dirnames))]
+                report.file_search_stats["skipped_directory_fn_ignore_dirs"] += len(removed_dirs)
+
+        # Skip *this* directory if matches ignore params
+        d_matches = [n for n in config.fn_ignore_dirs if fnmatch.fnmatch(bname, n.rstrip(os.sep))]
+        if len(d_matches) > 0:
+            report.file_search_stats["skipped_directory_fn_ignore_dirs"] += 1
+            return False
+        p_matches = [n for n in config.fn_ignore_paths if fnmatch.fnmatch(root, n.rstrip(os.sep))]
+        if len(p_matches) > 0:
+            report.file_search_stats["skipped_directory_fn_ignore_dirs"] += 1
+            return False
+
+        # Sanity check - make sure that we're not just running in the installation directory
+        if len(filenames) > 0 and all([fn in filenames for fn in multiqc_installation_dir_files]):
+            logger.error("Error: MultiQC is running in source code directory! {}".format(root))
+            logger.warning("Please see the docs for how to use MultiQC: https://multiqc.info/docs/#running-multiqc")
+            dirnames[:] = []
+            filenames[:] = []
+            return False
+
+        return True
+
+    def walk_dir(path, pool=None):
+        """
+        Walk a directory tree, yielding (root, filenames) in the same order as os.walk().
+        If a thread pool is given, the directory listings are fetched by the
+        pool ahead of time, so that slow stat calls (eg. NFS) run in parallel.
+        """
+        followlinks = not config.ignore_symlinks
+        if pool is None:
+            for root, dirnames, filenames in os.walk(path, followlinks=followlinks, topdown=True):
+                if prune_dir(root, dirnames, filenames):
+                    yield root, filenames
+            return
+
+        pending = {path: pool.submit(_list_dir, path)}
+        stack = [path]
+        while stack:
+            root = stack.pop()
+            dirnames, filenames = pending.pop(root).result()
+            keep_files = prune_dir(root, dirnames, filenames)
+            subdirs = [os.path.join(root, d) for d in dirnames]
+            subdirs = [d for d in subdirs if followlinks or not os.path.islink(d)]
+            for d in subdirs:
+                pending[d] = pool.submit(_list_dir, d)
+            stack.extend(reversed(subdirs))
+            if keep_files:
+                yield root, filenames
+
+    # Use a thread pool if requested. Most of the work is stat / open / read calls,
+    # which release the GIL, so threads are enough to get a good speedup.
+    num_threads = max(int(getattr(config, "search_threads", 1) or 1), 1)
+    pool = None
+    if num_threads > 1:
+        logger.debug("Searching files using {} threads".format(num_threads))
+        # Initialise the mimetypes database once, before any threads use it
+        mimetypes.init()
+        pool = ThreadPoolExecutor(max_workers=num_threads)
+
     total_sp_starttime = time.time()
     for path in config.analysis_dir:
         if os.path.islink(path) and config.ignore_symlinks:
-            file_search_stats["skipped_symlinks"] += 1
+            report.file_search_stats["skipped_symlinks"] += 1
             continue
         elif os.path.isfile(path):
-            searchfiles.append([os.path.basename(path), os.path.dirname(path)])
+            report.searchfiles.append([os.path.basename(path), os.path.dirname(path)])
         elif os.path.isdir(path):
-            for root, dirnames, filenames in os.walk(path, followlinks=(not config.ignore_symlinks), topdown=True):
-                bname = os.path.basename(root)
-
-                # Skip any sub-directories matching ignore params
-                orig_dirnames = dirnames[:]
-                for n in config.fn_ignore_dirs:
-                    dirnames[:] = [d for d in dirnames if not fnmatch.fnmatch(d, n.rstrip(os.sep))]
-                    if len(orig_dirnames) != len(dirnames):
-                        removed_dirs = [
-                            os.path.join(root, d) for d in set(orig_dirnames).symmetric_difference(set(dirnames))
-                        ]
-                        file_search_stats["skipped_directory_fn_ignore_dirs"] += len(removed_dirs)
-                        orig_dirnames = dirnames[:]
-                for n in config.fn_ignore_paths:
-                    dirnames[:] = [d for d in dirnames if not fnmatch.fnmatch(os.path.join(root, d), n.rstrip(os.sep))]
-                    if len(orig_dirnames) != len(dirnames):
-                        removed_dirs = [
-                            os.path.join(root, d) for d in set(orig_dirnames).symmetric_difference(set(dirnames))
-                        ]
-                        file_search_stats["skipped_directory_fn_ignore_dirs"] += len(removed_dirs)
-
-                # Skip *this* directory if matches ignore params
-                d_matches = [n for n in config.fn_ignore_dirs if fnmatch.fnmatch(bname, n.rstrip(os.sep))]
-                if len(d_matches) > 0:
-                    file_search_stats["skipped_directory_fn_ignore_dirs"] += 1
-                    continue
-                p_matches = [n for n in config.fn_ignore_paths if fnmatch.fnmatch(root, n.rstrip(os.sep))]
-                if len(p_matches) > 0:
-                    file_search_stats["skipped_directory_fn_ignore_dirs"] += 1
-                    continue
-
-                # Sanity check - make sure that we're not just running in the installation directory
-                if len(filenames) > 0 and all([fn in filenames for fn in multiqc_installation_dir_files]):
-                    logger.error("Error: MultiQC is running in source code directory! {}".format(root))
-                    logger.warning(
-                        "Please see the docs for how to use MultiQC: https://multiqc.info/docs/#running-multiqc"
-                    )
-                    dirnames[:] = []
-                    filenames[:] = []
-                    continue
-
+            for root, filenames in walk_dir(path, pool):
                 # Search filenames in this directory
                 for fn in filenames:
-                    searchfiles.append([fn, root])
+                    report.searchfiles.append([fn, root])
 
     # Search through collected files
     console = rich.console.Console(
@@ -304,30 +388,84 @@ def get_filelist(run_module_names):
         console=console,
         disable=config.no_ansi or config.quiet,
     )
-    with progress_obj as progress:
-        mqc_task = progress.add_task("searching", total=len(searchfiles), s_fn="")
-        for sf in searchfiles:
-            progress.update(mqc_task, advance=1, s_fn=os.path.join(sf[1], sf[0])[-50:])
-            if not add_file(sf[0], sf[1]):
-                file_search_stats["skipped_no_match"] += 1
-        progress.update(mqc_task, s_fn="")
-
-    runtimes["total_sp"] = time.time() - total_sp_starttime
+    try:
+        with progress_obj as progress:
+            mqc_task = progress.add_task("searching", total=len(report.searchfiles), s_fn="")
+            if pool is None:
+                results = (add_file(sf[0], sf[1]) for sf in report.searchfiles)
+            else:
+                # The search threads use the config of this thread's ReportContext
+                results = _ordered_map(pool, context.wrap(add_file), report.searchfiles, num_threads * 64)
+            for result in results:
+                f = result[0]
+                progress.update(mqc_task, advance=1, s_fn=os.path.join(f["root"], f["fn"])[-50:])
+                if not merge_file(*result):
+                    report.file_search_stats["skipped_no_match"] += 1
+            progress.update(mqc_task, s_fn="")
+        if cache is not None:
+            cache.prune()
+    finally:
+        if pool is not None:
+            pool.shutdown(wait=True)
+        if cache is not None:
+            cache.save()
+
+    report.runtimes["total_sp"] = time.time() - total_sp_starttime
 
     # Debug log summary about what we skipped
     summaries = []
-    for key in sorted(file_search_stats, key=file_search_stats.get, reverse=True):
-        if "skipped_" in key and file_search_stats[key] > 0:
-            summaries.append(f"{key}: {file_search_stats[key]}")
+    for key in sorted(report.file_search_stats, key=report.file_search_stats.get, reverse=True):
+        if "skipped_" in key and report.file_search_stats[key] > 0:
+            summaries.append(f"{key}: {report.file_search_stats[key]}")
     logger.debug(f"Summary of files that were skipped by the search: [{'] // ['.join(summaries)}]")
 
 
-def search_file(pattern, f, module_key):
+def get_search_matcher(spatterns):
+    """
+    Compiled search patterns. The last matcher is kept and reused if the search patterns
+    haven't changed, for when MultiQC is run more than once in the same process.
+    """
+    global last_search_matcher
+    fingerprint = search_cache.search_fingerprint(spatterns)
+    if last_search_matcher is None or last_search_matcher[0] != fingerprint:
+        last_search_matcher = (fingerprint, SearchMatcher(spatterns))
+    return last_search_matcher[1]
+
+
+def _list_dir(path):
+    """List a single directory, returning (dirnames, filenames) as os.walk() would"""
+    try:
+        _, dirnames, filenames = next(os.walk(path))
+    except StopIteration:
+        # os.walk() silently skips directories that can't be read
+        return [], []
+    return dirnames, filenames
+
+
+def _ordered_map(pool, fn, items, window):
+    """
+    Like pool.map(), but only keeps a limited number of tasks in flight
+    so that we don't create a future for every file up front.
+    Results are yielded in the same order as the input items.
+    """
+    queue = deque()
+    for item in items:
+        if len(queue) >= window:
+            yield queue.popleft().result()
+        queue.append(pool.submit(fn, *item))
+    while queue:
+        yield queue.popleft().result()
+
+
+def search_file(pattern, f, module_key, stats=None):
     """
     Function to searach a single file for a single search pattern.
+    Skipped-file counts are added to `stats` if given, otherwise
+    to the global file_search_stats.
     """
 
-    global file_search_stats
+    if stats is None:
+        stats = report.file_search_stats
     fn_matched = False
     contents_matched = False
 
@@ -342,7 +480,7 @@ def search_file(pattern, f, module_key):
     # Search pattern specific filesize limit
     if pattern.get("max_filesize") is not None and "filesize" in f:
         if f["filesize"] > pattern.get("max_filesize"):
-            file_search_stats["skipped_module_specific_max_filesize"] += 1
+            stats["skipped_module_specific_max_filesize"] += 1
             return False
 
     # Search by file name (glob)
@@ -390,7 +528,7 @@ def search_file(pattern, f, module_key):
         except (IOError, OSError, ValueError, UnicodeDecodeError) as e:
             if config.report_readerrors:
                 logger.debug(f"Couldn't read file when looking for output: {file_path}, {e}")
-            file_search_stats["skipped_file_contents_search_errors"] += 1
+            stats["skipped_file_contents_search_errors"] += 1
             return False
 
     return fn_matched and contents_matched
@@ -401,37 +539,38 @@ def exclude_file(sp, f):
     Exclude discovered files if they match the special exclude_
     search pattern keys
     """
-    # Make everything a list if it isn't already
-    for k in sp:
-        if k in ["exclude_fn", "exclude_fn_re" "exclude_contents", "exclude_contents_re"]:
-            if not isinstance(sp[k], list):
-                sp[k] = [sp[k]]
+    # Make everything a list if it isn't already.
+    # Don't modify the search pattern itself, as this may be running in several threads.
+    excl = {}
+    for k in ["exclude_fn", "exclude_fn_re", "exclude_contents", "exclude_contents_re"]:
+        if k in sp:
+            excl[k] = sp[k] if isinstance(sp[k], list) else [sp[k]]
 
     # Search by file name (glob)
-    if "exclude_fn" in sp:
-        for pat in sp["exclude_fn"]:
+    if "exclude_fn" in excl:
+        for pat in excl["exclude_fn"]:
             if fnmatch.fnmatch(f["fn"], pat):
                 return True
 
     # Search by file name (regex)
-    if "exclude_fn_re" in sp:
-        for pat in sp["exclude_fn_re"]:
+    if "exclude_fn_re" in excl:
+        for pat in excl["exclude_fn_re"]:
             if re.match(pat, f["fn"]):
                 return True
 
     # Search the contents of the file
-    if "exclude_contents" in sp or "exclude_contents_re" in sp:
+    if "exclude_contents" in excl or "exclude_contents_re" in excl:
         # Compile regex patterns if we have any
-        if "exclude_contents_re" in sp:
-            sp["exclude_contents_re"] = [re.compile(pat) for pat in sp["exclude_contents_re"]]
+        if "exclude_contents_re" in excl:
+            excl["exclude_contents_re"] = [re.compile(pat) for pat in excl["exclude_contents_re"]]
         with io.open(os.path.join(f["root"], f["fn"]), "r", encoding="utf-8") as fh:
             for line in fh:
-                if "exclude_contents" in sp:
-                    for pat in sp["exclude_contents"]:
+                if "exclude_contents" in excl:
+                    for pat in excl["exclude_contents"]:
                         if pat in line:
                             return True
-                if "exclude_contents_re" in sp:
-                    for pat in sp["exclude_contents_re"]:
+                if "exclude_contents_re" in excl:
+                    for pat in excl["exclude_contents_re"]:
                         if re.search(pat, line):
                             return True
     return False
@@ -441,15 +580,15 @@ def data_sources_tofile():
     fn = "multiqc_sources.{}".format(config.data_format_extensions[config.data_format])
     with io.open(os.path.join(config.data_dir, fn), "w", encoding="utf-8") as f:
         if config.data_format == "json":
-            jsonstr = json.dumps(data_sources, indent=4, ensure_ascii=False)
+            jsonstr = json.dumps(report.data_sources, indent=4, ensure_ascii=False)
             print(jsonstr.encode("utf-8", "ignore").decode("utf-8"), file=f)
         elif config.data_format == "yaml":
-            yaml.dump(data_sources, f, default_flow_style=False)
+            yaml.dump(report.data_sources, f, default_flow_style=False)
         else:
             lines = [["Module", "Section", "Sample Name", "Source"]]
-            for mod in data_sources:
-                for sec in data_sources[mod]:
-                    for s_name, source in data_sources[mod][sec].items():
+            for mod in report.data_sources:
+                for sec in report.data_sources[mod]:
+                    for s_name, source in report.data_sources[mod][sec].items():
                         lines.append([mod, sec, s_name, source])
             body = "\n".join(["\t".join(l) for l in lines])
             print(body.encode("utf-8", "ignore").decode("utf-8"), file=f)
@@ -459,7 +598,7 @@ def dois_tofile():
     """Find all DOIs listed in report sections and write to a file"""
     # Collect DOIs
     dois = {"MultiQC": ["10.1093/bioinformatics/btw354"]}
-    for mod in modules_output:
+    for mod in report.modules_output:
         if mod.doi is not None and mod.doi != []:
             dois[mod.anchor] = mod.doi
     # Write to a file
@@ -481,9 +620,6 @@ def dois_tofile():
 def save_htmlid(html_id, skiplint=False):
     """Take a HTML ID, sanitise for HTML, check for duplicates and save.
     Returns sanitised, unique ID"""
-    global html_ids
-    global lint_errors
-
     # Trailing whitespace
     html_id_clean = html_id.strip()
 
@@ -511,43 +647,208 @@ def save_htmlid(html_id, skiplint=False):
     if config.lint and not skiplint and html_id != html_id_clean:
         errmsg = "LINT: {}HTML ID was not clean ('{}' -> '{}') ## {}".format(modname, html_id, html_id_clean, codeline)
         logger.error(errmsg)
-        lint_errors.append(errmsg)
+        report.lint_errors.append(errmsg)
 
     # Check for duplicates
     i = 1
     html_id_base = html_id_clean
-    while html_id_clean in html_ids:
+    while html_id_clean in report.html_ids:
         html_id_clean = "{}-{}".format(html_id_base, i)
         i += 1
         if config.lint and not skiplint:
             errmsg = "LINT: {}HTML ID was a duplicate ({}) ## {}".format(modname, html_id_clean, codeline)
             logger.error(errmsg)
-            lint_errors.append(errmsg)
+            report.lint_errors.append(errmsg)
 
     # Remember and return
-    html_ids.append(html_id_clean)
+    report.html_ids.append(html_id_clean)
     return html_id_clean
 
 
-def compress_json(data):
-    """Take a Python data object. Convert to JSON and compress using lzstring"""
-    json_string = json.dumps(data).encode("utf-8", "ignore").decode("utf-8")
-    json_string = sanitise_json(json_string)
+def compress_json(data, compression="lzstring"):
+    """
+    Take a Python data object. Convert to JSON and compress, then encode as base64.
+    Compression is either "deflate" (zlib, much faster) or "lzstring".
+    For "deflate", the JSON is compressed one top-level key at a time,
+    so that the whole JSON string is never held in memory.
+    """
+    chunks = json_chunks(data)
+    if compression == "deflate":
+        compressor = zlib.compressobj(6, zlib.DEFLATED, -15)  # Raw deflate stream, without zlib header
+        compressed = [compressor.compress(chunk.encode("utf-8")) for chunk in chunks]
+        compressed.append(compressor.flush())
+        return base64.b64encode(b"".join(compressed)).decode("ascii")
     x = lzstring.LZString()
-    return x.compressToBase64(json_string)
+    return x.compressToBase64("".join(chunks))
+
+
+def compress_plot_data(data, compression="lzstring"):
+    """
+    Compress the JSON for each plot separately, so that the report only has to
+    decompress the data for a plot when it is shown. Returns a dict of plot ID to
+    base64 encoded compressed JSON.
+    """
+    return {pid: compress_json(plot, compression) for pid, plot in data.items()}
+
+
+class LegacyCompressedJson(object):
+    """
+    The plot data of the whole report as one LZString compressed JSON string, as
+    report.plot_compressed_json was before the data was compressed for each plot.
+    Kept for templates that still use it, and only made when it is first used.
+    """
+
+    def __init__(self, data):
+        self.data = data
+        self.compressed = None
+
+    def __str__(self):
+        if self.compressed is None:
+            self.compressed = compress_json(self.data, "lzstring")
+        return self.compressed
+
+    def __html__(self):
+        return str(self)
+
+
+def json_chunks(data):
+    """
+    Generate the JSON for a dict one top-level key at a time. Joined together,
+    the chunks are the same as json.dumps(data), except that NaN and Infinity
+    are written as null.
+    """
+    if not isinstance(data, dict):
+        yield util_functions.dump_json(data)
+        return
+    yield "{"
+    for i, (k, v) in enumerate(data.items()):
+        # Dump a single-item dict, so that keys are converted in the same way as json.dumps
+        yield ("" if i == 0 else ", ") + util_functions.dump_json({k: v})[1:-1]
+    yield "}"
 
 
 def sanitise_json(json_string):
     """
-    The Python json module uses a bunch of values which are valid JavaScript
-    but invalid JSON. These crash the browser when parsing the JSON.
-    Nothing in the MultiQC front-end uses these values, so instead we just
-    do a find-and-replace for them and switch them with `null`, which works fine.
-
-    Side effect: Any string values that include the word "Infinity"
-    (case-sensitive) will have it switched for "null". Hopefully that doesn't happen
-    a lot, otherwise we'll have to do this in a more complicated manner.
+    Deprecated, will be removed in the next release. Replace NaN and Infinity
+    values in a JSON string with null. Use util_functions.dump_json() to
+    write the JSON without them in the first place instead.
     """
-    json_string = re.sub(r"\bNaN\b", "null", json_string)
-    json_string = re.sub(r"\b-?Infinity\b", "null", json_string)
-    return json_string
+    warnings.warn(
+        "report.sanitise_json() is deprecated, use util_functions.dump_json() instead",
+        DeprecationWarning,
+        stacklevel=2,
+    )
+    return util_functions.dump_json(json.loads(json_string, object_pairs_hook=OrderedDict))
+
+
+def encode_plot_data(data, encoding="float64"):
+    """
+    Return a copy of the report plot data with the numeric series packed as base64 encoded,
+    little-endian typed arrays, which multiqc_plotting.js decodes when the report loads.
+    With encoding "float64" or "float32", line graph, bar graph and beeswarm series are packed,
+    and series with any values that aren't numbers or null are left as JSON lists.
+    Heatmap matrices are always packed as one dense row-major array, as Float64 unless
+    the encoding is "float32".
+    """
+    dtype = "float32" if encoding == "float32" else "float64"
+    encoded = dict()
+    for pid, plot in data.items():
+        encoder = plot_data_encoders.get(plot.get("plot_type")) if isinstance(plot, dict) else None
+        if encoder is None or (encoding == "json" and encoder is not encode_heatmap):
+            encoded[pid] = plot
+        else:
+            encoded[pid] = encoder(plot, TypedArrayPacker(dtype))
+    return encoded
+
+
+class TypedArrayPacker(object):
+    """Packs the series of one plot, storing each distinct line graph x-axis once"""
+
+    def __init__(self, dtype):
+        # Imported here as NumPy is slow to load, and not needed to start MultiQC
+        import numpy as np
+
+        self.dtype = np.dtype(dtype).newbyteorder("<")
+        self.typed = "f{}".format(self.dtype.itemsize)
+        self.x_axes = list()
+        self.x_axis_ids = dict()
+
+    def pack(self, values):
+        """Pack a list of numbers and None as a typed array, or return None if it has other values"""
+        import numpy as np
+
+        if not isinstance(values, list) or not all(is_packable_type(t) for t in set(map(type, values))):
+            return None
+        arr = np.array(values, dtype=float)  # None becomes NaN
+        arr[~np.isfinite(arr)] = np.nan  # NaN and Infinity are null in the JSON
+        return {"mqc_typed": self.typed, "data": base64.b64encode(arr.astype(self.dtype).tobytes()).decode("ascii")}
+
+    def pack_xy(self, pairs):
+        """Pack a list of [x, y] pairs as a y typed array and a shared x-axis"""
+        if not isinstance(pairs, list) or not all(isinstance(p, (list, tuple)) and len(p) == 2 for p in pairs):
+            return None
+        x = self.pack([p[0] for p in pairs])
+        y = self.pack([p[1] for p in pairs])
+        if x is None or y is None:
+            return None
+        if x["data"] not in self.x_axis_ids:
+            self.x_axis_ids[x["data"]] = len(self.x_axes)
+            self.x_axes.append(x)
+        return {"mqc_typed": "xy", "x": self.x_axis_ids[x["data"]], "y": y}
+
+    def pack_matrix(self, rows):
+        """Pack a rectangular list of rows of numbers and None as one row-major typed array"""
+        if not isinstance(rows, list) or not all(isinstance(r, list) for r in rows):
+            return None
+        ncols = len(rows[0]) if rows else 0
+        if any(len(r) != ncols for r in rows):
+            return None
+        values = self.pack([v for r in rows for v in r])
+        if values is None:
+            return None
+        return {"mqc_typed": "matrix", "ncols": ncols, "values": values}
+
+
+def is_packable_type(t):
+    """Can values of this type go in a typed array"""
+    return t is type(None) or (issubclass(t, numbers.Real) and not issubclass(t, bool))
+
+
+def pack_series_data(series, pack):
+    """Copy of a series dict with its data packed, if it can be"""
+    if not isinstance(series, dict) or "data" not in series:
+        return series
+    packed = pack(series["data"])
+    return series if packed is None else dict(series, data=packed)
+
+
+def encode_line_graph(plot, packer):
+    def pack(data):
+        if data and isinstance(data[0], (list, tuple)):
+            return packer.pack_xy(data)
+        return packer.pack(data)  # Category line graphs
+
+    datasets = [[pack_series_data(s, pack) for s in dataset] for dataset in plot["datasets"]]
+    return dict(plot, datasets=datasets, typed_x_axes=packer.x_axes)
+
+
+def encode_bar_graph(plot, packer):
+    datasets = [[pack_series_data(s, packer.pack) for s in dataset] for dataset in plot["datasets"]]
+    return dict(plot, datasets=datasets)
+
+
+def encode_beeswarm(plot, packer):
+    datasets = [packer.pack(dataset) or dataset for dataset in plot["datasets"]]
+    return dict(plot, datasets=datasets)
+
+
+def encode_heatmap(plot, packer):
+    return dict(plot, rows=packer.pack_matrix(plot["rows"]) or plot["rows"])
+
+
+plot_data_encoders = {
+    "xy_line": encode_line_graph,
+    "bar_graph": encode_bar_graph,
+    "beeswarm": encode_beeswarm,
+    "heatmap": encode_heatmap,
+}
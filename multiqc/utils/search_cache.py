@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+
+""" MultiQC file search cache. Remembers which search patterns each file
+matched, so that unchanged files don't need to be searched again on the
+next run. Results are stored in a SQLite database, keyed on the file path,
+size and modification time. Disabled by default. """
+
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+from . import config
+
+logger = config.logger
+
+# Forget search results for settings that haven't been used for 30 days
+max_fingerprint_age = 30 * 24 * 60 * 60
+
+
+def get_cache_dir():
+    """Directory for MultiQC cache files"""
+    if config.cache_dir is not None:
+        return config.cache_dir
+    cache_home = os.environ.get("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache"))
+    return os.path.join(cache_home, "multiqc")
+
+
+def search_fingerprint(spatterns):
+    """
+    Hash everything that changes the search result for a file: the MultiQC version,
+    the search patterns being used (in search order) and the file ignore settings.
+    """
+    fingerprint = {
+        "version": config.version,
+        "spatterns": [[[key, sps] for key, sps in bucket.items()] for bucket in spatterns],
+        "fn_ignore_files": config.fn_ignore_files,
+        "log_filesize_limit": config.log_filesize_limit,
+        "ignore_images": config.ignore_images,
+    }
+    fingerprint_json = json.dumps(fingerprint, sort_keys=True, default=str)
+    return hashlib.sha1(fingerprint_json.encode("utf-8")).hexdigest()
+
+
+def open_cache(spatterns, search_paths):
+    """Load the search cache, or return None if it's disabled or can't be used"""
+    if not config.search_cache:
+        return None
+    cache_fn = os.path.join(get_cache_dir(), "search_cache.sqlite")
+    try:
+        return SearchCache(cache_fn, search_fingerprint(spatterns), search_paths)
+    except (sqlite3.Error, OSError) as e:
+        logger.debug("Could not load file search cache '{}': {}".format(cache_fn, e))
+        return None
+
+
+class SearchCache(object):
+    """
+    Search results for one set of search patterns. The results for files under
+    the search paths are read into memory when the cache is opened, so that
+    lookups are thread safe. New results are collected and written to disk in
+    one go by save().
+    """
+
+    def __init__(self, cache_fn, fingerprint, search_paths):
+        self.cache_fn = cache_fn
+        self.fingerprint = fingerprint
+        self.new_results = list()
+        self.seen = set()
+        self.stale = list()
+
+        os.makedirs(os.path.dirname(cache_fn), exist_ok=True)
+        self.db = sqlite3.connect(cache_fn, timeout=30)
+        with self.db:
+            self.db.execute(
+                """CREATE TABLE IF NOT EXISTS files (
+                    fingerprint TEXT, path TEXT, size INTEGER, mtime_ns INTEGER, result TEXT,
+                    PRIMARY KEY (fingerprint, path)
+                )"""
+            )
+            self.db.execute("CREATE TABLE IF NOT EXISTS fingerprints (fingerprint TEXT PRIMARY KEY, last_used REAL)")
+
+            # Clean up results for old search settings
+            expired = time.time() - max_fingerprint_age
+            self.db.execute(
+                "DELETE FROM files WHERE fingerprint IN (SELECT fingerprint FROM fingerprints WHERE last_used < ?)",
+                (expired,),
+            )
+            self.db.execute("DELETE FROM fingerprints WHERE last_used < ?", (expired,))
+            self.db.execute(
+                "INSERT OR REPLACE INTO fingerprints (fingerprint, last_used) VALUES (?, ?)",
+                (fingerprint, time.time()),
+            )
+
+        # Only load results for files that this search can find
+        self.results = dict()
+        for search_path in set(os.path.abspath(p) for p in search_paths):
+            if os.path.isdir(search_path):
+                # All paths starting with the directory, as a range so that the primary key index is used
+                prefix = search_path.rstrip(os.sep) + os.sep
+                query = "path >= ? AND path < ?"
+                params = (prefix, prefix[:-1] + chr(ord(os.sep) + 1))
+            else:
+                query = "path = ?"
+                params = (search_path,)
+            for path, size, mtime_ns, result in self.db.execute(
+                "SELECT path, size, mtime_ns, result FROM files WHERE fingerprint = ? AND " + query,
+                (fingerprint,) + params,
+            ):
+                self.results[path] = (size, mtime_ns, result)
+        logger.debug("Loaded {} file search results from cache: {}".format(len(self.results), cache_fn))
+
+    def get(self, path, st):
+        """
+        Return the cached (matched_keys, stats) for a file if it
+        hasn't changed since it was searched, otherwise None
+        """
+        path = os.path.abspath(path)
+        self.seen.add(path)
+        cached = self.results.get(path)
+        if cached is None or cached[0] != st.st_size or cached[1] != st.st_mtime_ns:
+            return None
+        result = json.loads(cached[2])
+        return result["matched_keys"], result["stats"]
+
+    def add(self, path, st, matched_keys, stats):
+        """Remember the search result for a file. Not thread safe."""
+        result = json.dumps({"matched_keys": matched_keys, "stats": stats})
+        self.new_results.append((self.fingerprint, os.path.abspath(path), st.st_size, st.st_mtime_ns, result))
+
+    def prune(self):
+        """
+        Forget the results for files under the search paths that this search didn't
+        find, eg. because they were deleted. Only call once the search has finished.
+        """
+        self.stale = [(self.fingerprint, path) for path in self.results if path not in self.seen]
+
+    def save(self):
+        """Write new search results to disk, and remove results from prune()"""
+        try:
+            with self.db:
+                self.db.executemany("DELETE FROM files WHERE fingerprint = ? AND path = ?", self.stale)
+                self.db.executemany(
+                    "INSERT OR REPLACE INTO files (fingerprint, path, size, mtime_ns, result) VALUES (?, ?, ?, ?, ?)",
+                    self.new_results,
+                )
+        except sqlite3.Error as e:
+            logger.debug("Could not save file search cache '{}': {}".format(self.cache_fn, e))
+        else:
+            logger.debug(
+                "Saved {} new file search results to cache, removed {}".format(len(self.new_results), len(self.stale))
+            )
+        finally:
+            self.db.close()
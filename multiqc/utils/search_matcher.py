@@ -0,0 +1,386 @@
+#!/usr/bin/env python
+
+""" MultiQC file search matcher. Compiles the search patterns for the
+modules being run once, so that each file only has to be opened and
+read a single time to check it against every content search pattern. """
+
+import fnmatch
+import heapq
+import io
+import itertools
+import mimetypes
+import os
+import re
+from collections import defaultdict, deque
+
+from . import config
+
+logger = config.logger
+
+# Images that are always allowed through, for custom content
+mqc_image_re = re.compile(r".+_mqc\.(png|jpg|jpeg)")
+
+# Regex backreferences can't be merged into a single alternation regex
+backreference_re = re.compile(r"\\[1-9]|\(\?P=")
+
+# Glob wildcard characters
+glob_special_re = re.compile(r"[*?\[]")
+
+
+class AhoCorasick(object):
+    """Aho-Corasick automaton. Finds every occurrence of a set of literal
+    strings in a single pass over some text."""
+
+    def __init__(self, needles):
+        # Build the trie
+        self.goto = [{}]
+        self.fail = [0]
+        self.out = [()]
+        for needle in needles:
+            state = 0
+            for ch in needle:
+                nxt = self.goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(self.goto)
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.out.append(())
+                    self.goto[state][ch] = nxt
+                state = nxt
+            self.out[state] = self.out[state] + (needle,)
+
+        # Add the failure links, breadth-first
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self.goto[state].items():
+                queue.append(nxt)
+                f = self.fail[state]
+                while f and ch not in self.goto[f]:
+                    f = self.fail[f]
+                if state != 0 and ch in self.goto[f]:
+                    self.fail[nxt] = self.goto[f][ch]
+                self.out[nxt] = self.out[nxt] + self.out[self.fail[nxt]]
+
+    def find(self, text):
+        """Return the set of needles found in text"""
+        goto = self.goto
+        fail = self.fail
+        out = self.out
+        found = set()
+        state = 0
+        for ch in text:
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if out[state]:
+                found.update(out[state])
+        return found
+
+
+class SearchPattern(object):
+    """A single search pattern dict from config.sp, with regexes compiled"""
+
+    def __init__(self, key, sp, order=0):
+        self.key = key
+        self.sp = sp
+        self.order = order
+        self.fn = sp.get("fn")
+        self.fn_re = re.compile(sp["fn_re"]) if sp.get("fn_re") is not None else None
+        self.contents = sp.get("contents")
+        self.contents_re = None
+        if self.contents is None and sp.get("contents_re") is not None:
+            self.contents_re = re.compile(sp["contents_re"])
+        self.num_lines = sp.get("num_lines") or None
+        self.max_filesize = sp.get("max_filesize")
+        self.shared = sp.get("shared", False)
+        self.prefiltered = False
+
+    @property
+    def has_fn(self):
+        return self.fn is not None or self.fn_re is not None
+
+    @property
+    def has_contents(self):
+        return self.contents is not None or self.contents_re is not None
+
+    def match_fn(self, fn):
+        """True / False if the filename matches, None if there is no filename pattern"""
+        if not self.has_fn:
+            return None
+        if self.fn is not None and fnmatch.fnmatch(fn, self.fn):
+            return True
+        if self.fn_re is not None and self.fn_re.match(fn):
+            return True
+        return False
+
+    def __lt__(self, other):
+        return self.order < other.order
+
+
+class FilenameIndex(object):
+    """Index of all fn / fn_re search patterns, to find the patterns that
+    match a filename without testing every pattern in turn.
+
+    Simple globs are put into hash tables: exact filenames, '*suffix' and
+    'prefix*'. Everything else (other globs and fn_re regexes) is merged into
+    a single regex, which is used to skip filenames that can't match any of them."""
+
+    def __init__(self, patterns):
+        self.exact = defaultdict(list)
+        self.suffixes = defaultdict(lambda: defaultdict(list))
+        self.prefixes = defaultdict(lambda: defaultdict(list))
+        self.match_all = list()
+        self.other = list()
+        self.other_prefilter = None
+
+        for p in patterns:
+            if p.fn is not None:
+                pat = os.path.normcase(p.fn)
+                if not glob_special_re.search(pat):
+                    self.exact[pat].append(p)
+                elif pat == "*":
+                    self.match_all.append(p)
+                elif pat.startswith("*") and not glob_special_re.search(pat[1:]):
+                    self.suffixes[len(pat) - 1][pat[1:]].append(p)
+                elif pat.endswith("*") and not glob_special_re.search(pat[:-1]):
+                    self.prefixes[len(pat) - 1][pat[:-1]].append(p)
+                else:
+                    self.other.append((p, re.compile(fnmatch.translate(pat))))
+            if p.fn_re is not None:
+                self.other.append((p, p.fn_re))
+
+        # Filename globs are translated to regexes that match the whole string, and fn_re
+        # patterns are used with re.match(), so both can go into one re.match() alternation.
+        mergeable = [r.pattern for _, r in self.other if not backreference_re.search(r.pattern)]
+        if len(mergeable) == len(self.other) and len(mergeable) > 0:
+            try:
+                self.other_prefilter = re.compile("|".join("(?:{})".format(r) for r in sorted(set(mergeable))))
+            except re.error as e:
+                logger.debug("Could not merge filename search regexes, testing them one at a time: {}".format(e))
+
+    def lookup(self, fn):
+        """Return the set of search patterns whose filename pattern matches fn"""
+        fn = os.path.normcase(fn)
+        found = set(self.match_all)
+        found.update(self.exact.get(fn, []))
+        for length, suffixes in self.suffixes.items():
+            if length <= len(fn):
+                found.update(suffixes.get(fn[len(fn) - length :], []))
+        for length, prefixes in self.prefixes.items():
+            if length <= len(fn):
+                found.update(prefixes.get(fn[:length], []))
+        if len(self.other) > 0 and (self.other_prefilter is None or self.other_prefilter.match(fn)):
+            for p, r in self.other:
+                if r.match(fn):
+                    found.add(p)
+        return found
+
+
+class SearchMatcher(object):
+    """All search patterns for a MultiQC run, compiled for fast file matching.
+    Takes the search pattern buckets from report.get_filelist(), which set the
+    order that patterns are tested in."""
+
+    def __init__(self, spatterns):
+        self.patterns = list()
+        order = itertools.count()
+        for bucket in spatterns:
+            for key, sps in bucket.items():
+                self.patterns.append((key, [SearchPattern(key, sp, next(order)) for sp in sps]))
+        all_patterns = [p for _, ps in self.patterns for p in ps]
+        self.content_patterns = [p for p in all_patterns if p.has_contents]
+
+        # Patterns with a filename are found with the index, the rest have to be tried on every file.
+        # Patterns with neither a filename nor contents can never match, so are dropped.
+        self.fn_index = FilenameIndex([p for p in all_patterns if p.has_fn])
+        self.no_fn_patterns = [p for p in self.content_patterns if not p.has_fn]
+
+        # One automaton for all literal content strings
+        literals = {p.contents for p in self.content_patterns if p.contents is not None}
+        self.literals = AhoCorasick(sorted(literals))
+
+        # One alternation regex to quickly skip lines that can't match any content regex
+        self.regex_prefilter = None
+        regexes = [p for p in self.content_patterns if p.contents_re is not None]
+        mergeable = [p for p in regexes if not backreference_re.search(p.contents_re.pattern)]
+        if len(mergeable) > 0:
+            try:
+                self.regex_prefilter = re.compile(
+                    "|".join("(?:{})".format(p) for p in sorted({p.contents_re.pattern for p in mergeable}))
+                )
+            except re.error as e:
+                logger.debug("Could not merge content search regexes, testing them one at a time: {}".format(e))
+            else:
+                for p in mergeable:
+                    p.prefiltered = True
+
+    def scan(self, f):
+        """Start searching a single file"""
+        return FileScan(self, f)
+
+
+class FileScan(object):
+    """Search state for a single file. The file is opened on the first content
+    search and read line by line. Every line read is checked against all content
+    patterns that could still match this file, so no line is read twice."""
+
+    def __init__(self, matcher, f):
+        self.matcher = matcher
+        self.f = f
+        self.path = os.path.join(f["root"], f["fn"])
+        self.fn_matches = matcher.fn_index.lookup(f["fn"])
+        self.is_binary = None
+        self.lines = None
+        self.fh = None
+        self.line_num = 0
+        self.results = dict()
+        self.pending_literals = defaultdict(list)
+        self.pending_regex = list()
+        self.expiry = defaultdict(list)
+        self.num_pending = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        if self.fh is not None:
+            self.fh.close()
+            self.fh = None
+
+    def patterns(self):
+        """Yield (search key, patterns) for the patterns that could match this file, in search order"""
+        candidates = heapq.merge(sorted(self.fn_matches), self.matcher.no_fn_patterns)
+        for key, ps in itertools.groupby(candidates, key=lambda p: p.key):
+            yield key, list(ps)
+
+    def match_fn(self, pattern):
+        """True / False if the filename matches, None if there is no filename pattern"""
+        if not pattern.has_fn:
+            return None
+        return pattern in self.fn_matches
+
+    def skip_binary(self):
+        """Use mimetypes to exclude binary files where possible"""
+        if self.is_binary is None:
+            self.is_binary = False
+            if not mqc_image_re.match(self.f["fn"]) and config.ignore_images:
+                (ftype, encoding) = mimetypes.guess_type(self.path)
+                if encoding is not None or (ftype is not None and ftype.startswith("image")):
+                    self.is_binary = True
+        return self.is_binary
+
+    def too_big(self, pattern):
+        """Search pattern specific filesize limit"""
+        return pattern.max_filesize is not None and "filesize" in self.f and self.f["filesize"] > pattern.max_filesize
+
+    def search(self, pattern, stats):
+        """Test this file against a single compiled search pattern.
+        Gives the same result as report.search_file()."""
+        if self.skip_binary():
+            return False
+
+        if self.too_big(pattern):
+            stats["skipped_module_specific_max_filesize"] += 1
+            return False
+
+        fn_matched = self.match_fn(pattern)
+        if not pattern.has_contents:
+            return fn_matched is True
+        if fn_matched is False:
+            return False
+
+        result = self.contents_result(pattern)
+        if result is None:
+            stats["skipped_file_contents_search_errors"] += 1
+            return False
+        return result
+
+    def contents_result(self, pattern):
+        """True / False if the file contents match, None if the file couldn't be read"""
+        if self.lines is None:
+            self.start()
+        while pattern not in self.results and self.num_pending > 0:
+            self.read_line()
+        return self.results.get(pattern, False)
+
+    def start(self):
+        """Open the file and queue up every content pattern that could match it"""
+        self.lines = iter(())
+        for p in self.matcher.content_patterns:
+            if self.too_big(p) or self.match_fn(p) is False:
+                continue
+            if p.contents is not None:
+                self.pending_literals[p.contents].append(p)
+            else:
+                self.pending_regex.append(p)
+            if p.num_lines is not None:
+                self.expiry[p.num_lines].append(p)
+            self.num_pending += 1
+        try:
+            self.fh = io.open(self.path, "r", encoding="utf-8")
+            self.lines = iter(self.fh)
+        except (IOError, OSError, ValueError, UnicodeDecodeError) as e:
+            self.read_error(e)
+
+    def read_line(self):
+        """Read the next line and check it against all pending content patterns"""
+        try:
+            line = next(self.lines, None)
+        # Can't read file - usually because it's a binary file and we're reading as utf-8
+        except (IOError, OSError, ValueError, UnicodeDecodeError) as e:
+            self.read_error(e)
+            return
+        if line is None:
+            self.resolve_all(False)
+            return
+        self.line_num += 1
+
+        # Search by file contents (string)
+        if len(self.pending_literals) > 0:
+            for needle in self.matcher.literals.find(line):
+                for p in self.pending_literals.get(needle, [])[:]:
+                    self.resolve(p, True)
+
+        # Search by file contents (regex)
+        if len(self.pending_regex) > 0:
+            prefilter = self.matcher.regex_prefilter
+            prefilter_hit = prefilter is None or prefilter.search(line) is not None
+            for p in self.pending_regex[:]:
+                if (prefilter_hit or not p.prefiltered) and p.contents_re.search(line):
+                    self.resolve(p, True)
+
+        # Stop searching for patterns that have seen enough lines
+        for p in self.expiry.pop(self.line_num, []):
+            if p not in self.results:
+                self.resolve(p, False)
+
+        if self.num_pending == 0:
+            self.close()
+
+    def read_error(self, e):
+        if config.report_readerrors:
+            logger.debug(f"Couldn't read file when looking for output: {self.path}, {e}")
+        self.resolve_all(None)
+
+    def resolve(self, p, result):
+        self.results[p] = result
+        if p.contents is not None:
+            self.pending_literals[p.contents].remove(p)
+            if len(self.pending_literals[p.contents]) == 0:
+                del self.pending_literals[p.contents]
+        else:
+            self.pending_regex.remove(p)
+        self.num_pending -= 1
+
+    def resolve_all(self, result):
+        for ps in list(self.pending_literals.values()):
+            for p in ps[:]:
+                self.resolve(p, result)
+        for p in self.pending_regex[:]:
+            self.resolve(p, result)
+        self.lines = iter(())
+        self.close()
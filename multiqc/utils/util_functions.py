@@ -40,6 +40,19 @@ def robust_rmtree(path, logger=None, max_retries=10):
     shutil.rmtree(path)
 
 
+def copy_tree(src, dst):
+    """
+    Copy the contents of a directory into another one, which may already exist.
+    Follows symlinks, and doesn't keep file modes and times to avoid problems
+    with mounted CIFS shares (see #625).
+    """
+    for root, dirs, files in os.walk(src, followlinks=True):
+        dst_root = os.path.normpath(os.path.join(dst, os.path.relpath(root, src)))
+        os.makedirs(dst_root, exist_ok=True)
+        for fn in files:
+            shutil.copyfile(os.path.join(root, fn), os.path.join(dst_root, fn))
+
+
 def write_data_file(data, fn, sort_cols=False, data_format=None):
     """Write a data file to the report directory. Will not do anything
     if config.data_dir is not set.
@@ -56,16 +69,6 @@ def write_data_file(data, fn, sort_cols=False, data_format=None):
         if data_format is None:
             data_format = config.data_format
 
-        # JSON encoder class to handle lambda functions
-        class MQCJSONEncoder(json.JSONEncoder):
-            def default(self, obj):
-                if callable(obj):
-                    try:
-                        return obj(1)
-                    except:
-                        return None
-                return json.JSONEncoder.default(self, obj)
-
         # Some metrics can't be coerced to tab-separated output, test and handle exceptions
         if data_format not in ["json", "yaml"]:
 
@@ -99,7 +102,7 @@ def write_data_file(data, fn, sort_cols=False, data_format=None):
         fn = "{}.{}".format(fn, config.data_format_extensions[data_format])
         with io.open(os.path.join(config.data_dir, fn), "w", encoding="utf-8") as f:
             if data_format == "json":
-                jsonstr = json.dumps(data, indent=4, cls=MQCJSONEncoder, ensure_ascii=False)
+                jsonstr = dump_json(data, indent=4, ensure_ascii=False)
                 print(jsonstr.encode("utf-8", "ignore").decode("utf-8"), file=f)
             elif data_format == "yaml":
                 yaml.dump(data, f, default_flow_style=False)
@@ -108,6 +111,74 @@ def write_data_file(data, fn, sort_cols=False, data_format=None):
                 print(body.encode("utf-8", "ignore").decode("utf-8"), file=f)
 
 
+class MQCJSONEncoder(json.JSONEncoder):
+    """
+    JSON encoder for MultiQC data. Writes NaN and Infinity as null: they are valid
+    JavaScript but invalid JSON, and crash the browser when parsing the JSON.
+    Lambda functions (eg. header modify functions) are called with 1.
+    """
+
+    def default(self, obj):
+        if callable(obj):
+            try:
+                return replace_nan(obj(1))
+            except:
+                return None
+        return json.JSONEncoder.default(self, obj)
+
+    def iterencode(self, o, _one_shot=False):
+        if not hasattr(json.encoder, "_make_iterencode"):
+            # Private to the json module, so replace NaN and Infinity in a copy of the data if it's not there
+            return json.JSONEncoder.iterencode(self, replace_nan(o), _one_shot)
+
+        def floatstr(f):
+            if f != f or f in (float("inf"), float("-inf")):
+                return "null"
+            return float.__repr__(f)
+
+        markers = {} if self.check_circular else None
+        if self.ensure_ascii:
+            encoder = json.encoder.encode_basestring_ascii
+        else:
+            encoder = json.encoder.encode_basestring
+        # The C encoder can't change how floats are written, so always use the Python encoder
+        iterencode = json.encoder._make_iterencode(
+            markers,
+            self.default,
+            encoder,
+            self.indent,
+            floatstr,
+            self.key_separator,
+            self.item_separator,
+            self.sort_keys,
+            self.skipkeys,
+            _one_shot,
+        )
+        return iterencode(o, 0)
+
+
+def replace_nan(obj):
+    """Copy of a data structure with NaN and Infinity floats replaced by None"""
+    if isinstance(obj, float):
+        return None if obj != obj or obj in (float("inf"), float("-inf")) else obj
+    if isinstance(obj, dict):
+        return {k: replace_nan(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [replace_nan(v) for v in obj]
+    return obj
+
+
+def dump_json(data, **kwargs):
+    """
+    Same as json.dumps() with MQCJSONEncoder. Tries the much faster C encoder first,
+    which only works if there are no NaN / Infinity values or lambda functions.
+    """
+    try:
+        return json.dumps(data, allow_nan=False, **kwargs)
+    except (ValueError, TypeError):
+        return json.dumps(data, cls=MQCJSONEncoder, **kwargs)
+
+
 def view_all_tags(ctx, param, value):
     """List available tags and associated modules
     Called by eager click option: --view-tags
@@ -55,6 +55,7 @@ setup(
         "click",
         "coloredlogs",
         "future>0.14.0",
+        "importlib-metadata; python_version < '3.8'",
         "jinja2>=3.0.0",
         "lzstring",
         "markdown",
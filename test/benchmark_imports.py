@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+
+""" Import time benchmark for MultiQC, using python -X importtime. Lists the slowest
+imports when MultiQC starts and when the plotting functions are loaded, and fails if
+libraries that should only be loaded on first use (matplotlib, numpy, spectra) are
+imported too early. The same checks are run as tests in test_imports.py. """
+
+import argparse
+import re
+import subprocess
+import sys
+
+# Import statement, and the libraries that it must not load
+checks = [
+    ("MultiQC startup", "import multiqc.multiqc", ["matplotlib", "numpy", "spectra"]),
+    (
+        "Plot functions",
+        "from multiqc.plots import bargraph, beeswarm, boxplot, heatmap, linegraph, scatter, table",
+        ["matplotlib", "numpy", "spectra"],
+    ),
+]
+
+importtime_re = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+
+
+def import_times(statement):
+    """Run the import statement in a new Python process. Returns the cumulative time in
+    microseconds for each imported module, and the total time for the statement."""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        check=True,
+    )
+    times = dict()
+    total = 0
+    for line in proc.stderr.splitlines():
+        m = importtime_re.match(line)
+        if m:
+            cumulative, indent, name = int(m.group(2)), len(m.group(3)), m.group(4)
+            times[name] = cumulative
+            # Imports by the statement itself have the smallest indent
+            if indent == 1:
+                total += cumulative
+    return times, total
+
+
+def lazy_libs_imported(times, lazy_libs):
+    """Libraries that were imported although they should only be loaded on first use"""
+    return [lib for lib in lazy_libs if lib in times]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time imports when starting MultiQC")
+    parser.add_argument("--repeats", type=int, default=3, help="Number of times to run each import")
+    parser.add_argument("--top", type=int, default=10, help="Number of slowest packages to list")
+    args = parser.parse_args()
+    if sys.version_info < (3, 7):
+        print("Skipping import time checks: python -X importtime needs Python 3.7 or newer")
+        sys.exit(0)
+
+    failed = False
+    for title, statement, lazy_libs in checks:
+        runs = [import_times(statement) for _ in range(args.repeats)]
+        times, total = min(runs, key=lambda run: run[1])
+        print("{}: {:.0f} ms  ({})".format(title, total / 1000, statement))
+        packages = sorted(((t, name) for name, t in times.items() if "." not in name), reverse=True)
+        for t, name in packages[: args.top]:
+            print("    {:>8.1f} ms  {}".format(t / 1000, name))
+        for lib in lazy_libs_imported(times, lazy_libs):
+            print(
+                "ERROR: '{}' imported {}, it should only be loaded when it's used".format(lib, title.lower()),
+                file=sys.stderr,
+            )
+            failed = True
+        print()
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
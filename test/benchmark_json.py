@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+
+""" Microbenchmark for writing report plot data as JSON: the previous json.dumps()
+followed by a regex replacement of NaN / Infinity, against MultiQC's JSON encoder
+which writes them as null while encoding. """
+
+import argparse
+import json
+import random
+import re
+import time
+
+from multiqc.utils import report
+
+parser = argparse.ArgumentParser(description="Time JSON encoding of a large synthetic plot_data")
+parser.add_argument("--samples", type=int, default=2000, help="Number of samples in each plot")
+parser.add_argument("--points", type=int, default=200, help="Number of points per sample")
+parser.add_argument("--plots", type=int, default=10, help="Number of plots")
+parser.add_argument("--nan-fraction", type=float, default=0.0001, help="Fraction of NaN / Infinity values")
+parser.add_argument("--repeats", type=int, default=3, help="Number of times to run each encoder")
+args = parser.parse_args()
+
+
+def sanitise_json(json_string):
+    """The regex replacement previously used by report.compress_json()"""
+    json_string = re.sub(r"\bNaN\b", "null", json_string)
+    json_string = re.sub(r"\b-?Infinity\b", "null", json_string)
+    return json_string
+
+
+def regex_encode(data):
+    return sanitise_json(json.dumps(data))
+
+
+def chunked_encode(data):
+    return "".join(report.json_chunks(data))
+
+
+def make_plot_data():
+    random.seed(1)
+    nonfinite = [float("nan"), float("inf"), float("-inf")]
+    plot_data = dict()
+    for p in range(args.plots):
+        dataset = dict()
+        for s in range(args.samples):
+            dataset["sample_{}".format(s)] = {
+                i: random.choice(nonfinite) if random.random() < args.nan_fraction else random.random() * 1000
+                for i in range(args.points)
+            }
+        plot_data["plot_{}".format(p)] = {"plot_type": "xy_line", "datasets": [dataset]}
+    # Only the first plot has non-finite values, as is usual in real reports
+    for p in range(1, args.plots):
+        for samp in plot_data["plot_{}".format(p)]["datasets"][0].values():
+            for i, v in samp.items():
+                if v != v or v in nonfinite:
+                    samp[i] = 0.0
+    return plot_data
+
+
+def is_valid_json(json_string):
+    def no_constants(name):
+        raise ValueError("Invalid JSON constant: {}".format(name))
+
+    try:
+        json.loads(json_string, parse_constant=no_constants)
+    except ValueError:
+        return False
+    return True
+
+
+plot_data = make_plot_data()
+print("JSON size: {:.1f} MB".format(len(json.dumps(plot_data)) / 1e6))
+
+for name, encode in [("json.dumps + regex", regex_encode), ("MultiQC JSON encoder", chunked_encode)]:
+    # The regex turns -Infinity into -null, which is not valid JSON
+    print("{:<22} valid JSON: {}".format(name, is_valid_json(encode(plot_data))))
+    times = list()
+    for _ in range(args.repeats):
+        start = time.perf_counter()
+        encode(plot_data)
+        times.append(time.perf_counter() - start)
+    print("{:<22} best {:.3f}s  mean {:.3f}s".format(name, min(times), sum(times) / len(times)))
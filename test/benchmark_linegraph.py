@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+
+""" Microbenchmark for building line graph series: the previous per-point loop, which
+sorted and parsed the x and y values again for every limit, against the NumPy-based
+linegraph.series_pairs() """
+
+import argparse
+import random
+import time
+
+from multiqc.plots import linegraph
+
+parser = argparse.ArgumentParser(description="Time building line graph series for a large synthetic dataset")
+parser.add_argument("--samples", type=int, default=1000, help="Number of samples")
+parser.add_argument("--points", type=int, default=1000, help="Number of points per sample")
+parser.add_argument("--repeats", type=int, default=3, help="Number of times to run each builder")
+args = parser.parse_args()
+
+series_config = {"xmin": 10, "xmax": args.points - 10, "ymin": 0, "ymax": 90}
+
+
+def loop_pairs(d, series_config):
+    """The series builder previously in linegraph.plot()"""
+    pairs = list()
+    discard_ymax = None
+    discard_ymin = None
+    for k in sorted(d.keys()):
+        if "xmax" in series_config and float(k) > float(series_config["xmax"]):
+            continue
+        if "xmin" in series_config and float(k) < float(series_config["xmin"]):
+            continue
+        if d[k] is not None and "ymax" in series_config:
+            if float(d[k]) > float(series_config["ymax"]):
+                discard_ymax = True
+            elif discard_ymax is True:
+                discard_ymax = False
+        if d[k] is not None and "ymin" in series_config:
+            if float(d[k]) > float(series_config["ymin"]):
+                discard_ymin = True
+            elif discard_ymin is True:
+                discard_ymin = False
+    for k in sorted(d.keys()):
+        if k is not None:
+            if "xmax" in series_config and float(k) > float(series_config["xmax"]):
+                continue
+            if "xmin" in series_config and float(k) < float(series_config["xmin"]):
+                continue
+        if d[k] is not None:
+            if "ymax" in series_config and float(d[k]) > float(series_config["ymax"]) and discard_ymax is not False:
+                continue
+            if "ymin" in series_config and float(d[k]) < float(series_config["ymin"]) and discard_ymin is not False:
+                continue
+        pairs.append([k, d[k]])
+    return pairs
+
+
+def make_data():
+    random.seed(1)
+    data = dict()
+    for s in range(args.samples):
+        data["sample_{}".format(s)] = {
+            i: None if random.random() < 0.01 else random.random() * 100 for i in range(args.points)
+        }
+    return data
+
+
+data = make_data()
+builders = [("per-point loop", loop_pairs), ("linegraph.series_pairs", linegraph.series_pairs)]
+results = [[build(d, series_config) for d in data.values()] for _, build in builders]
+print("Same series: {}".format(results[0] == results[1]))
+
+for name, build in builders:
+    times = list()
+    for _ in range(args.repeats):
+        start = time.perf_counter()
+        for d in data.values():
+            build(d, series_config)
+        times.append(time.perf_counter() - start)
+    print("{:<24} best {:.3f}s  mean {:.3f}s".format(name, min(times), sum(times) / len(times)))
@@ -0,0 +1,16 @@
+#!/usr/bin/env python
+
+""" Tests that MultiQC only loads slow libraries when they are first used. """
+
+import sys
+
+import pytest
+
+from benchmark_imports import checks, import_times, lazy_libs_imported
+
+
+@pytest.mark.skipif(sys.version_info < (3, 7), reason="python -X importtime needs Python 3.7")
+@pytest.mark.parametrize("title, statement, lazy_libs", checks, ids=[c[0] for c in checks])
+def test_lazy_imports(title, statement, lazy_libs):
+    times, _ = import_times(statement)
+    assert lazy_libs_imported(times, lazy_libs) == [], "Imported {}".format(title.lower())
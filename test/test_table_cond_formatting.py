@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+
+""" Tests for the table conditional formatting rules, checked against the
+per-cell code that make_table() used before the rules were compiled. """
+
+import itertools
+import logging
+
+import pytest
+
+from multiqc.plots.table import compile_cond_formatting
+
+logger = logging.getLogger("multiqc.plots.table")
+
+COLOURS = [{"pass": "#5cb85c"}, {"warn": "#f0ad4e"}, {"fail": "#d9534f"}]
+COMPARATORS = ["s_eq", "s_contains", "s_ne", "eq", "ne", "gt", "lt"]
+RULE_VALUES = [10, 10.0, "10", "1e1", 0, -5, "abc", "ABC", "b", "", None, "nan"]
+CELL_VALUES = [10, 10.0, 9.99, "10", 100, 0, -5, "abc", "aBc", "xAbCx", "B", "", None, True, float("nan")]
+
+
+def reference_badge_colour(val, rules, colours, rule_keys):
+    """Badge colour from the per-cell code in make_table() before the rules were compiled"""
+    cmatches = {}
+    for cfc in colours:
+        for cfck in cfc:
+            cmatches[cfck] = False
+    for cfk in rule_keys:
+        if cfk in rules:
+            for ftype in cmatches.keys():
+                for cmp in rules[cfk].get(ftype, []):
+                    try:
+                        if "s_eq" in cmp and str(cmp["s_eq"]).lower() == str(val).lower():
+                            cmatches[ftype] = True
+                        if "s_contains" in cmp and str(cmp["s_contains"]).lower() in str(val).lower():
+                            cmatches[ftype] = True
+                        if "s_ne" in cmp and str(cmp["s_ne"]).lower() != str(val).lower():
+                            cmatches[ftype] = True
+                        if "eq" in cmp and float(cmp["eq"]) == float(val):
+                            cmatches[ftype] = True
+                        if "ne" in cmp and float(cmp["ne"]) != float(val):
+                            cmatches[ftype] = True
+                        if "gt" in cmp and float(cmp["gt"]) < float(val):
+                            cmatches[ftype] = True
+                        if "lt" in cmp and float(cmp["lt"]) > float(val):
+                            cmatches[ftype] = True
+                    except:
+                        logger.warning("Not able to apply table conditional formatting to '{}' ({})".format(val, cmp))
+    badge_col = None
+    for cfc in colours:
+        for cfck in cfc:
+            if cmatches[cfck]:
+                badge_col = cfc[cfck]
+    return badge_col
+
+
+def assert_same_as_reference(caplog, rules, rule_keys, values, colours=COLOURS):
+    badge_colour = compile_cond_formatting(rules, colours, rule_keys)
+    for val in values:
+        caplog.clear()
+        expected = reference_badge_colour(val, rules, colours, rule_keys)
+        expected_warnings = len(caplog.records)
+        caplog.clear()
+        assert badge_colour(val) == expected, "value {!r} with rules {}".format(val, rules)
+        assert len(caplog.records) == expected_warnings, "warnings for value {!r} with rules {}".format(val, rules)
+
+
+@pytest.mark.parametrize("key", COMPARATORS)
+@pytest.mark.parametrize("rule_val", RULE_VALUES)
+def test_single_comparator(caplog, key, rule_val):
+    rules = {"col": {"fail": [{key: rule_val}]}}
+    assert_same_as_reference(caplog, rules, ["all_columns", "col", "table"], CELL_VALUES)
+
+
+@pytest.mark.parametrize("keys", list(itertools.combinations(COMPARATORS, 2)))
+def test_combined_comparators(caplog, keys):
+    # Several comparisons in one dict: a failing numeric one keeps earlier string matches
+    for rule_vals in itertools.product(["abc", 10, "x"], repeat=2):
+        rules = {"col": {"warn": [dict(zip(keys, rule_vals))]}}
+        assert_same_as_reference(caplog, rules, ["all_columns", "col", "table"], CELL_VALUES)
+
+
+def test_comparators():
+    def colour(key, rule_val, val):
+        return compile_cond_formatting({"col": {"pass": [{key: rule_val}]}}, COLOURS, ["col"])(val)
+
+    assert colour("s_eq", "PASS", "pass") == "#5cb85c"
+    assert colour("s_eq", "pass", "passed") is None
+    assert colour("s_contains", "Err", "some ERROR") == "#5cb85c"
+    assert colour("s_contains", "err", "fine") is None
+    assert colour("s_ne", "FAIL", "fail") is None
+    assert colour("s_ne", "fail", "pass") == "#5cb85c"
+    assert colour("eq", "10", 10.0) == "#5cb85c"
+    assert colour("eq", 10, "10.5") is None
+    assert colour("ne", 10, 11) == "#5cb85c"
+    assert colour("ne", 10, "10") is None
+    assert colour("gt", 10, 10.5) == "#5cb85c"
+    assert colour("gt", 10, 10) is None
+    assert colour("lt", 10, 9) == "#5cb85c"
+    assert colour("lt", 10, 10) is None
+
+
+def test_not_a_number(caplog):
+    # Numeric comparisons with a value or rule that is not a number do not match and warn
+    badge_colour = compile_cond_formatting({"col": {"fail": [{"gt": 10}]}}, COLOURS, ["col"])
+    assert badge_colour("abc") is None
+    assert len(caplog.records) == 1
+    caplog.clear()
+    badge_colour = compile_cond_formatting({"col": {"fail": [{"lt": "abc"}]}}, COLOURS, ["col"])
+    assert badge_colour(5) is None
+    assert len(caplog.records) == 1
+
+
+def test_rule_precedence(caplog):
+    # Rules for all columns, the column and the table all apply; the last matching colour wins
+    rules = {
+        "all_columns": {"pass": [{"gt": 0}], "fail": [{"lt": 5}]},
+        "col": {"warn": [{"s_eq": "3"}], "pass": [{"s_contains": "x"}]},
+        "other_col": {"fail": [{"gt": -100}]},
+        "table": {"warn": [{"eq": 7}], "fail": [{"s_eq": "7"}]},
+    }
+    rule_keys = ["all_columns", "col", "table"]
+    badge_colour = compile_cond_formatting(rules, COLOURS, rule_keys)
+    assert badge_colour(10) == "#5cb85c"
+    assert badge_colour(3) == "#d9534f"
+    assert badge_colour(7) == "#d9534f"
+    assert badge_colour(-1) == "#d9534f"
+    assert badge_colour("x") == "#5cb85c"
+    assert_same_as_reference(caplog, rules, rule_keys, CELL_VALUES + [3, 7, "3", "7"])
+
+    # Colours listed later take precedence, whichever rule key matched
+    colours = [{"fail": "red"}, {"warn": "orange"}, {"pass": "green"}]
+    badge_colour = compile_cond_formatting(rules, colours, rule_keys)
+    assert badge_colour(3) == "green"
+    assert badge_colour(7) == "green"
+    assert badge_colour(-1) == "red"
+    assert badge_colour("-7") == "red"
+    assert_same_as_reference(caplog, rules, rule_keys, CELL_VALUES + [3, 7, "3", "7"], colours)
+
+
+def test_no_rules():
+    assert compile_cond_formatting({}, COLOURS, ["all_columns", "col", "table"])(10) is None
+    assert compile_cond_formatting({"other_col": {"fail": [{"gt": 0}]}}, COLOURS, ["col"])(10) is None
+    assert compile_cond_formatting({"col": {"fail": [{"gt": 0}]}}, [], ["col"])(10) is None
+    # Formatting types without a colour are ignored
+    assert compile_cond_formatting({"col": {"other": [{"gt": 0}]}}, COLOURS, ["col"])(10) is None
+
+
+@pytest.mark.parametrize("cmp", [5, "s_eq: pass", None, ["gt", 5]])
+def test_malformed_rules(caplog, cmp):
+    # Comparisons that are not dicts are skipped with a warning instead of raising an error
+    rules = {"all_columns": {"warn": [cmp]}, "col": {"fail": [{"s_eq": "pass"}]}}
+    badge_colour = compile_cond_formatting(rules, COLOURS, ["all_columns", "col"])
+    assert badge_colour("pass") == "#d9534f"
+    assert len(caplog.records) == 1
+    assert "Not able to apply table conditional formatting to 'pass'" in caplog.records[0].getMessage()
+    caplog.clear()
+    assert badge_colour(5) is None
+    assert len(caplog.records) == 1
+    assert_same_as_reference(caplog, rules, ["all_columns", "col"], CELL_VALUES)